@@ -0,0 +1,155 @@
+# Copyright (c) 2026, Mohamed AbdElsabour and contributors
+# For license information, please see license.txt
+
+"""
+قياس ذروة الذاكرة وعدد الاستعلامات لمراجع سندات الصرف في كشف حساب العميل:
+الطريقة القديمة (تحميل جدول Payment Entry Reference كاملاً) مقابل الاستعلام على دفعات
+لسندات الكشف فقط (get_payment_references)، مع أحجام مختلفة للجدول.
+
+أداة تطوير مستقلة (خارج حزمة التطبيق) تعمل على SQLite في الذاكرة بنفس شكل الاستعلامين:
+    python benchmarks/payment_references.py --sizes 10000 100000 500000 --statement-payments 200
+"""
+
+import argparse
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+# نفس PAYMENT_REFERENCES_CHUNK_SIZE في customer_statement_report.py
+PAYMENT_REFERENCES_CHUNK_SIZE = 1000
+
+REFERENCES_PER_PAYMENT = 2
+
+
+def build_table(payments):
+    connection = sqlite3.connect(":memory:")
+    connection.row_factory = sqlite3.Row
+    connection.execute(
+        """
+        CREATE TABLE `tabPayment Entry Reference` (
+            name TEXT PRIMARY KEY,
+            parent TEXT,
+            parenttype TEXT,
+            docstatus INTEGER,
+            reference_doctype TEXT,
+            reference_name TEXT
+        )
+    """
+    )
+    connection.execute("CREATE INDEX parent ON `tabPayment Entry Reference` (parent)")
+    connection.executemany(
+        "INSERT INTO `tabPayment Entry Reference` VALUES (?, ?, 'Payment Entry', 1, 'Sales Invoice', ?)",
+        (
+            (
+                "ref-{0}-{1}".format(payment, reference),
+                "ACC-PAY-{0:07d}".format(payment),
+                "ACC-SINV-{0:07d}".format(payment * REFERENCES_PER_PAYMENT + reference),
+            )
+            for payment in range(payments)
+            for reference in range(REFERENCES_PER_PAYMENT)
+        ),
+    )
+    return connection
+
+
+def get_all_payment_references(connection, _payment_entries):
+    """الطريقة السابقة: كل المراجع المعتمدة في كل تشغيل"""
+    references = {}
+    cursor = connection.execute(
+        """
+        SELECT parent, reference_doctype, reference_name
+        FROM `tabPayment Entry Reference`
+        WHERE docstatus = 1
+    """
+    )
+    for ref in cursor.fetchall():
+        references.setdefault(ref["parent"], []).append(dict(ref))
+
+    return references, 1
+
+
+def get_chunked_payment_references(connection, payment_entries):
+    """نفس get_payment_references: مراجع سندات الكشف فقط على دفعات parent IN"""
+    references = {}
+    queries = 0
+    for start in range(0, len(payment_entries), PAYMENT_REFERENCES_CHUNK_SIZE):
+        chunk = payment_entries[start : start + PAYMENT_REFERENCES_CHUNK_SIZE]
+        cursor = connection.execute(
+            """
+            SELECT parent, reference_doctype, reference_name
+            FROM `tabPayment Entry Reference`
+            WHERE docstatus = 1
+                AND parenttype = 'Payment Entry'
+                AND parent IN ({0})
+        """.format(
+                ", ".join("?" * len(chunk))
+            ),
+            chunk,
+        )
+        queries += 1
+        for ref in cursor.fetchall():
+            references.setdefault(ref["parent"], []).append(dict(ref))
+
+    return references, queries
+
+
+def measure(method, connection, payment_entries):
+    tracemalloc.start()
+    start = time.perf_counter()
+    references, queries = method(connection, payment_entries)
+    seconds = time.perf_counter() - start
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return references, queries, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 500000])
+    parser.add_argument("--statement-payments", type=int, default=200)
+    args = parser.parse_args()
+
+    print("payments_in_table  path     queries  peak_kib   seconds")
+    failed = False
+
+    for size in args.sizes:
+        connection = build_table(size)
+        # سندات الكشف موزعة على الجدول
+        step = max(size // args.statement_payments, 1)
+        payment_entries = ["ACC-PAY-{0:07d}".format(i) for i in range(0, size, step)][
+            : args.statement_payments
+        ]
+
+        old_refs, old_queries, old_seconds, old_peak = measure(
+            get_all_payment_references, connection, payment_entries
+        )
+        new_refs, new_queries, new_seconds, new_peak = measure(
+            get_chunked_payment_references, connection, payment_entries
+        )
+
+        expected_queries = -(-len(payment_entries) // PAYMENT_REFERENCES_CHUNK_SIZE)
+        same_references = all(
+            old_refs.get(payment) == new_refs.get(payment) for payment in payment_entries
+        )
+        if new_queries != expected_queries or not same_references:
+            failed = True
+
+        for path, queries, peak, seconds in (
+            ("old", old_queries, old_peak, old_seconds),
+            ("chunked", new_queries, new_peak, new_seconds),
+        ):
+            print(
+                "{0:>17}  {1:<7}  {2:>7}  {3:>8.0f}  {4:>8.3f}".format(
+                    size, path, queries, peak / 1024, seconds
+                )
+            )
+
+        connection.close()
+
+    if failed:
+        sys.exit("chunked path returned different references or an unexpected query count")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import click
+from frappe.commands import pass_context
+from frappe.exceptions import SiteNotSpecifiedError
+
+
+@click.command("rebuild-vat-period-ledger")
+@click.option("--company", help="Rebuild only this company's rows")
+@pass_context
+def rebuild_vat_period_ledger(context, company=None):
+    "Rebuild the VAT Period Ledger from submitted Sales and Purchase Invoices"
+    import frappe
+
+    from muzaini_app.muzaini_app.doctype.vat_period_ledger.vat_period_ledger import (
+        rebuild_vat_period_ledger as rebuild,
+    )
+
+    for site in context.sites:
+        try:
+            frappe.init(site=site)
+            frappe.connect()
+            rebuild(company)
+            frappe.db.commit()
+        finally:
+            frappe.destroy()
+
+    if not context.sites:
+        raise SiteNotSpecifiedError
+
+
+@click.command("rebuild-party-balance-checkpoints")
+@click.option("--company", help="Rebuild only this company's rows")
+@pass_context
+def rebuild_party_balance_checkpoints(context, company=None):
+    "Rebuild the monthly Party Balance Checkpoints from the General Ledger"
+    import frappe
+
+    from muzaini_app.muzaini_app.doctype.party_balance_checkpoint.party_balance_checkpoint import (
+        rebuild_party_balance_checkpoints as rebuild,
+    )
+
+    for site in context.sites:
+        try:
+            frappe.init(site=site)
+            frappe.connect()
+            rebuild(company)
+            frappe.db.commit()
+        finally:
+            frappe.destroy()
+
+    if not context.sites:
+        raise SiteNotSpecifiedError
+
+
+commands = [rebuild_vat_period_ledger, rebuild_party_balance_checkpoints]
@@ -64,6 +64,11 @@ app_license = "mit"
 # 	"Role": "home_page"
 # }
 
+# صفحة كشف الحساب في بوابة العملاء
+portal_menu_items = [
+	{"title": "كشف الحساب", "route": "/customer_statement", "role": "Customer"},
+]
+
 # Generators
 # ----------
 
@@ -137,34 +142,47 @@ app_license = "mit"
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-# 	"*": {
-# 		"on_update": "method",
-# 		"on_cancel": "method",
-# 		"on_trash": "method"
-# 	}
-# }
+doc_events = {
+	"Account": {
+		"after_insert": "muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_report.clear_tax_accounts_cache",
+		"on_update": "muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_report.clear_tax_accounts_cache",
+		"after_rename": "muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_report.clear_tax_accounts_cache",
+		"on_trash": "muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_report.clear_tax_accounts_cache",
+	},
+	"Sales Invoice": {
+		"on_submit": "muzaini_app.muzaini_app.doctype.vat_period_ledger.vat_period_ledger.update_for_invoice",
+		"on_cancel": "muzaini_app.muzaini_app.doctype.vat_period_ledger.vat_period_ledger.update_for_invoice",
+	},
+	"Purchase Invoice": {
+		"on_submit": "muzaini_app.muzaini_app.doctype.vat_period_ledger.vat_period_ledger.update_for_invoice",
+		"on_cancel": "muzaini_app.muzaini_app.doctype.vat_period_ledger.vat_period_ledger.update_for_invoice",
+	},
+	"GL Entry": {
+		"on_submit": [
+			"muzaini_app.muzaini_app.doctype.party_balance_checkpoint.party_balance_checkpoint.update_for_gl_entry",
+			"muzaini_app.muzaini_app.report.customer_statement_report.customer_statement_report.clear_receivable_accounts_for_gl_entry",
+			"muzaini_app.templates.pages.customer_statement.clear_portal_statement_cache",
+		],
+	},
+	"Customer": {
+		"on_update": "muzaini_app.muzaini_app.report.customer_statement_report.customer_statement_report.clear_receivable_accounts_cache",
+		"after_rename": "muzaini_app.muzaini_app.report.customer_statement_report.customer_statement_report.clear_receivable_accounts_cache",
+		"on_trash": "muzaini_app.muzaini_app.report.customer_statement_report.customer_statement_report.clear_receivable_accounts_cache",
+	},
+}
 
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-# 	"all": [
-# 		"muzaini_app.tasks.all"
-# 	],
-# 	"daily": [
-# 		"muzaini_app.tasks.daily"
-# 	],
-# 	"hourly": [
-# 		"muzaini_app.tasks.hourly"
-# 	],
-# 	"weekly": [
-# 		"muzaini_app.tasks.weekly"
-# 	],
-# 	"monthly": [
-# 		"muzaini_app.tasks.monthly"
-# 	],
-# }
+scheduler_events = {
+	"hourly": [
+		"muzaini_app.muzaini_app.doctype.party_balance_checkpoint.party_balance_checkpoint.sync_changed_checkpoints"
+	],
+	"daily": [
+		"muzaini_app.muzaini_app.doctype.vat_declaration_snapshot.vat_declaration_snapshot.check_frozen_declarations",
+		"muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_export.delete_old_exports",
+	],
+}
 
 # Testing
 # -------
@@ -0,0 +1,326 @@
+# Copyright (c) 2026, Mohamed AbdElsabour and contributors
+# For license information, please see license.txt
+
+import hashlib
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_to_date, flt, get_first_day, get_last_day, getdate, now
+
+# تاريخ آخر إعادة بناء لكل شركة (لا تُستخدم نقاط شركة في التقارير قبل بنائها لها)
+CHECKPOINTS_REBUILT_ON_KEY = "party_balance_checkpoints_rebuilt_on"
+
+PARTY_TYPES = ("Customer", "Supplier")
+
+# آخر مزامنة للأشهر التي تغيرت حركاتها (إعادة الترحيل تحذف قيود الأستاذ وتعيد إنشاءها)
+CHECKPOINTS_SYNCED_ON_KEY = "party_balance_checkpoints_synced_on"
+
+# تداخل بين المزامنات لتغطية القيود التي أُنشئت قبل المزامنة واعتُمدت بعدها
+CHECKPOINTS_SYNC_OVERLAP_MINUTES = 15
+
+CHECKPOINTS_SYNC_CHUNK_SIZE = 500
+
+
+class PartyBalanceCheckpoint(Document):
+    pass
+
+
+def get_checkpoint_ready_key(company):
+    return "{0}:{1}".format(CHECKPOINTS_REBUILT_ON_KEY, company)
+
+
+def is_checkpoint_ready(company):
+    return bool(company and frappe.db.get_default(get_checkpoint_ready_key(company)))
+
+
+def get_checkpoint_name(company, posting_month, party_type, party, account):
+    """اسم ثابت لكل (شركة، شهر، طرف، حساب) حتى يمكن التحديث بالإضافة (upsert)"""
+    key = "|".join(
+        str(value or "") for value in (company, posting_month, party_type, party, account)
+    )
+    return hashlib.md5(key.encode("utf-8")).hexdigest()
+
+
+def update_for_gl_entry(doc, method=None):
+    """
+    إضافة حركة الأستاذ العام إلى حركة الشهر للطرف والحساب.
+    قيود عكس الإلغاء تُعتمد كقيود جديدة بمبالغ معكوسة فيصبح صافي المستند المُلغى صفراً.
+    """
+    if doc.party_type not in PARTY_TYPES or not doc.party:
+        return
+
+    posting_month = get_first_day(doc.posting_date)
+    timestamp = now()
+
+    frappe.db.sql(
+        """
+        INSERT INTO `tabParty Balance Checkpoint`
+            (name, creation, modified, owner, modified_by, docstatus, idx,
+            company, posting_month, party_type, party, account, debit, credit)
+        VALUES
+            (%(name)s, %(timestamp)s, %(timestamp)s, %(user)s, %(user)s, 0, 0,
+            %(company)s, %(posting_month)s, %(party_type)s, %(party)s, %(account)s,
+            %(debit)s, %(credit)s)
+        ON DUPLICATE KEY UPDATE
+            debit = debit + VALUES(debit),
+            credit = credit + VALUES(credit),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+    """,
+        {
+            "name": get_checkpoint_name(
+                doc.company, posting_month, doc.party_type, doc.party, doc.account
+            ),
+            "timestamp": timestamp,
+            "user": frappe.session.user,
+            "company": doc.company,
+            "posting_month": posting_month,
+            "party_type": doc.party_type,
+            "party": doc.party,
+            "account": doc.account,
+            "debit": flt(doc.debit),
+            "credit": flt(doc.credit),
+        },
+    )
+
+
+def rebuild_party_balance_checkpoints(company=None):
+    """إعادة بناء حركات الأطراف الشهرية بالكامل من الأستاذ العام (داخل قاعدة البيانات)"""
+    conditions = ""
+    values = {"timestamp": now(), "user": frappe.session.user, "party_types": PARTY_TYPES}
+
+    if company:
+        frappe.db.delete("Party Balance Checkpoint", {"company": company})
+        conditions = "AND company = %(company)s"
+        values["company"] = company
+    else:
+        frappe.db.delete("Party Balance Checkpoint")
+
+    insert_checkpoints_from_gl(conditions, values)
+
+    # إعادة البناء الكاملة تشمل كل الشركات
+    for rebuilt_company in [company] if company else frappe.get_all("Company", pluck="name"):
+        frappe.db.set_default(get_checkpoint_ready_key(rebuilt_company), values["timestamp"])
+
+    if not frappe.db.get_default(CHECKPOINTS_SYNCED_ON_KEY):
+        frappe.db.set_default(CHECKPOINTS_SYNCED_ON_KEY, values["timestamp"])
+
+
+def insert_checkpoints_from_gl(conditions, values, replace_existing=False):
+    """
+    تجميع حركات الأستاذ العام حسب (الشركة، الشهر، الطرف، الحساب) داخل قاعدة البيانات.
+    مع replace_existing تُستبدل مجاميع النقاط الموجودة بدلاً من فشل الإدراج
+    """
+    on_duplicate = ""
+    if replace_existing:
+        on_duplicate = """ON DUPLICATE KEY UPDATE
+            debit = VALUES(debit),
+            credit = VALUES(credit),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)"""
+
+    # نفس صيغة get_checkpoint_name: md5 للقيم مفصولة بـ |
+    frappe.db.sql(
+        """
+        INSERT INTO `tabParty Balance Checkpoint`
+            (name, creation, modified, owner, modified_by, docstatus, idx,
+            company, posting_month, party_type, party, account, debit, credit)
+        SELECT
+            MD5(CONCAT_WS('|', company, posting_month, party_type, party, account)),
+            %(timestamp)s, %(timestamp)s, %(user)s, %(user)s, 0, 0,
+            company, posting_month, party_type, party, account,
+            SUM(debit), SUM(credit)
+        FROM (
+            SELECT
+                company,
+                DATE_FORMAT(posting_date, '%%Y-%%m-01') as posting_month,
+                party_type,
+                party,
+                account,
+                debit,
+                credit
+            FROM `tabGL Entry`
+            WHERE is_cancelled = 0
+                AND party_type IN %(party_types)s
+                AND party IS NOT NULL
+                AND party != ''
+                {conditions}
+        ) gl
+        GROUP BY
+            company, posting_month, party_type, party, account
+        {on_duplicate}
+    """.format(
+            conditions=conditions,
+            on_duplicate=on_duplicate,
+        ),
+        values,
+    )
+
+
+def sync_changed_checkpoints():
+    """
+    مهمة كل ساعة: إعادة تجميع أشهر الأطراف التي أُنشئت لها قيود منذ آخر مزامنة.
+    إعادة ترحيل المستندات (Repost Item Valuation / Repost Accounting Ledger) تحذف قيود
+    الأستاذ مباشرة وتعيد اعتمادها، فتُضاف حركتها مرتين؛ إعادة التجميع من الأستاذ تصحح ذلك.
+    """
+    synced_on = frappe.db.get_default(CHECKPOINTS_SYNCED_ON_KEY)
+    if not synced_on:
+        return
+
+    timestamp = now()
+    since = add_to_date(synced_on, minutes=-CHECKPOINTS_SYNC_OVERLAP_MINUTES)
+
+    changed = frappe.db.sql(
+        """
+        SELECT DISTINCT
+            company,
+            DATE_FORMAT(posting_date, '%%Y-%%m-01') as posting_month,
+            party_type,
+            party
+        FROM `tabGL Entry`
+        WHERE creation >= %(since)s
+            AND party_type IN %(party_types)s
+            AND party IS NOT NULL
+            AND party != ''
+    """,
+        {"since": since, "party_types": PARTY_TYPES},
+        as_dict=1,
+    )
+
+    parties_by_month = {}
+    for row in changed:
+        if is_checkpoint_ready(row.company):
+            parties_by_month.setdefault(
+                (row.company, getdate(row.posting_month), row.party_type), []
+            ).append(row.party)
+
+    for (company, posting_month, party_type), parties in parties_by_month.items():
+        for start in range(0, len(parties), CHECKPOINTS_SYNC_CHUNK_SIZE):
+            resync_checkpoints(
+                company,
+                posting_month,
+                party_type,
+                parties[start : start + CHECKPOINTS_SYNC_CHUNK_SIZE],
+                timestamp,
+            )
+
+    frappe.db.set_default(CHECKPOINTS_SYNCED_ON_KEY, timestamp)
+
+
+def resync_checkpoints(company, posting_month, party_type, parties, timestamp):
+    """
+    استبدال نقاط شهر لمجموعة أطراف بالمجاميع الحالية من الأستاذ العام بالإضافة مع الاستبدال
+    (upsert) حتى لا تتعارض مع update_for_gl_entry المتزامن، ثم حذف النقاط التي لم يعد لها قيود
+    (لم تُحدَّث في هذه المزامنة ولا بعدها)
+    """
+    values = {
+        "timestamp": timestamp,
+        "user": frappe.session.user,
+        "party_types": (party_type,),
+        "company": company,
+        "parties": tuple(parties),
+        "from_date": posting_month,
+        "to_date": get_last_day(posting_month),
+    }
+
+    insert_checkpoints_from_gl(
+        """AND company = %(company)s
+                AND party IN %(parties)s
+                AND posting_date BETWEEN %(from_date)s AND %(to_date)s""",
+        values,
+        replace_existing=True,
+    )
+
+    frappe.db.sql(
+        """
+        DELETE FROM `tabParty Balance Checkpoint`
+        WHERE company = %(company)s
+            AND posting_month = %(from_date)s
+            AND party_type IN %(party_types)s
+            AND party IN %(parties)s
+            AND modified < %(timestamp)s
+    """,
+        values,
+    )
+
+
+def get_checkpoint_balance(company, party_type, party, before_month, accounts=None):
+    """صافي حركات الطرف في كل الأشهر السابقة لـ before_month (من النقاط المجمّعة)"""
+    return get_checkpoint_balances(company, party_type, [party], before_month, accounts).get(
+        party, 0
+    )
+
+
+def get_checkpoint_balances(company, party_type, parties, before_month, accounts=None):
+    """نفس get_checkpoint_balance لعدة أطراف في استعلام واحد: {الطرف: الرصيد}"""
+    if not parties:
+        return {}
+
+    conditions = ""
+    values = {
+        "company": company,
+        "party_type": party_type,
+        "parties": tuple(parties),
+        "before_month": before_month,
+    }
+
+    if accounts:
+        conditions = "AND account IN %(accounts)s"
+        values["accounts"] = tuple(accounts)
+
+    balances = frappe.db.sql(
+        """
+        SELECT party, SUM(debit) - SUM(credit)
+        FROM `tabParty Balance Checkpoint`
+        WHERE company = %(company)s
+            AND party_type = %(party_type)s
+            AND party IN %(parties)s
+            AND posting_month < %(before_month)s
+            {conditions}
+        GROUP BY party
+    """.format(
+            conditions=conditions
+        ),
+        values,
+    )
+
+    return {party: flt(balance) for party, balance in balances}
+
+
+def get_party_opening_balance(company, party_type, party, to_date, accounts=None):
+    """
+    رصيد الطرف حتى تاريخ to_date (شاملاً): آخر نقطة شهرية + حركات الشهر الحالي فقط،
+    أو مسح كامل للأستاذ العام إذا لم يتم بناء النقاط بعد
+    """
+    to_date = getdate(to_date)
+    conditions = ""
+    values = {"company": company, "party_type": party_type, "party": party, "to_date": to_date}
+
+    if accounts:
+        conditions += " AND account IN %(accounts)s"
+        values["accounts"] = tuple(accounts)
+
+    balance = 0
+    if is_checkpoint_ready(company):
+        month_start = get_first_day(to_date)
+        balance = get_checkpoint_balance(company, party_type, party, month_start, accounts)
+        conditions += " AND posting_date >= %(month_start)s"
+        values["month_start"] = month_start
+
+    delta = frappe.db.sql(
+        """
+        SELECT SUM(debit) - SUM(credit)
+        FROM `tabGL Entry`
+        WHERE company = %(company)s
+            AND party_type = %(party_type)s
+            AND party = %(party)s
+            AND posting_date <= %(to_date)s
+            AND is_cancelled = 0
+            {conditions}
+    """.format(
+            conditions=conditions
+        ),
+        values,
+    )
+
+    return balance + (flt(delta[0][0]) if delta else 0)
@@ -0,0 +1,197 @@
+# Copyright (c) 2026, Mohamed AbdElsabour and contributors
+# For license information, please see license.txt
+
+import hashlib
+import json
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import getdate, now
+
+# الفلاتر التي تحدد محتوى الإقرار (أي اختلاف فيها يعني إقراراً مختلفاً)
+SNAPSHOT_FILTER_KEYS = (
+    "company",
+    "companies",
+    "from_date",
+    "to_date",
+    "cost_center",
+    "apportion_cost_center",
+    "compare_periods",
+    "tax_account",
+    "expense_voucher_types",
+    "rate_breakdown",
+)
+
+# المستندات التي تؤثر على أرقام الإقرار (إضافة لأنواع مستندات المصروفات في فلاتر الإقرار)
+DECLARATION_VOUCHER_TYPES = ("Sales Invoice", "Purchase Invoice", "Journal Entry", "Payment Entry")
+
+
+class VATDeclarationSnapshot(Document):
+    pass
+
+
+def get_filters_hash(filters):
+    key = {}
+    for fieldname in SNAPSHOT_FILTER_KEYS:
+        value = filters.get(fieldname)
+        if not value:
+            continue
+
+        if fieldname in ("from_date", "to_date"):
+            value = str(getdate(value))
+        elif isinstance(value, list):
+            value = sorted(value)
+
+        key[fieldname] = value
+
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_content_hash(data_json, summary_json):
+    """بصمة محتوى الإقرار كما هو محفوظ (نص JSON) للتحقق منه عند العرض"""
+    return hashlib.sha256((data_json + "\n" + summary_json).encode("utf-8")).hexdigest()
+
+
+def verify_content_hash(snapshot):
+    if snapshot.content_hash != get_content_hash(snapshot.data_json, snapshot.summary_json):
+        frappe.throw(
+            _("بيانات الإقرار المجمّد {0} لا تطابق بصمة المحتوى المحفوظة عند التجميد").format(
+                snapshot.name
+            )
+        )
+
+
+def get_frozen_declaration(filters):
+    """الإقرار المجمّد المطابق للفلاتر إن وجد (وضع المطابقة لا يُجمّد ولا يُعرض من النسخ المجمّدة)"""
+    if filters.get("reconcile"):
+        return None
+
+    return frappe.db.get_value(
+        "VAT Declaration Snapshot",
+        {"filters_hash": get_filters_hash(filters)},
+        [
+            "name",
+            "frozen_on",
+            "is_stale",
+            "content_hash",
+            "columns_json",
+            "data_json",
+            "summary_json",
+        ],
+        as_dict=1,
+    )
+
+
+@frappe.whitelist()
+def freeze_declaration(filters):
+    """حفظ نسخة ثابتة من الإقرار الحالي للشركة والفترة"""
+    from muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_report import (
+        check_report_permission,
+        execute,
+    )
+
+    check_report_permission()
+    frappe.has_permission("VAT Declaration Snapshot", "create", throw=True)
+
+    filters = frappe._dict(frappe.parse_json(filters))
+    if not filters.get("company") or not filters.get("from_date") or not filters.get("to_date"):
+        frappe.throw(_("يرجى تحديد الشركة والفترة قبل تجميد الإقرار"))
+
+    if filters.get("reconcile"):
+        frappe.throw(_("لا يمكن تجميد الإقرار في وضع المطابقة، يرجى إلغاء خيار المطابقة أولاً"))
+
+    if get_frozen_declaration(filters):
+        frappe.throw(_("تم تجميد الإقرار لهذه الفترة مسبقاً"))
+
+    filters.ignore_snapshot = 1
+    columns, data, _message, _chart, summary = execute(filters)
+    data_json = frappe.as_json(data)
+    summary_json = frappe.as_json(summary)
+
+    doc = frappe.get_doc(
+        {
+            "doctype": "VAT Declaration Snapshot",
+            "company": filters.company,
+            "from_date": filters.from_date,
+            "to_date": filters.to_date,
+            "frozen_by": frappe.session.user,
+            "frozen_on": now(),
+            "filters_hash": get_filters_hash(filters),
+            "content_hash": get_content_hash(data_json, summary_json),
+            "filters_json": frappe.as_json(
+                {key: filters.get(key) for key in SNAPSHOT_FILTER_KEYS if filters.get(key)}
+            ),
+            "columns_json": frappe.as_json(columns),
+            "data_json": data_json,
+            "summary_json": summary_json,
+        }
+    ).insert()
+
+    return doc.name
+
+
+def check_frozen_declarations():
+    """
+    مهمة يومية: البحث عن مستندات بتاريخ داخل فترة مجمّدة تم إنشاؤها أو تعديلها
+    بعد التجميد (أو بعد آخر فحص) وتمييز الإقرار بأنه يحتاج مراجعة
+    """
+    snapshots = frappe.get_all(
+        "VAT Declaration Snapshot",
+        filters={"is_stale": 0},
+        fields=["name", "company", "from_date", "to_date", "frozen_on", "last_checked_on", "filters_json"],
+    )
+
+    for snapshot in snapshots:
+        snapshot_filters = frappe.parse_json(snapshot.filters_json) or {}
+        companies = snapshot_filters.get("companies") or [snapshot.company]
+        voucher_types = list(DECLARATION_VOUCHER_TYPES)
+        voucher_types.extend(
+            voucher_type
+            for voucher_type in snapshot_filters.get("expense_voucher_types") or []
+            if voucher_type not in voucher_types
+        )
+        checked_on = now()
+
+        changed_vouchers = frappe.db.sql(
+            """
+            SELECT DISTINCT voucher_type, voucher_no
+            FROM `tabGL Entry`
+            WHERE company IN %(companies)s
+                AND posting_date BETWEEN %(from_date)s AND %(to_date)s
+                AND voucher_type IN %(voucher_types)s
+                AND modified > %(since)s
+            LIMIT 50
+        """,
+            {
+                "companies": tuple(companies),
+                "from_date": snapshot.from_date,
+                "to_date": snapshot.to_date,
+                "voucher_types": tuple(voucher_types),
+                "since": snapshot.last_checked_on or snapshot.frozen_on,
+            },
+            as_dict=1,
+        )
+
+        if not changed_vouchers:
+            frappe.db.set_value(
+                "VAT Declaration Snapshot",
+                snapshot.name,
+                "last_checked_on",
+                checked_on,
+                update_modified=False,
+            )
+            continue
+
+        stale_vouchers = "\n".join(
+            "{0}: {1}".format(row.voucher_type, row.voucher_no) for row in changed_vouchers
+        )
+        frappe.db.set_value(
+            "VAT Declaration Snapshot",
+            snapshot.name,
+            {"is_stale": 1, "stale_vouchers": stale_vouchers, "last_checked_on": checked_on},
+        )
+        frappe.get_doc("VAT Declaration Snapshot", snapshot.name).add_comment(
+            "Comment",
+            _("تم العثور على مستندات بتاريخ داخل الفترة المجمّدة بعد التجميد:") + "\n" + stale_vouchers,
+        )
@@ -0,0 +1,297 @@
+# Copyright (c) 2026, Mohamed AbdElsabour and contributors
+# For license information, please see license.txt
+
+import hashlib
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import flt, get_first_day, getdate, now
+
+from muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_report import (
+    get_tax_bucket,
+    get_tax_bucket_case,
+)
+
+# تاريخ آخر إعادة بناء للسجل لكل شركة (لا يُستخدم السجل لشركة قبل بنائه لها)
+LEDGER_REBUILT_ON_KEY = "vat_period_ledger_rebuilt_on"
+
+INVOICE_DOCTYPES = ("Sales Invoice", "Purchase Invoice")
+
+VALUE_FIELDS = ("base_grand_total", "base_net_total", "tax_amount")
+
+
+class VATPeriodLedger(Document):
+    pass
+
+
+def get_ledger_ready_key(company):
+    return "{0}:{1}".format(LEDGER_REBUILT_ON_KEY, company)
+
+
+def is_ledger_ready(companies):
+    """السجل جاهز فقط إذا تم بناؤه لكل الشركات المطلوبة"""
+    return bool(companies) and all(
+        frappe.db.get_default(get_ledger_ready_key(company)) for company in companies
+    )
+
+
+def get_ledger_name(company, posting_month, cost_center, invoice_doctype, is_return, is_taxable):
+    """اسم ثابت لكل مجموعة تجميع حتى يمكن التحديث بالإضافة (upsert)"""
+    key = "|".join(
+        str(value or "")
+        for value in (company, posting_month, cost_center, invoice_doctype, is_return, is_taxable)
+    )
+    return hashlib.md5(key.encode("utf-8")).hexdigest()
+
+
+def update_for_invoice(doc, method=None):
+    """تحديث السجل عند اعتماد أو إلغاء فاتورة مبيعات / مشتريات"""
+    bucket = get_tax_bucket(doc.is_return, doc.total_taxes_and_charges)
+    if not bucket:
+        return
+
+    sign = -1 if method == "on_cancel" else 1
+    posting_month = get_first_day(doc.posting_date)
+    is_taxable = 1 if bucket.startswith("taxable") else 0
+
+    weights = get_cost_center_weights(doc)
+    precision = get_amount_precision(doc.doctype)
+    shares = {
+        "base_grand_total": distribute_amount(doc.base_grand_total, weights, precision),
+        "base_net_total": distribute_amount(doc.base_net_total, weights, precision),
+        "tax_amount": distribute_amount(doc.total_taxes_and_charges, weights, precision),
+    }
+
+    for cost_center in weights:
+        values = {field: sign * shares[field][cost_center] for field in VALUE_FIELDS}
+        upsert_ledger_row(
+            doc.company, posting_month, cost_center, doc.doctype, doc.is_return, is_taxable, values
+        )
+
+
+def get_amount_precision(invoice_doctype):
+    return frappe.get_precision(invoice_doctype, "base_grand_total") or 2
+
+
+def distribute_amount(amount, weights, precision):
+    """
+    توزيع مبلغ الفاتورة على مراكز التكلفة بحصص مقربة، وفرق التقريب لآخر مركز تكلفة
+    (بترتيب الاسم) حتى يساوي مجموع الحصص مبلغ الفاتورة تماماً
+    """
+    cost_centers = sorted(weights)
+    shares = {}
+    allocated = 0
+
+    for cost_center in cost_centers[:-1]:
+        shares[cost_center] = flt(flt(amount) * weights[cost_center], precision)
+        allocated += shares[cost_center]
+
+    shares[cost_centers[-1]] = flt(flt(amount) - allocated, precision)
+    return shares
+
+
+def get_cost_center_weights(doc):
+    """
+    توزيع الفاتورة على مراكز التكلفة حسب صافي مبلغ البنود،
+    أو حسب عدد البنود إذا كان صافي الفاتورة صفراً
+    """
+    net_by_cost_center = {}
+    lines_by_cost_center = {}
+
+    for item in doc.get("items") or []:
+        cost_center = item.cost_center or ""
+        net_by_cost_center[cost_center] = net_by_cost_center.get(cost_center, 0) + flt(
+            item.base_net_amount
+        )
+        lines_by_cost_center[cost_center] = lines_by_cost_center.get(cost_center, 0) + 1
+
+    if not lines_by_cost_center:
+        return {doc.get("cost_center") or "": 1}
+
+    base_net_total = flt(doc.base_net_total)
+    total_lines = sum(lines_by_cost_center.values())
+
+    if base_net_total:
+        return {cc: net / base_net_total for cc, net in net_by_cost_center.items()}
+
+    return {cc: lines / total_lines for cc, lines in lines_by_cost_center.items()}
+
+
+def upsert_ledger_row(company, posting_month, cost_center, invoice_doctype, is_return, is_taxable, values):
+    timestamp = now()
+    frappe.db.sql(
+        """
+        INSERT INTO `tabVAT Period Ledger`
+            (name, creation, modified, owner, modified_by, docstatus, idx,
+            company, posting_month, cost_center, invoice_doctype, is_return, is_taxable,
+            base_grand_total, base_net_total, tax_amount)
+        VALUES
+            (%(name)s, %(timestamp)s, %(timestamp)s, %(user)s, %(user)s, 0, 0,
+            %(company)s, %(posting_month)s, %(cost_center)s, %(invoice_doctype)s, %(is_return)s, %(is_taxable)s,
+            %(base_grand_total)s, %(base_net_total)s, %(tax_amount)s)
+        ON DUPLICATE KEY UPDATE
+            base_grand_total = base_grand_total + VALUES(base_grand_total),
+            base_net_total = base_net_total + VALUES(base_net_total),
+            tax_amount = tax_amount + VALUES(tax_amount),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+    """,
+        {
+            "name": get_ledger_name(
+                company, posting_month, cost_center, invoice_doctype, is_return, is_taxable
+            ),
+            "timestamp": timestamp,
+            "user": frappe.session.user,
+            "company": company,
+            "posting_month": posting_month,
+            "cost_center": cost_center or None,
+            "invoice_doctype": invoice_doctype,
+            "is_return": is_return or 0,
+            "is_taxable": is_taxable,
+            **values,
+        },
+    )
+
+
+def rebuild_vat_period_ledger(company=None):
+    """إعادة بناء السجل بالكامل من الفواتير المعتمدة"""
+    if company:
+        frappe.db.delete("VAT Period Ledger", {"company": company})
+    else:
+        frappe.db.delete("VAT Period Ledger")
+
+    timestamp = now()
+    user = frappe.session.user
+    fields = [
+        "name",
+        "creation",
+        "modified",
+        "owner",
+        "modified_by",
+        "company",
+        "posting_month",
+        "cost_center",
+        "invoice_doctype",
+        "is_return",
+        "is_taxable",
+        *VALUE_FIELDS,
+    ]
+
+    for invoice_doctype in INVOICE_DOCTYPES:
+        values = []
+        for row in get_aggregated_invoices(invoice_doctype, company):
+            if not row.bucket:
+                continue
+
+            posting_month = getdate(row.posting_month)
+            is_taxable = 1 if row.bucket.startswith("taxable") else 0
+            values.append(
+                (
+                    get_ledger_name(
+                        row.company,
+                        posting_month,
+                        row.cost_center,
+                        invoice_doctype,
+                        row.is_return,
+                        is_taxable,
+                    ),
+                    timestamp,
+                    timestamp,
+                    user,
+                    user,
+                    row.company,
+                    posting_month,
+                    row.cost_center or None,
+                    invoice_doctype,
+                    row.is_return,
+                    is_taxable,
+                    *(flt(row.get(field)) for field in VALUE_FIELDS),
+                )
+            )
+
+        if values:
+            frappe.db.bulk_insert("VAT Period Ledger", fields, values)
+
+    # إعادة البناء الكاملة تشمل كل الشركات
+    for rebuilt_company in [company] if company else frappe.get_all("Company", pluck="name"):
+        frappe.db.set_default(get_ledger_ready_key(rebuilt_company), timestamp)
+
+
+def get_aggregated_invoices(invoice_doctype, company=None):
+    """تجميع الفواتير حسب الشركة والشهر ومركز التكلفة والتصنيف الضريبي"""
+    conditions = ""
+    values = {}
+    if company:
+        conditions = "AND inv.company = %(company)s"
+        values["company"] = company
+
+    weight = (
+        "(CASE WHEN inv.base_net_total != 0 THEN w.cc_net / inv.base_net_total "
+        "ELSE w.cc_lines / w.total_lines END)"
+    )
+
+    # نفس distribute_amount: حصص مقربة لكل مركز تكلفة وفرق التقريب لآخر مركز بترتيب الاسم
+    def get_share(field):
+        share = "ROUND(inv.{0} * {1}, {2})".format(
+            field, weight, get_amount_precision(invoice_doctype)
+        )
+        return """CASE
+                    WHEN w.cc_rank = w.total_cost_centers
+                    THEN inv.{0} - (SUM({1}) OVER (PARTITION BY inv.name) - {1})
+                    ELSE {1}
+                END""".format(
+            field, share
+        )
+
+    return frappe.db.sql(
+        """
+        SELECT
+            company,
+            posting_month,
+            cost_center,
+            is_return,
+            bucket,
+            SUM(base_grand_total) as base_grand_total,
+            SUM(base_net_total) as base_net_total,
+            SUM(tax_amount) as tax_amount
+        FROM (
+            SELECT
+                inv.company,
+                DATE_FORMAT(inv.posting_date, '%%Y-%%m-01') as posting_month,
+                w.cost_center,
+                inv.is_return,
+                CASE {bucket_case} END as bucket,
+                {base_grand_total} as base_grand_total,
+                {base_net_total} as base_net_total,
+                {tax_amount} as tax_amount
+            FROM
+                `tab{doctype}` inv
+            INNER JOIN (
+                SELECT
+                    parent,
+                    cost_center,
+                    SUM(base_net_amount) as cc_net,
+                    COUNT(*) as cc_lines,
+                    SUM(COUNT(*)) OVER (PARTITION BY parent) as total_lines,
+                    ROW_NUMBER() OVER (PARTITION BY parent ORDER BY cost_center) as cc_rank,
+                    COUNT(*) OVER (PARTITION BY parent) as total_cost_centers
+                FROM `tab{doctype} Item`
+                GROUP BY parent, cost_center
+            ) w ON w.parent = inv.name
+            WHERE
+                inv.docstatus = 1
+                {conditions}
+        ) shares
+        GROUP BY
+            company, posting_month, cost_center, is_return, bucket
+    """.format(
+            bucket_case=get_tax_bucket_case(),
+            base_grand_total=get_share("base_grand_total"),
+            base_net_total=get_share("base_net_total"),
+            tax_amount=get_share("total_taxes_and_charges"),
+            doctype=invoice_doctype,
+            conditions=conditions,
+        ),
+        values,
+        as_dict=1,
+    )
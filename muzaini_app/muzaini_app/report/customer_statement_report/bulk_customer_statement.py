@@ -0,0 +1,305 @@
+# Copyright (c) 2026, Mohamed AbdElsabour and contributors
+# For license information, please see license.txt
+
+import csv
+import io
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, cint, flt, get_first_day, getdate
+
+from muzaini_app.muzaini_app.doctype.party_balance_checkpoint.party_balance_checkpoint import (
+    get_checkpoint_balances,
+    is_checkpoint_ready,
+)
+from muzaini_app.muzaini_app.report.customer_statement_report.customer_statement_report import (
+    build_statement_rows,
+    check_report_permission,
+    get_columns,
+    get_receivable_accounts_map,
+    get_recorded_customer_balances,
+    get_statement_context,
+    get_statement_gl_query,
+)
+
+# عدد العملاء في كل مهمة خلفية (كل مهمة = استعلام واحد مقسّم حسب العميل)
+BULK_STATEMENT_CHUNK_SIZE = 200
+
+BULK_STATEMENT_CACHE_KEY = "muzaini_bulk_statement"
+
+# مدة الاحتفاظ بتقدم التشغيل في التخزين المؤقت
+BULK_STATEMENT_PROGRESS_EXPIRY = 24 * 60 * 60
+
+
+@frappe.whitelist()
+def enqueue_bulk_statements(company, from_date, to_date, customers=None, customer_group=None):
+    """
+    كشوف حساب لعدد كبير من العملاء: يتم تقسيم العملاء إلى دفعات وإرسال كل دفعة
+    كمهمة مستقلة في طابور المهام الطويلة، فتعمل الدفعات بالتوازي على عمال الخلفية
+    """
+    check_report_permission()
+
+    customers = frappe.parse_json(customers) if customers else []
+    if customer_group:
+        customers = list(dict.fromkeys(customers + get_group_customers(customer_group)))
+
+    if not customers:
+        frappe.throw(_("يرجى تحديد العملاء أو مجموعة العملاء"))
+
+    run_id = frappe.generate_hash(length=10)
+    frappe.cache().set_value(
+        get_progress_key(run_id),
+        {"total": len(customers)},
+        expires_in_sec=BULK_STATEMENT_PROGRESS_EXPIRY,
+    )
+
+    for start in range(0, len(customers), BULK_STATEMENT_CHUNK_SIZE):
+        frappe.enqueue(
+            "muzaini_app.muzaini_app.report.customer_statement_report.bulk_customer_statement.generate_statements_chunk",
+            queue="long",
+            run_id=run_id,
+            company=company,
+            from_date=from_date,
+            to_date=to_date,
+            customers=customers[start : start + BULK_STATEMENT_CHUNK_SIZE],
+            user=frappe.session.user,
+        )
+
+    return {"run_id": run_id, "total": len(customers)}
+
+
+@frappe.whitelist()
+def get_bulk_statement_progress(run_id):
+    progress = frappe.cache().get_value(get_progress_key(run_id)) or {}
+    progress["done"] = get_done_count(run_id)
+    return progress
+
+
+def get_progress_key(run_id):
+    return "{0}:{1}".format(BULK_STATEMENT_CACHE_KEY, run_id)
+
+
+def get_done_count(run_id, increment=0):
+    """عداد ذري للعملاء المنجزين (لا تضيع التحديثات عند انتهاء عدة دفعات معاً)"""
+    cache = frappe.cache()
+    key = cache.make_key(get_progress_key(run_id) + ":done")
+    done = cint(cache.incrby(key, increment))
+    cache.expire(key, BULK_STATEMENT_PROGRESS_EXPIRY)
+    return done
+
+
+def get_group_customers(customer_group, include_disabled_with_entries=False):
+    """
+    عملاء مجموعة العملاء وكل المجموعات الفرعية (الشجرة المتداخلة lft/rgt).
+    مع include_disabled_with_entries يُضاف العملاء الموقوفون الذين لهم قيود في الأستاذ العام
+    """
+    lft, rgt = frappe.db.get_value("Customer Group", customer_group, ["lft", "rgt"]) or (0, 0)
+
+    disabled_condition = "AND customer.disabled = 0"
+    if include_disabled_with_entries:
+        disabled_condition = """AND (customer.disabled = 0 OR EXISTS (
+                SELECT 1 FROM `tabGL Entry` gle
+                WHERE gle.party_type = 'Customer'
+                    AND gle.party = customer.name
+                    AND gle.is_cancelled = 0
+            ))"""
+
+    return frappe.db.sql_list(
+        """
+        SELECT customer.name
+        FROM `tabCustomer` customer
+        INNER JOIN `tabCustomer Group` customer_group
+            ON customer_group.name = customer.customer_group
+        WHERE customer_group.lft >= %s
+            AND customer_group.rgt <= %s
+            {disabled_condition}
+        ORDER BY customer.name
+    """.format(
+            disabled_condition=disabled_condition
+        ),
+        (lft, rgt),
+    )
+
+
+def generate_statements_chunk(run_id, company, from_date, to_date, customers, user=None):
+    """بناء وحفظ كشف حساب لكل عميل في الدفعة من استعلام واحد مقسّم حسب العميل"""
+    from_date = getdate(from_date)
+    to_date = getdate(to_date)
+    opening_date = add_days(from_date, -1)
+
+    entries_by_customer, opening_by_customer, checkpoint_balances = get_chunk_gl_entries(
+        company, opening_date, from_date, to_date, customers
+    )
+
+    # بيانات المستندات لكل عملاء الدفعة معاً
+    context = get_statement_context(
+        [entry for entries in entries_by_customer.values() for entry in entries]
+    )
+
+    opening_balances = get_opening_balances(customers, opening_by_customer, checkpoint_balances)
+
+    for customer in customers:
+        opening_balance, balance_offset = opening_balances[customer]
+
+        data = build_statement_rows(
+            entries_by_customer.get(customer) or [],
+            opening_balance,
+            opening_date,
+            balance_offset,
+            context,
+        )
+        save_statement_file(customer, from_date, to_date, data)
+
+    update_progress(run_id, len(customers), user)
+
+
+def get_chunk_gl_entries(company, opening_date, from_date, to_date, customers):
+    """
+    حركات ورصيد افتتاحي لكل عملاء الدفعة مع رصيد تراكمي مستقل لكل عميل.
+    حسابات كل عميل هي نفس حسابات الكشف الفردي، وتُحدد لكل عملاء الدفعة معاً.
+    """
+    accounts_by_customer = {
+        customer: tuple(accounts)
+        for customer, accounts in get_receivable_accounts_map(company, customers).items()
+        if accounts
+    }
+
+    if not accounts_by_customer:
+        return {}, {}, {}
+
+    all_accounts = tuple(
+        {account for accounts in accounts_by_customer.values() for account in accounts}
+    )
+    party_accounts = tuple(
+        (customer, account)
+        for customer, accounts in accounts_by_customer.items()
+        for account in accounts
+    )
+
+    checkpoint_balances = {}
+    opening_start_condition = ""
+    opening_start_values = []
+    if is_checkpoint_ready(company):
+        opening_month = get_first_day(opening_date)
+
+        # العملاء أصحاب نفس الحسابات في استعلام واحد
+        customers_by_accounts = {}
+        for customer, accounts in accounts_by_customer.items():
+            customers_by_accounts.setdefault(accounts, []).append(customer)
+
+        for accounts, account_customers in customers_by_accounts.items():
+            checkpoint_balances.update(
+                get_checkpoint_balances(
+                    company, "Customer", account_customers, opening_month, accounts
+                )
+            )
+
+        opening_start_condition = "AND posting_date >= %s"
+        opening_start_values = [opening_month]
+
+    rows = frappe.db.sql(
+        get_statement_gl_query(
+            party_condition="(party, account) IN %s",
+            opening_start_condition=opening_start_condition,
+            partition_by_party=True,
+        ),
+        tuple(
+            [
+                all_accounts,
+                party_accounts,
+                company,
+                opening_date,
+                *opening_start_values,
+                all_accounts,
+                party_accounts,
+                company,
+                from_date,
+                to_date,
+            ]
+        ),
+        as_dict=1,
+    )
+
+    entries_by_customer = {}
+    opening_by_customer = {}
+    for row in rows:
+        if row.is_opening_row:
+            opening_by_customer[row.party] = row
+        else:
+            entries_by_customer.setdefault(row.party, []).append(row)
+
+    return entries_by_customer, opening_by_customer, checkpoint_balances
+
+
+def get_opening_balances(customers, opening_by_customer, checkpoint_balances):
+    """
+    {العميل: (الرصيد الافتتاحي، إزاحة الرصيد التراكمي)} بنفس منطق الكشف الفردي:
+    النقاط الشهرية + صف الرصيد الافتتاحي، ثم رصيد العميل المسجل إذا كان الرصيد صفراً
+    """
+    opening_balances = {}
+    zero_balance_customers = []
+
+    for customer in customers:
+        balance_offset = checkpoint_balances.get(customer, 0)
+        opening_row = opening_by_customer.get(customer)
+        opening_balance = balance_offset
+        if opening_row:
+            opening_balance += flt(opening_row.debit) - flt(opening_row.credit)
+
+        opening_balances[customer] = (opening_balance, balance_offset)
+        if opening_balance == 0:
+            zero_balance_customers.append(customer)
+
+    for customer, recorded_balance in get_recorded_customer_balances(
+        zero_balance_customers
+    ).items():
+        if recorded_balance:
+            opening_balances[customer] = (recorded_balance, recorded_balance)
+
+    return opening_balances
+
+
+def save_statement_file(customer, from_date, to_date, data):
+    """حفظ كشف العميل كملف CSV خاص مرفق بسجل العميل"""
+    columns = get_columns()
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([column["label"] for column in columns])
+    for row in data:
+        writer.writerow([row.get(column["fieldname"]) for column in columns])
+
+    file_name = "statement-{0}-{1}-{2}.csv".format(frappe.scrub(customer), from_date, to_date)
+
+    # إعادة إنشاء كشف نفس العميل والفترة تستبدل المرفق السابق بدلاً من تكراره
+    for existing_file in frappe.get_all(
+        "File",
+        filters={
+            "attached_to_doctype": "Customer",
+            "attached_to_name": customer,
+            "file_name": file_name,
+        },
+        pluck="name",
+    ):
+        frappe.delete_doc("File", existing_file, ignore_permissions=True, force=True)
+
+    frappe.get_doc(
+        {
+            "doctype": "File",
+            "file_name": file_name,
+            "content": output.getvalue().encode("utf-8-sig"),
+            "is_private": 1,
+            "attached_to_doctype": "Customer",
+            "attached_to_name": customer,
+        }
+    ).insert(ignore_permissions=True)
+
+
+def update_progress(run_id, count, user=None):
+    progress = frappe.cache().get_value(get_progress_key(run_id)) or {}
+
+    frappe.publish_realtime(
+        "bulk_customer_statement_progress",
+        {"run_id": run_id, "done": get_done_count(run_id, count), "total": progress.get("total")},
+        user=user,
+    )
@@ -17,7 +17,6 @@ frappe.query_reports["Customer Statement Report"] = {
 			label: __("العميل"),
 			fieldtype: "Link",
 			options: "Customer",
-			reqd: 1,
 			width: "200px",
 			get_query: function () {
 				return {
@@ -25,6 +24,14 @@ frappe.query_reports["Customer Statement Report"] = {
 				};
 			},
 		},
+		{
+			fieldname: "customer_group",
+			label: __("مجموعة العملاء"),
+			fieldtype: "Link",
+			options: "Customer Group",
+			width: "200px",
+			depends_on: "eval:!doc.customer",
+		},
 		{
 			fieldname: "from_date",
 			label: __("من تاريخ"),
@@ -74,6 +81,12 @@ frappe.query_reports["Customer Statement Report"] = {
 			},
 			depends_on: "company",
 		},
+		{
+			fieldname: "in_account_currency",
+			label: __("بعملة حساب العميل"),
+			fieldtype: "Check",
+			default: 0,
+		},
 	],
 	formatter: function (value, row, column, data, default_formatter) {
 		if (data) {
@@ -105,6 +118,8 @@ frappe.query_reports["Customer Statement Report"] = {
 						return "الإجمالي";
 					case "Opening Balance":
 						return "رصيد افتتاحي";
+					case "Exchange Revaluation":
+						return "فرق إعادة التقييم";
 					default:
 						return value || "";
 				}
@@ -308,6 +323,8 @@ frappe.query_reports["Customer Statement Report"] = {
 			'<div class="transactions-summary" style="margin-top: 20px;"></div>',
 		);
 
+		var $agingSummary = $('<div class="aging-summary" style="margin-top: 20px;"></div>');
+
 		report.page.main.find(".report-filter-section").after($customerSummarySection);
 
 		report.page.main.find(".report-filter-section").after($filterBadgesSection);
@@ -317,7 +334,8 @@ frappe.query_reports["Customer Statement Report"] = {
 		$customerSummarySection
 			.append($customerInfoSection)
 			.append($balanceCardsSection)
-			.append($transactionsSummary);
+			.append($transactionsSummary)
+			.append($agingSummary);
 
 		function updateSelectedFilters() {
 			var filters = report.get_values();
@@ -371,6 +389,8 @@ frappe.query_reports["Customer Statement Report"] = {
 				updateOpeningBalanceContainer(report);
 
 				updateCustomerSummary(report);
+
+				updateAgingSummary(report);
 			} else {
 				$(".opening-balance-container").empty();
 				$(".customer-info").empty();
@@ -378,6 +398,7 @@ frappe.query_reports["Customer Statement Report"] = {
 				$(".credit-amount").text("0.00");
 				$(".closing-amount").text("0.00");
 				$(".transactions-summary").empty();
+				$(".aging-summary").empty();
 			}
 		};
 
@@ -465,6 +486,57 @@ frappe.query_reports["Customer Statement Report"] = {
 			updateTransactionSummary(report.data);
 		}
 
+		function updateAgingSummary(report) {
+			var report_dict = report.report_dict || {};
+			var aging = report_dict.aging || {};
+			var openInvoices = report_dict.open_invoices || [];
+
+			$(".aging-summary").empty();
+			if (!openInvoices.length) return;
+
+			var bucketCards = Object.keys(aging)
+				.map(function (bucket) {
+					return `
+                        <div style="flex: 1 0 150px; background-color: #f8f9fa; padding: 15px; border-radius: 5px; text-align: center; box-shadow: 0 2px 5px rgba(0,0,0,0.05);">
+                            <div style="font-size: 18px; font-weight: bold; color: #4272d7;">${format_currency(aging[bucket])}</div>
+                            <div style="color: #666;">${bucket} ${__("يوم")}</div>
+                        </div>`;
+				})
+				.join("");
+
+			var invoiceRows = openInvoices
+				.map(function (row) {
+					return `<tr>
+                        <td>${frappe.utils.escape_html(row.invoice)}</td>
+                        <td>${frappe.datetime.str_to_user(row.posting_date)}</td>
+                        <td>${row.due_date ? frappe.datetime.str_to_user(row.due_date) : ""}</td>
+                        <td>${format_currency(row.grand_total)}</td>
+                        <td>${format_currency(row.outstanding_amount)}</td>
+                        <td>${row.age}</td>
+                    </tr>`;
+				})
+				.join("");
+
+			$(".aging-summary").append(`
+                <div>
+                    <h4 style="margin-bottom: 15px; color: #333; font-weight: bold;">${__("أعمار الديون")}</h4>
+                    <div style="display: flex; flex-wrap: wrap; gap: 10px;">${bucketCards}</div>
+                    <h4 style="margin: 20px 0 15px; color: #333; font-weight: bold;">${__("الفواتير المفتوحة")}</h4>
+                    <table class="table table-bordered" dir="rtl">
+                        <thead><tr>
+                            <th>${__("الفاتورة")}</th>
+                            <th>${__("التاريخ")}</th>
+                            <th>${__("تاريخ الاستحقاق")}</th>
+                            <th>${__("قيمة الفاتورة")}</th>
+                            <th>${__("المتبقي")}</th>
+                            <th>${__("العمر (يوم)")}</th>
+                        </tr></thead>
+                        <tbody>${invoiceRows}</tbody>
+                    </table>
+                </div>
+            `);
+		}
+
 		function updateCustomerInfo(filters) {
 			if (!filters || !filters.customer) return;
 
@@ -659,6 +731,134 @@ frappe.query_reports["Customer Statement Report"] = {
 				frappe.msgprint(__("لا توجد بيانات للتصدير"));
 			}
 		});
+
+		// عرض الكشف صفحة بصفحة من الخادم (للعملاء ذوي الحركات الكثيرة)
+		report.page.add_inner_button(__("عرض مقسم لصفحات"), function () {
+			var filters = report.get_values();
+			if (!filters || !filters.customer) return;
+
+			var cursors = [null];
+			var current = 0;
+			var dialog = new frappe.ui.Dialog({
+				title: __("كشف الحساب"),
+				size: "extra-large",
+				fields: [{ fieldname: "page_html", fieldtype: "HTML" }],
+				primary_action_label: __("الصفحة التالية"),
+				primary_action: function () {
+					loadPage(current + 1);
+				},
+				secondary_action_label: __("الصفحة السابقة"),
+				secondary_action: function () {
+					if (current > 0) loadPage(current - 1);
+				},
+			});
+
+			function loadPage(index) {
+				frappe.call({
+					method: "muzaini_app.muzaini_app.report.customer_statement_report.customer_statement_report.get_statement_page",
+					args: { filters: filters, cursor: cursors[index] },
+					freeze: true,
+					callback: function (r) {
+						if (!r.message) return;
+
+						current = index;
+						cursors = cursors.slice(0, index + 1);
+						if (r.message.next_cursor) cursors.push(r.message.next_cursor);
+
+						var rows = r.message.data
+							.map(function (row) {
+								return `<tr>
+									<td>${row.posting_date ? frappe.datetime.str_to_user(row.posting_date) : ""}</td>
+									<td>${frappe.utils.escape_html(row.voucher_no || "")}</td>
+									<td>${frappe.utils.escape_html(row.description || "")}</td>
+									<td>${format_currency(row.debit || 0)}</td>
+									<td>${format_currency(row.credit || 0)}</td>
+									<td>${format_currency(row.balance || 0)}</td>
+								</tr>`;
+							})
+							.join("");
+
+						dialog.fields_dict.page_html.$wrapper.html(`
+							<table class="table table-bordered" dir="rtl">
+								<thead><tr>
+									<th>${__("التاريخ")}</th><th>${__("رقم المستند")}</th>
+									<th>${__("البيان")}</th><th>${__("مدين")}</th>
+									<th>${__("دائن")}</th><th>${__("الرصيد")}</th>
+								</tr></thead>
+								<tbody>${rows}</tbody>
+							</table>
+						`);
+						dialog.get_primary_btn().toggle(!!r.message.next_cursor);
+					},
+				});
+			}
+
+			dialog.show();
+			loadPage(0);
+		});
+
+		// كشوف حساب جماعية تُنشأ في الخلفية وتُرفق بسجل كل عميل
+		report.page.add_inner_button(__("كشوف حساب جماعية"), function () {
+			var filters = report.get_values();
+			var dialog = new frappe.ui.Dialog({
+				title: __("كشوف حساب جماعية"),
+				fields: [
+					{
+						fieldname: "customer_group",
+						label: __("مجموعة العملاء"),
+						fieldtype: "Link",
+						options: "Customer Group",
+					},
+					{
+						fieldname: "customers",
+						label: __("العملاء"),
+						fieldtype: "MultiSelectList",
+						get_data: function (txt) {
+							return frappe.db.get_link_options("Customer", txt, { disabled: 0 });
+						},
+					},
+				],
+				primary_action_label: __("إنشاء"),
+				primary_action: function (values) {
+					dialog.hide();
+					frappe.call({
+						method: "muzaini_app.muzaini_app.report.customer_statement_report.bulk_customer_statement.enqueue_bulk_statements",
+						args: {
+							company: filters.company,
+							from_date: filters.from_date,
+							to_date: filters.to_date,
+							customers: values.customers,
+							customer_group: values.customer_group,
+						},
+						callback: function (r) {
+							if (!r.message) return;
+
+							var run_id = r.message.run_id;
+							frappe.show_progress(__("كشوف حساب جماعية"), 0, r.message.total);
+							frappe.realtime.on("bulk_customer_statement_progress", function (data) {
+								if (data.run_id !== run_id) return;
+
+								frappe.show_progress(
+									__("كشوف حساب جماعية"),
+									data.done,
+									data.total,
+									__("تم إنشاء {0} من {1}", [data.done, data.total]),
+								);
+								if (data.done >= data.total) {
+									frappe.hide_progress();
+									frappe.realtime.off("bulk_customer_statement_progress");
+									frappe.show_alert({
+										message: __("تم إنشاء كشوف الحساب وإرفاقها بسجلات العملاء"),
+										indicator: "green",
+									});
+								}
+							});
+						},
+					});
+				},
+			});
+			dialog.show();
+		});
 	},
 
 	initial_setup: true,
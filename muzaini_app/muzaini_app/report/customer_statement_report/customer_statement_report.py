@@ -3,9 +3,14 @@
 
 import frappe
 from frappe import _
-from frappe.utils import flt, getdate, add_days, cint, formatdate
+from frappe.utils import flt, getdate, add_days, cint, date_diff, formatdate, get_first_day
 import datetime
 
+from muzaini_app.muzaini_app.doctype.party_balance_checkpoint.party_balance_checkpoint import (
+    get_checkpoint_balance,
+    is_checkpoint_ready,
+)
+
 
 def execute(filters=None):
     if not filters:
@@ -17,12 +22,15 @@ def execute(filters=None):
     if not filters.get("to_date"):
         filters["to_date"] = datetime.date.today()
 
+    if not filters.get("customer") and not filters.get("customer_group"):
+        frappe.throw(_("يرجى تحديد العميل أو مجموعة العملاء"))
+
     if not filters.get("customer"):
-        frappe.throw(_("يرجى تحديد العميل"))
+        return get_group_statement(filters)
 
-    columns = get_columns()
+    columns = get_columns(filters)
 
-    opening_balance, opening_date, data = get_customer_ledger_entries(filters)
+    opening_balance, opening_date, data, aging = get_customer_ledger_entries(filters)
 
     if opening_date:
         formatted_opening_date = formatdate(opening_date)
@@ -34,6 +42,8 @@ def execute(filters=None):
         {
             "opening_balance": flt(opening_balance),
             "opening_date": formatted_opening_date,
+            "aging": aging.buckets if aging else {},
+            "open_invoices": aging.open_invoices if aging else [],
         }
     )
 
@@ -44,8 +54,8 @@ def execute(filters=None):
     return columns, data, report_dict
 
 
-def get_columns():
-    return [
+def get_columns(filters=None):
+    columns = [
         {
             "fieldname": "posting_date",
             "label": _("التاريخ"),
@@ -109,6 +119,161 @@ def get_columns():
         },
     ]
 
+    if filters and filters.get("in_account_currency"):
+        for column in columns:
+            if column["fieldname"] in ("debit", "credit", "balance"):
+                column["options"] = "currency"
+
+        columns.extend(
+            [
+                {
+                    "fieldname": "exchange_rate",
+                    "label": _("سعر الصرف"),
+                    "fieldtype": "Float",
+                    "precision": 6,
+                    "width": 100,
+                },
+                {
+                    "fieldname": "company_balance",
+                    "label": _("الرصيد بعملة الشركة"),
+                    "fieldtype": "Currency",
+                    "width": 140,
+                },
+            ]
+        )
+
+    return columns
+
+
+def get_group_statement(filters):
+    """
+    كشف موحد لمجموعة عملاء (مع المجموعات الفرعية): كل الحركات من استعلام واحد مقسّم حسب العميل،
+    مع إجمالي لكل عميل ورصيد تراكمي موحد للمجموعة
+    """
+    from muzaini_app.muzaini_app.report.customer_statement_report.bulk_customer_statement import (
+        get_chunk_gl_entries,
+        get_group_customers,
+        get_opening_balances,
+    )
+
+    if filters.get("in_account_currency"):
+        frappe.throw(_("لا يمكن عرض كشف مجموعة العملاء بعملة الحساب، يرجى اختيار عميل واحد"))
+
+    columns = get_columns(filters)
+    columns[1:1] = [
+        {
+            "fieldname": "customer",
+            "label": _("العميل"),
+            "fieldtype": "Link",
+            "options": "Customer",
+            "width": 150,
+        }
+    ]
+    columns.append(
+        {
+            "fieldname": "group_balance",
+            "label": _("رصيد المجموعة"),
+            "fieldtype": "Currency",
+            "width": 130,
+        }
+    )
+
+    opening_date = add_days(getdate(filters.get("from_date")), -1)
+    # الموقوفون الذين لهم قيود يبقون في الكشف حتى لا تسقط أرصدتهم من إجمالي المجموعة
+    customers = get_group_customers(
+        filters.get("customer_group"), include_disabled_with_entries=True
+    )
+
+    entries_by_customer, opening_by_customer, checkpoint_balances = {}, {}, {}
+    if customers:
+        entries_by_customer, opening_by_customer, checkpoint_balances = get_chunk_gl_entries(
+            filters.get("company"),
+            opening_date,
+            getdate(filters.get("from_date")),
+            getdate(filters.get("to_date")),
+            customers,
+        )
+
+    context = get_statement_context(
+        [entry for entries in entries_by_customer.values() for entry in entries]
+    )
+
+    data = []
+    group_opening_balance = 0
+    group_balance = 0
+    total_debit = total_credit = 0
+
+    opening_balances = get_opening_balances(customers, opening_by_customer, checkpoint_balances)
+
+    for customer in customers:
+        opening_balance, balance_offset = opening_balances[customer]
+
+        gl_entries = entries_by_customer.get(customer) or []
+        if not gl_entries and not opening_balance:
+            continue
+
+        rows = build_statement_rows(
+            gl_entries, opening_balance, opening_date, balance_offset, context
+        )
+
+        # الرصيد الموحد = أرصدة العملاء السابقين الختامية + رصيد العميل الحالي
+        closing_balance = opening_balance
+        for row in rows:
+            row["customer"] = customer
+            row["group_balance"] = group_balance + flt(row["balance"])
+            closing_balance = flt(row["balance"])
+            if row.get("is_total_row"):
+                row["description"] = _("إجمالي {0}").format(customer)
+
+        if not gl_entries:
+            rows.append(
+                {
+                    "customer": customer,
+                    "voucher_type": "Total",
+                    "description": _("إجمالي {0}").format(customer),
+                    "debit": 0,
+                    "credit": 0,
+                    "balance": closing_balance,
+                    "group_balance": group_balance + closing_balance,
+                    "is_total_row": True,
+                }
+            )
+
+        data.extend(rows)
+        group_opening_balance += opening_balance
+        group_balance += closing_balance
+        total_debit += sum(flt(entry.debit) for entry in gl_entries)
+        total_credit += sum(flt(entry.credit) for entry in gl_entries)
+
+    if data:
+        data.append(
+            {
+                "voucher_type": "Total",
+                "description": _("إجمالي المجموعة"),
+                "debit": total_debit,
+                "credit": total_credit,
+                "balance": group_balance,
+                "group_balance": group_balance,
+                "is_total_row": True,
+                "is_group_total_row": True,
+            }
+        )
+
+    aging = get_aging(filters.get("company"), customers, filters.get("to_date"))
+    report_dict = frappe._dict(
+        {
+            "opening_balance": group_opening_balance,
+            "opening_date": formatdate(opening_date),
+            "aging": aging.buckets,
+            "open_invoices": aging.open_invoices,
+        }
+    )
+
+    if not data:
+        frappe.msgprint(_("لا توجد بيانات لعملاء هذه المجموعة في الفترة المحددة"))
+
+    return columns, data, report_dict
+
 
 def get_customer_ledger_entries(filters):
     receivable_accounts = get_receivable_accounts(
@@ -117,170 +282,466 @@ def get_customer_ledger_entries(filters):
 
     if not receivable_accounts:
         frappe.msgprint(_("لم يتم العثور على حسابات مدينة للعميل"))
-        return 0, None, []
+        return 0, None, [], None
 
-    opening_balance = 0
     opening_date = add_days(getdate(filters.get("from_date")), -1)
 
     if not opening_date:
         opening_date = add_days(getdate(), -1)
 
-    user_condition, user_values = get_user_condition(filters)
-    cost_center_condition, cost_center_values = get_cost_center_condition(filters)
-    warehouse_condition, warehouse_values = get_warehouse_condition(filters)
+    filter_condition, filter_values = get_gl_filter_condition(filters, receivable_accounts)
 
-    for account in receivable_accounts:
-        opening_gl_query = """
-            SELECT SUM(debit) - SUM(credit) as balance
-            FROM `tabGL Entry`
-            WHERE account = %s
-            AND party_type = 'Customer'
-            AND party = %s
-            AND company = %s
-            AND posting_date <= %s
-            AND is_cancelled = 0
-        """
+    checkpoint_balance, opening_start_condition, opening_start_values = get_opening_checkpoint(
+        filters, receivable_accounts, opening_date, filter_condition
+    )
 
-        opening_values = [
-            account,
-            filters.get("customer"),
-            filters.get("company"),
+    # استعلام واحد لكل الحسابات المدينة: صف الرصيد الافتتاحي المجمّع ثم حركات الفترة،
+    # والرصيد التراكمي يُحسب في قاعدة البيانات بدالة نافذة
+    gl_entries = frappe.db.sql(
+        get_statement_gl_query(
+            opening_start_condition=opening_start_condition,
+            filter_condition=filter_condition,
+        ),
+        tuple(
+            [
+                tuple(receivable_accounts),
+                filters.get("customer"),
+                filters.get("company"),
+                opening_date,
+                *opening_start_values,
+                *filter_values,
+                tuple(receivable_accounts),
+                filters.get("customer"),
+                filters.get("company"),
+                filters.get("from_date"),
+                filters.get("to_date"),
+                *filter_values,
+            ]
+        ),
+        as_dict=1,
+    )
+
+    opening_row = gl_entries.pop(0)
+    balance_offset = checkpoint_balance
+    opening_balance = checkpoint_balance + flt(opening_row.debit) - flt(opening_row.credit)
+
+    if filters.get("in_account_currency"):
+        return get_account_currency_statement(
+            filters,
+            receivable_accounts,
+            opening_row,
+            gl_entries,
             opening_date,
-        ]
+            get_aging_vouchers(filter_condition, filter_values),
+        )
 
-        if user_condition:
-            opening_gl_query += " AND " + user_condition
-            opening_values.extend(user_values)
+    # إذا لم يوجد رصيد افتتاحي في الأستاذ العام يُستخدم رصيد العميل المسجل (إن وجد)
+    if opening_balance == 0:
+        recorded_balance = get_recorded_customer_balance(filters.get("customer"))
+        if recorded_balance:
+            balance_offset = opening_balance = recorded_balance
+
+    context = get_statement_context(gl_entries)
+    data = build_statement_rows(
+        gl_entries,
+        opening_balance,
+        opening_date,
+        balance_offset,
+        context,
+    )
 
-        if cost_center_condition:
-            opening_gl_query += " AND " + cost_center_condition
-            opening_values.extend(cost_center_values)
+    return (
+        opening_balance,
+        opening_date,
+        data,
+        get_aging(
+            filters.get("company"),
+            [filters.get("customer")],
+            filters.get("to_date"),
+            get_aging_vouchers(filter_condition, filter_values),
+        ),
+    )
 
-        if warehouse_condition:
-            opening_gl_query += " AND " + warehouse_condition
-            opening_values.extend(warehouse_values)
 
-        opening_gl = frappe.db.sql(opening_gl_query, tuple(opening_values), as_dict=1)
+def get_aging_vouchers(filter_condition, filter_values):
+    """مستندات فلاتر الكشف لأعمار الديون: None بدون فلاتر، أو المجموعة المطابقة (قد تكون فارغة)"""
+    if not filter_condition:
+        return None
 
-        if opening_gl and opening_gl[0].balance:
-            opening_balance += flt(opening_gl[0].balance)
+    return tuple(filter_values[0]) if filter_values else ()
 
-    if opening_balance == 0:
-        try:
-            current_balance = frappe.db.get_value(
-                "Customer", filters.get("customer"), "outstanding_amount"
+
+def get_account_currency_statement(
+    filters, receivable_accounts, opening_row, gl_entries, opening_date, aging_vouchers=None
+):
+    """
+    الكشف بعملة حساب العميل من نفس نتيجة الاستعلام: المدين والدائن والرصيد بعملة الحساب،
+    مع الرصيد بعملة الشركة وسعر الصرف لكل حركة، وسطر فرق إعادة التقييم في نهاية الفترة.
+    """
+    account_currency = get_statement_account_currency(receivable_accounts)
+    company_currency = frappe.get_cached_value(
+        "Company", filters.get("company"), "default_currency"
+    )
+
+    opening_balance = flt(opening_row.debit_in_account_currency) - flt(
+        opening_row.credit_in_account_currency
+    )
+    company_opening_balance = flt(opening_row.debit) - flt(opening_row.credit)
+
+    for entry in gl_entries:
+        entry.company_balance = flt(entry.balance)
+        entry.currency = account_currency
+        entry.debit = entry.debit_in_account_currency
+        entry.credit = entry.credit_in_account_currency
+        entry.balance = entry.balance_in_account_currency
+
+    context = get_statement_context(gl_entries)
+    data = build_statement_rows(gl_entries, opening_balance, opening_date, 0, context)
+
+    closing_balance = flt(gl_entries[-1].balance) if gl_entries else opening_balance
+    company_closing_balance = (
+        gl_entries[-1].company_balance if gl_entries else company_opening_balance
+    )
+
+    for row in data:
+        if row.get("is_opening_row"):
+            row.update(company_balance=company_opening_balance, currency=account_currency)
+        elif row.get("is_total_row"):
+            row.update(company_balance=company_closing_balance, currency=account_currency)
+
+    if closing_balance and account_currency != company_currency:
+        revaluation_row = get_revaluation_row(
+            filters,
+            account_currency,
+            company_currency,
+            closing_balance,
+            company_closing_balance,
+            gl_entries,
+        )
+        if revaluation_row:
+            data.append(revaluation_row)
+
+    return (
+        opening_balance,
+        opening_date,
+        data,
+        get_aging(
+            filters.get("company"),
+            [filters.get("customer")],
+            filters.get("to_date"),
+            aging_vouchers,
+            in_account_currency=True,
+        ),
+    )
+
+
+def get_statement_account_currency(receivable_accounts):
+    currencies = set(
+        frappe.get_all(
+            "Account",
+            filters={"name": ["in", receivable_accounts]},
+            pluck="account_currency",
+        )
+    )
+
+    if len(currencies) > 1:
+        frappe.throw(
+            _("حسابات العميل بعملات مختلفة ({0})، لا يمكن عرض الكشف بعملة الحساب").format(
+                ", ".join(sorted(filter(None, currencies)))
             )
-            if current_balance:
-                opening_balance = flt(current_balance)
-        except Exception:
-            pass
+        )
+
+    return currencies.pop() if currencies else None
+
+
+def get_revaluation_row(
+    filters,
+    account_currency,
+    company_currency,
+    closing_balance,
+    company_closing_balance,
+    gl_entries,
+):
+    """فرق إعادة التقييم: الرصيد الختامي بعملة الحساب بسعر صرف نهاية الفترة مقابل الرصيد الدفتري"""
+    from erpnext.setup.utils import get_exchange_rate
+
+    closing_rate = flt(
+        get_exchange_rate(account_currency, company_currency, filters.get("to_date"))
+    )
+
+    # بدون سعر مسجل يُستخدم سعر آخر حركة في الفترة
+    if not closing_rate:
+        closing_rate = next(
+            (flt(entry.exchange_rate) for entry in reversed(gl_entries) if entry.exchange_rate),
+            0,
+        )
+        frappe.msgprint(
+            _("لا يوجد سعر صرف مسجل من {0} إلى {1} بتاريخ {2}").format(
+                account_currency, company_currency, formatdate(filters.get("to_date"))
+            )
+            + (
+                " - " + _("تم استخدام سعر آخر حركة في الفترة: {0}").format(closing_rate)
+                if closing_rate
+                else ""
+            ),
+            indicator="orange",
+        )
+
+    # بدون أي سعر لا يمكن حساب فرق إعادة التقييم
+    if not closing_rate:
+        return None
+
+    revalued_balance = closing_balance * closing_rate
+    difference = revalued_balance - flt(company_closing_balance)
+
+    return {
+        "posting_date": getdate(filters.get("to_date")),
+        "voucher_type": "Exchange Revaluation",
+        "voucher_no": "",
+        "description": _("فرق إعادة التقييم: {0}").format(
+            frappe.format_value(difference, {"fieldtype": "Currency", "options": company_currency})
+        ),
+        "debit": 0,
+        "credit": 0,
+        "balance": closing_balance,
+        "exchange_rate": closing_rate,
+        "company_balance": revalued_balance,
+        "revaluation_difference": difference,
+        "currency": account_currency,
+        "payment_type": "",
+        "invoice_status": "",
+        "is_revaluation_row": True,
+    }
+
+
+def get_opening_checkpoint(filters, receivable_accounts, opening_date, filter_condition):
+    """
+    الرصيد حتى بداية شهر الرصيد الافتتاحي من نقاط الأرصدة الشهرية (بدون فلاتر إضافية)،
+    فيقتصر مسح الرصيد الافتتاحي على حركات ذلك الشهر فقط.
+    النتيجة: (رصيد النقاط، شرط بداية المسح، قيم الشرط)
+    """
+    # النقاط الشهرية بعملة الشركة فقط
+    if (
+        filter_condition
+        or filters.get("in_account_currency")
+        or not is_checkpoint_ready(filters.get("company"))
+    ):
+        return 0, "", []
+
+    opening_month = get_first_day(opening_date)
+    checkpoint_balance = get_checkpoint_balance(
+        filters.get("company"),
+        "Customer",
+        filters.get("customer"),
+        opening_month,
+        receivable_accounts,
+    )
+
+    return checkpoint_balance, "AND posting_date >= %s", [opening_month]
+
 
-    gl_entries = []
-    for account in receivable_accounts:
-        gl_query = """
+def get_recorded_customer_balance(customer):
+    return get_recorded_customer_balances([customer]).get(customer, 0)
+
+
+def get_recorded_customer_balances(customers):
+    """رصيد العملاء المسجل في سجل العميل (إن وجد الحقل) في استعلام واحد"""
+    if not customers or not frappe.get_meta("Customer").has_field("outstanding_amount"):
+        return {}
+
+    return {
+        customer: flt(balance)
+        for customer, balance in frappe.get_all(
+            "Customer",
+            filters={"name": ["in", customers]},
+            fields=["name", "outstanding_amount"],
+            as_list=1,
+        )
+    }
+
+
+# حقول حركات الأستاذ العام في كشف الحساب (صف الرصيد الافتتاحي يحمل المجاميع فقط)
+STATEMENT_GL_FIELDS = (
+    "name",
+    "posting_date",
+    "voucher_type",
+    "voucher_no",
+    "debit",
+    "credit",
+    "debit_in_account_currency",
+    "credit_in_account_currency",
+    "remarks",
+    "against",
+    "is_opening",
+    "account",
+    "against_voucher",
+    "against_voucher_type",
+    "creation",
+    "owner",
+    "cost_center",
+)
+
+# الحقول التي تُجمع في صف الرصيد الافتتاحي
+STATEMENT_GL_SUM_FIELDS = (
+    "debit",
+    "credit",
+    "debit_in_account_currency",
+    "credit_in_account_currency",
+)
+
+# سعر الصرف الفعلي للحركة: مبلغ عملة الشركة / مبلغ عملة الحساب
+STATEMENT_EXCHANGE_RATE = """CASE
+                    WHEN debit_in_account_currency - credit_in_account_currency != 0
+                    THEN (debit - credit)
+                        / (debit_in_account_currency - credit_in_account_currency)
+                END"""
+
+
+def get_statement_gl_query(
+    party_condition="party = %s",
+    opening_start_condition="",
+    filter_condition="",
+    partition_by_party=False,
+):
+    """
+    استعلام الكشف: صف رصيد افتتاحي مجمّع ثم حركات الفترة مع الرصيد التراكمي
+    بعملة الشركة وبعملة الحساب، وسعر الصرف لكل حركة.
+    القيم بالترتيب: الحسابات، الطرف، الشركة، تاريخ الرصيد الافتتاحي، قيم بداية الرصيد
+    الافتتاحي، قيم الفلاتر، ثم الحسابات، الطرف، الشركة، من تاريخ، إلى تاريخ، قيم الفلاتر.
+
+    مع partition_by_party يكون الطرف قائمة (party IN %s) ولكل طرف صف افتتاحي ورصيد مستقل.
+    """
+    opening_fields = ",\n                ".join(
+        "COALESCE(SUM({0}), 0) as {0}".format(field)
+        if field in STATEMENT_GL_SUM_FIELDS
+        else "NULL as {0}".format(field)
+        for field in STATEMENT_GL_FIELDS
+    )
+
+    return """
+        SELECT
+            entries.*,
+            SUM(entries.debit - entries.credit) OVER (
+                {partition}
+                ORDER BY entries.is_opening_row DESC, entries.posting_date,
+                    entries.creation, entries.name
+            ) as balance,
+            SUM(entries.debit_in_account_currency - entries.credit_in_account_currency) OVER (
+                {partition}
+                ORDER BY entries.is_opening_row DESC, entries.posting_date,
+                    entries.creation, entries.name
+            ) as balance_in_account_currency
+        FROM (
             SELECT
-                posting_date,
-                voucher_type,
-                voucher_no,
-                debit,
-                credit,
-                remarks,
-                against,
-                is_opening,
-                account,
-                against_voucher,
-                against_voucher_type,
-                creation,
-                owner,
-                CASE
-                    WHEN voucher_type = 'Sales Invoice' THEN 
-                        (SELECT grand_total FROM `tabSales Invoice` WHERE name = voucher_no)
-                    ELSE NULL
-                END as invoice_amount,
-                CASE
-                    WHEN voucher_type = 'Payment Entry' THEN 
-                        (SELECT payment_type FROM `tabPayment Entry` WHERE name = voucher_no)
-                    ELSE NULL
-                END as payment_type,
-                CASE
-                    WHEN voucher_type = 'Sales Invoice' THEN 
-                        (SELECT owner FROM `tabSales Invoice` WHERE name = voucher_no)
-                    WHEN voucher_type = 'Payment Entry' THEN 
-                        (SELECT owner FROM `tabPayment Entry` WHERE name = voucher_no)
-                    WHEN voucher_type = 'Journal Entry' THEN 
-                        (SELECT owner FROM `tabJournal Entry` WHERE name = voucher_no)
-                    ELSE owner
-                END as created_by,
-                CASE
-                    WHEN voucher_type = 'Sales Invoice' THEN 
-                        (SELECT cost_center FROM `tabSales Invoice` WHERE name = voucher_no)
-                    WHEN voucher_type = 'Payment Entry' THEN 
-                        (SELECT cost_center FROM `tabPayment Entry` WHERE name = voucher_no)
-                    WHEN voucher_type = 'Journal Entry' THEN 
-                        (SELECT cost_center FROM `tabJournal Entry` WHERE name = voucher_no)
-                    ELSE cost_center
-                END as cost_center
+                1 as is_opening_row,
+                {opening_party} as party,
+                {opening_fields},
+                NULL as exchange_rate
             FROM
                 `tabGL Entry`
             WHERE
-                account = %s
+                account IN %s
                 AND party_type = 'Customer'
-                AND party = %s
+                AND {party_condition}
                 AND company = %s
-                AND posting_date BETWEEN %s AND %s
+                AND posting_date <= %s
+                {opening_start_condition}
                 AND is_cancelled = 0
-        """
+                {filter_condition}
+            {opening_group_by}
 
-        gl_values = [
-            account,
-            filters.get("customer"),
-            filters.get("company"),
-            filters.get("from_date"),
-            filters.get("to_date"),
-        ]
+            UNION ALL
 
-        if user_condition:
-            gl_query += " AND " + user_condition
-            gl_values.extend(user_values)
+            SELECT
+                0 as is_opening_row,
+                party,
+                {fields},
+                {exchange_rate} as exchange_rate
+            FROM
+                `tabGL Entry`
+            WHERE
+                account IN %s
+                AND party_type = 'Customer'
+                AND {party_condition}
+                AND company = %s
+                AND posting_date BETWEEN %s AND %s
+                AND is_cancelled = 0
+                {filter_condition}
+        ) entries
+        ORDER BY
+            {order_party}entries.is_opening_row DESC, entries.posting_date,
+            entries.creation, entries.name
+    """.format(
+        partition="PARTITION BY entries.party" if partition_by_party else "",
+        opening_party="party" if partition_by_party else "MAX(party)",
+        opening_fields=opening_fields,
+        opening_group_by="GROUP BY party" if partition_by_party else "",
+        fields=",\n                ".join(STATEMENT_GL_FIELDS),
+        exchange_rate=STATEMENT_EXCHANGE_RATE,
+        party_condition=party_condition,
+        opening_start_condition=opening_start_condition,
+        filter_condition=filter_condition,
+        order_party="entries.party, " if partition_by_party else "",
+    )
 
-        if cost_center_condition:
-            gl_query += " AND " + cost_center_condition
-            gl_values.extend(cost_center_values)
 
-        if warehouse_condition:
-            gl_query += " AND " + warehouse_condition
-            gl_values.extend(warehouse_values)
+def get_statement_context(gl_entries):
+    """
+    بيانات المستندات اللازمة لبناء الكشف (استعلامات مجمّعة لكل نوع مستند):
+    قيمة الفاتورة ونوع السند والمنشئ ومركز التكلفة، حالات الفواتير، ومراجع السندات
+    """
+    invoices = get_statement_invoices(
+        [
+            entry.voucher_no
+            for entry in gl_entries
+            if entry.voucher_type == "Sales Invoice" and entry.voucher_no
+        ]
+    )
 
-        gl_query += " ORDER BY posting_date, creation"
+    return frappe._dict(
+        voucher_metadata=get_voucher_metadata(gl_entries),
+        invoices=invoices,
+        invoice_statuses=get_invoice_statuses(invoices),
+        payment_references=get_payment_references(
+            {
+                entry.voucher_no
+                for entry in gl_entries
+                if entry.voucher_type == "Payment Entry" and entry.voucher_no
+            }
+        ),
+    )
 
-        entries = frappe.db.sql(gl_query, tuple(gl_values), as_dict=1)
-        gl_entries.extend(entries)
 
-    gl_entries.sort(
-        key=lambda x: (x.posting_date, x.creation if hasattr(x, "creation") else "")
-    )
+def build_statement_rows(
+    gl_entries,
+    opening_balance,
+    opening_date,
+    balance_offset,
+    context,
+    include_opening=True,
+    include_total=True,
+    totals=None,
+):
+    """
+    بناء صفوف الكشف من حركات الأستاذ العام (بدون استعلامات):
+    الرصيد التراكمي محسوب مسبقاً في حقل balance لكل حركة.
+    في العرض المقسم لصفحات يتم تمرير إجماليات الفترة كاملة في totals.
+    """
+    voucher_metadata = context.voucher_metadata
+    invoice_statuses = context.invoice_statuses
+    payment_references = context.payment_references
 
     data = []
     balance = opening_balance
 
-    invoice_numbers = [
-        entry.voucher_no
-        for entry in gl_entries
-        if entry.voucher_type == "Sales Invoice" and entry.voucher_no
-    ]
-    invoice_statuses = get_invoice_statuses(invoice_numbers)
-
-    payment_references = get_payment_references()
-
-    payment_entries = [
-        entry.voucher_no
-        for entry in gl_entries
-        if entry.voucher_type == "Payment Entry" and entry.voucher_no
-    ]
-    payment_types = get_payment_types(payment_entries)
-
     for entry in gl_entries:
-        balance += flt(entry.debit) - flt(entry.credit)
+        balance = flt(entry.balance) + balance_offset
+
+        metadata = voucher_metadata.get((entry.voucher_type, entry.voucher_no)) or {}
+        entry.invoice_amount = metadata.get("invoice_amount")
+        entry.payment_type = metadata.get("payment_type")
+        entry.created_by = metadata.get("created_by") or entry.owner
+        entry.cost_center = metadata.get("cost_center") or entry.cost_center
 
         description = entry.remarks or ""
 
@@ -312,16 +773,10 @@ def get_customer_ledger_entries(filters):
 
         payment_type = ""
         if entry.voucher_type == "Payment Entry":
-            if hasattr(entry, "payment_type") and entry.payment_type:
-                if entry.payment_type == "Receive":
-                    payment_type = _("استلام")
-                elif entry.payment_type == "Pay":
-                    payment_type = _("دفع")
-            elif entry.voucher_no in payment_types:
-                if payment_types[entry.voucher_no] == "Receive":
-                    payment_type = _("استلام")
-                elif payment_types[entry.voucher_no] == "Pay":
-                    payment_type = _("دفع")
+            if entry.payment_type == "Receive":
+                payment_type = _("استلام")
+            elif entry.payment_type == "Pay":
+                payment_type = _("دفع")
 
         data.append(
             {
@@ -335,22 +790,29 @@ def get_customer_ledger_entries(filters):
                 "invoice_status": invoice_status,
                 "payment_type": payment_type,
                 "invoice_amount": (
-                    flt(entry.invoice_amount)
-                    if hasattr(entry, "invoice_amount") and entry.invoice_amount
-                    else None
-                ),
-                "created_by": (
-                    entry.created_by if hasattr(entry, "created_by") else None
-                ),
-                "cost_center": (
-                    entry.cost_center if hasattr(entry, "cost_center") else None
+                    flt(entry.invoice_amount) if entry.invoice_amount else None
                 ),
+                "created_by": entry.created_by,
+                "cost_center": entry.cost_center,
             }
         )
 
-    if gl_entries:
-        total_debit = sum(flt(entry.debit) for entry in gl_entries)
-        total_credit = sum(flt(entry.credit) for entry in gl_entries)
+        # وضع عملة الحساب: سعر الصرف والرصيد بعملة الشركة لكل حركة
+        if entry.get("company_balance") is not None:
+            data[-1].update(
+                {
+                    "exchange_rate": flt(entry.exchange_rate) or None,
+                    "company_balance": flt(entry.company_balance),
+                    "currency": entry.currency,
+                }
+            )
+
+    if gl_entries and include_total:
+        if totals:
+            total_debit, total_credit = flt(totals["debit"]), flt(totals["credit"])
+        else:
+            total_debit = sum(flt(entry.debit) for entry in gl_entries)
+            total_credit = sum(flt(entry.credit) for entry in gl_entries)
 
         data.append(
             {
@@ -367,6 +829,9 @@ def get_customer_ledger_entries(filters):
             }
         )
 
+    if not include_opening:
+        return data
+
     data.insert(
         0,
         {
@@ -383,46 +848,282 @@ def get_customer_ledger_entries(filters):
         },
     )
 
-    return opening_balance, opening_date, data
+    return data
+
+
+DEFAULT_PAGE_LENGTH = 500
+MAX_PAGE_LENGTH = 5000
+
+
+def check_report_permission():
+    if not frappe.get_cached_doc("Report", "Customer Statement Report").is_permitted():
+        frappe.throw(_("ليس لديك صلاحية للوصول إلى كشف حساب العملاء"), frappe.PermissionError)
+
+
+@frappe.whitelist()
+def get_statement_page(filters, cursor=None, page_length=DEFAULT_PAGE_LENGTH):
+    """
+    صفحة واحدة من كشف الحساب مع الرصيد المرحّل عند حدود الصفحة.
+    الترقيم بالمفتاح (posting_date, creation, name) فتكلفة الصفحة N مثل الصفحة الأولى؛
+    next_cursor يحمل آخر مفتاح والرصيد والإجماليات المرحّلة ويُعاد كما هو للصفحة التالية.
+    """
+    check_report_permission()
+
+    filters = frappe._dict(frappe.parse_json(filters))
+    cursor = frappe._dict(frappe.parse_json(cursor)) if cursor else None
+    page_length = min(cint(page_length) or DEFAULT_PAGE_LENGTH, MAX_PAGE_LENGTH)
+
+    if not filters.get("customer"):
+        frappe.throw(_("يرجى تحديد العميل"))
+
+    receivable_accounts = get_receivable_accounts(
+        filters.get("company"), filters.get("customer")
+    )
+    if not receivable_accounts:
+        return {"data": [], "next_cursor": None}
+
+    opening_date = add_days(getdate(filters.get("from_date")), -1)
+    filter_condition, filter_values = get_gl_filter_condition(filters, receivable_accounts)
+
+    if cursor:
+        opening_balance = carried_balance = flt(cursor.balance)
+    else:
+        opening_balance = carried_balance = get_statement_opening_balance(
+            filters, receivable_accounts, opening_date, filter_condition, filter_values
+        )
+
+    keyset_condition = ""
+    keyset_values = []
+    if cursor:
+        keyset_condition = """AND (posting_date > %s
+            OR (posting_date = %s AND (creation > %s
+                OR (creation = %s AND name > %s))))"""
+        keyset_values = [
+            cursor.posting_date,
+            cursor.posting_date,
+            cursor.creation,
+            cursor.creation,
+            cursor.name,
+        ]
+
+    # صف إضافي لمعرفة وجود صفحة تالية
+    gl_entries = frappe.db.sql(
+        """
+        SELECT {fields}
+        FROM `tabGL Entry`
+        WHERE
+            account IN %s
+            AND party_type = 'Customer'
+            AND party = %s
+            AND company = %s
+            AND posting_date BETWEEN %s AND %s
+            AND is_cancelled = 0
+            {filter_condition}
+            {keyset_condition}
+        ORDER BY posting_date, creation, name
+        LIMIT %s
+    """.format(
+            fields=", ".join(STATEMENT_GL_FIELDS),
+            filter_condition=filter_condition,
+            keyset_condition=keyset_condition,
+        ),
+        tuple(
+            [
+                tuple(receivable_accounts),
+                filters.get("customer"),
+                filters.get("company"),
+                filters.get("from_date"),
+                filters.get("to_date"),
+                *filter_values,
+                *keyset_values,
+                page_length + 1,
+            ]
+        ),
+        as_dict=1,
+    )
+
+    is_last_page = len(gl_entries) <= page_length
+    gl_entries = gl_entries[:page_length]
+
+    # الرصيد التراكمي داخل الصفحة يبدأ من الرصيد المرحّل
+    running_balance = 0
+    for entry in gl_entries:
+        running_balance += flt(entry.debit) - flt(entry.credit)
+        entry.balance = running_balance
+
+    totals = {
+        "debit": flt((cursor or {}).get("total_debit"))
+        + sum(flt(entry.debit) for entry in gl_entries),
+        "credit": flt((cursor or {}).get("total_credit"))
+        + sum(flt(entry.credit) for entry in gl_entries),
+    }
+
+    data = build_statement_rows(
+        gl_entries,
+        opening_balance,
+        opening_date,
+        carried_balance,
+        get_statement_context(gl_entries),
+        include_opening=not cursor,
+        include_total=is_last_page,
+        totals=totals,
+    )
+
+    next_cursor = None
+    if not is_last_page:
+        last_entry = gl_entries[-1]
+        next_cursor = {
+            "posting_date": str(last_entry.posting_date),
+            "creation": str(last_entry.creation),
+            "name": last_entry.name,
+            "balance": carried_balance + running_balance,
+            "total_debit": totals["debit"],
+            "total_credit": totals["credit"],
+        }
+
+    return {"data": data, "next_cursor": next_cursor}
+
+
+def get_statement_opening_balance(
+    filters, receivable_accounts, opening_date, filter_condition, filter_values
+):
+    """الرصيد الافتتاحي بنفس منطق get_customer_ledger_entries (بدون حركات الفترة)"""
+    checkpoint_balance, opening_start_condition, opening_start_values = get_opening_checkpoint(
+        filters, receivable_accounts, opening_date, filter_condition
+    )
+
+    balance = frappe.db.sql(
+        """
+        SELECT SUM(debit) - SUM(credit)
+        FROM `tabGL Entry`
+        WHERE
+            account IN %s
+            AND party_type = 'Customer'
+            AND party = %s
+            AND company = %s
+            AND posting_date <= %s
+            {opening_start_condition}
+            AND is_cancelled = 0
+            {filter_condition}
+    """.format(
+            opening_start_condition=opening_start_condition,
+            filter_condition=filter_condition,
+        ),
+        tuple(
+            [
+                tuple(receivable_accounts),
+                filters.get("customer"),
+                filters.get("company"),
+                opening_date,
+                *opening_start_values,
+                *filter_values,
+            ]
+        ),
+    )
+
+    opening_balance = checkpoint_balance + flt(balance[0][0] if balance else 0)
+    if opening_balance == 0:
+        opening_balance = get_recorded_customer_balance(filters.get("customer"))
+
+    return opening_balance
+
+
+RECEIVABLE_ACCOUNTS_CACHE_KEY = "muzaini_customer_receivable_accounts"
 
 
 def get_receivable_accounts(company, customer):
-    accounts = []
+    """الحسابات المدينة للعميل من التخزين المؤقت: {الشركة: الحسابات} لكل عميل"""
+    return get_receivable_accounts_map(company, [customer])[customer]
+
+
+def get_receivable_accounts_map(company, customers):
+    """
+    الحسابات المدينة لعدة عملاء {العميل: الحسابات}: من التخزين المؤقت، والعملاء غير المخزنين
+    يتم البحث عنهم معاً في نفس الاستعلامات
+    """
+    cache = frappe.cache()
+    accounts_by_customer = {}
+    cached_maps = {}
+
+    for customer in customers:
+        cached_maps[customer] = cache.hget(RECEIVABLE_ACCOUNTS_CACHE_KEY, customer) or {}
+        if company in cached_maps[customer]:
+            accounts_by_customer[customer] = cached_maps[customer][company]
+
+    missing_customers = [customer for customer in customers if customer not in accounts_by_customer]
+    if missing_customers:
+        found_accounts = find_receivable_accounts(company, missing_customers)
+        for customer in missing_customers:
+            accounts_by_customer[customer] = found_accounts.get(customer) or []
+            cached_maps[customer][company] = accounts_by_customer[customer]
+            cache.hset(RECEIVABLE_ACCOUNTS_CACHE_KEY, customer, cached_maps[customer])
+
+    return accounts_by_customer
+
+
+def clear_receivable_accounts_cache(doc, method=None, *args, **kwargs):
+    """مسح حسابات العميل المخزنة عند تعديل العميل (ومعه جدول Party Account) أو حذفه أو إعادة تسميته"""
+    cache = frappe.cache()
+    cache.hdel(RECEIVABLE_ACCOUNTS_CACHE_KEY, doc.name)
+
+    # after_rename: (الاسم القديم، الاسم الجديد، دمج)
+    if args:
+        cache.hdel(RECEIVABLE_ACCOUNTS_CACHE_KEY, args[0])
+
+
+def clear_receivable_accounts_for_gl_entry(doc, method=None):
+    """قيد على حساب غير موجود في قائمة العميل المخزنة يعني حساباً جديداً: يُعاد البحث في المرة القادمة"""
+    if doc.party_type != "Customer" or not doc.party:
+        return
+
+    cache = frappe.cache()
+    accounts_map = cache.hget(RECEIVABLE_ACCOUNTS_CACHE_KEY, doc.party)
+    if accounts_map and doc.account not in (accounts_map.get(doc.company) or []):
+        cache.hdel(RECEIVABLE_ACCOUNTS_CACHE_KEY, doc.party)
+
+
+def find_receivable_accounts(company, customers):
+    """
+    البحث عن الحسابات المدينة لعدة عملاء باستعلام واحد لكل طريقة:
+    حسابات العميل (Party Account)، ثم الحسابات المستخدمة في قيوده، ثم كل الحسابات المدينة للشركة
+    """
+    accounts = {}
 
     try:
-        party_accounts = frappe.get_all(
+        for d in frappe.get_all(
             "Party Account",
-            filters={"parenttype": "Customer", "parent": customer, "company": company},
-            fields=["account"],
-        )
-
-        if party_accounts:
-            accounts.extend([d.account for d in party_accounts])
+            filters={"parenttype": "Customer", "parent": ["in", customers], "company": company},
+            fields=["parent", "account"],
+        ):
+            accounts.setdefault(d.parent, []).append(d.account)
     except Exception:
         pass
 
-    if not accounts:
+    missing_customers = [customer for customer in customers if not accounts.get(customer)]
+    if missing_customers:
         try:
             gl_accounts = frappe.db.sql(
                 """
-                SELECT DISTINCT account
+                SELECT party, account
                 FROM `tabGL Entry`
                 WHERE party_type = 'Customer'
-                AND party = %s
+                AND party IN %s
                 AND company = %s
                 AND is_cancelled = 0
-                ORDER BY creation DESC
+                GROUP BY party, account
+                ORDER BY MAX(creation) DESC
             """,
-                (customer, company),
+                (tuple(missing_customers), company),
                 as_dict=1,
             )
 
-            if gl_accounts:
-                accounts.extend([d.account for d in gl_accounts])
+            for d in gl_accounts:
+                accounts.setdefault(d.party, []).append(d.account)
         except Exception:
             pass
 
-    if not accounts:
+    missing_customers = [customer for customer in customers if not accounts.get(customer)]
+    if missing_customers:
         try:
             receivable_accounts = frappe.get_all(
                 "Account",
@@ -431,64 +1132,85 @@ def get_receivable_accounts(company, customer):
                     "account_type": "Receivable",
                     "is_group": 0,
                 },
-                fields=["name"],
+                pluck="name",
             )
 
-            if receivable_accounts:
-                accounts.extend([d.name for d in receivable_accounts])
+            for customer in missing_customers:
+                accounts[customer] = list(receivable_accounts)
         except Exception:
             pass
 
     return accounts
 
 
-def get_payment_references():
-    references = {}
+# عدد سندات الصرف في كل استعلام مراجع
+PAYMENT_REFERENCES_CHUNK_SIZE = 1000
 
-    payment_refs = frappe.db.sql(
-        """
-        SELECT parent, reference_doctype, reference_name
-        FROM `tabPayment Entry Reference`
-        WHERE docstatus = 1
-    """,
-        as_dict=1,
-    )
 
-    for ref in payment_refs:
-        if ref.parent not in references:
-            references[ref.parent] = []
-        references[ref.parent].append(ref)
+def get_payment_references(payment_entries):
+    """مراجع سندات الصرف الموجودة في الكشف فقط (على دفعات) بدلاً من الجدول كاملاً"""
+    references = {}
 
-    return references
+    payment_entries = list(payment_entries or [])
+    for start in range(0, len(payment_entries), PAYMENT_REFERENCES_CHUNK_SIZE):
+        payment_refs = frappe.db.sql(
+            """
+            SELECT parent, reference_doctype, reference_name
+            FROM `tabPayment Entry Reference`
+            WHERE docstatus = 1
+                AND parenttype = 'Payment Entry'
+                AND parent IN %s
+        """,
+            (tuple(payment_entries[start : start + PAYMENT_REFERENCES_CHUNK_SIZE]),),
+            as_dict=1,
+        )
 
+        for ref in payment_refs:
+            if ref.parent not in references:
+                references[ref.parent] = []
+            references[ref.parent].append(ref)
 
-def get_payment_types(payment_entries):
-    payment_types = {}
+    return references
 
-    if not payment_entries:
-        return payment_types
 
-    payments = frappe.get_all(
-        "Payment Entry",
-        filters={"name": ["in", payment_entries]},
-        fields=["name", "payment_type"],
-    )
+# حقول بيانات المستندات التي تظهر في كشف الحساب لكل نوع مستند
+VOUCHER_METADATA_FIELDS = {
+    "Sales Invoice": ["grand_total as invoice_amount", "owner as created_by", "cost_center"],
+    "Payment Entry": ["payment_type", "owner as created_by", "cost_center"],
+    "Journal Entry": ["owner as created_by", "cost_center"],
+}
 
-    for payment in payments:
-        payment_types[payment.name] = payment.payment_type
 
-    return payment_types
+def get_voucher_metadata(gl_entries):
+    """
+    بيانات المستندات المرتبطة بحركات الأستاذ العام: استعلام IN واحد لكل نوع مستند
+    بدلاً من استعلامات فرعية لكل حركة. النتيجة: {(نوع المستند، رقم المستند): البيانات}
+    """
+    vouchers_by_type = {}
+    for entry in gl_entries:
+        if entry.voucher_type in VOUCHER_METADATA_FIELDS and entry.voucher_no:
+            vouchers_by_type.setdefault(entry.voucher_type, set()).add(entry.voucher_no)
+
+    metadata = {}
+    for voucher_type, voucher_nos in vouchers_by_type.items():
+        for row in frappe.get_all(
+            voucher_type,
+            filters={"name": ["in", list(voucher_nos)]},
+            fields=["name"] + VOUCHER_METADATA_FIELDS[voucher_type],
+        ):
+            metadata[(voucher_type, row.name)] = row
 
+    return metadata
 
-def get_invoice_statuses(invoice_numbers):
-    invoice_statuses = {}
 
+def get_statement_invoices(invoice_numbers):
+    """فواتير الكشف في استعلام واحد لحساب حالاتها"""
     if not invoice_numbers:
-        return invoice_statuses
+        return []
 
-    invoices = frappe.get_all(
+    return frappe.get_all(
         "Sales Invoice",
-        filters={"name": ["in", invoice_numbers]},
+        filters={"name": ["in", list(set(invoice_numbers))]},
         fields=[
             "name",
             "status",
@@ -499,6 +1221,10 @@ def get_invoice_statuses(invoice_numbers):
         ],
     )
 
+
+def get_invoice_statuses(invoices):
+    invoice_statuses = {}
+
     for invoice in invoices:
         status = ""
 
@@ -530,27 +1256,185 @@ def get_invoice_statuses(invoice_numbers):
     return invoice_statuses
 
 
-def get_user_condition(filters):
-    if not filters.get("users"):
+# حدود فترات أعمار الديون بالأيام (None = ما بعد آخر حد)
+AGING_BUCKETS = (
+    (30, "0-30"),
+    (60, "31-60"),
+    (90, "61-90"),
+    (None, "90+"),
+)
+
+
+def get_aging(company, customers, as_of_date, vouchers=None, in_account_currency=False):
+    """
+    أعمار الديون وقائمة الفواتير المفتوحة لكل فواتير العملاء كما كانت في نهاية الفترة
+    (وليس فواتير الفترة فقط) في استعلام واحد: المتبقي من دفتر الدفعات (Payment Ledger Entry)
+    بحركات حتى نهاية الفترة، فالفاتورة المسددة بعدها تظهر مفتوحة في الكشف التاريخي.
+    العمر من تاريخ الاستحقاق (أو تاريخ الفاتورة) حتى نهاية الفترة؛ المرتجعات المفتوحة بقيمة سالبة.
+    vouchers: المستندات المطابقة لفلاتر الكشف (get_filtered_vouchers) أو None بدون فلاتر.
+    """
+    buckets = {label: 0 for _limit, label in AGING_BUCKETS}
+    open_invoices = []
+
+    invoices = []
+    if customers and vouchers != ():
+        conditions = ""
+        values = {
+            "company": company,
+            "customers": tuple(customers),
+            "as_of_date": as_of_date,
+        }
+        if vouchers is not None:
+            conditions = "AND ple.against_voucher_no IN %(vouchers)s"
+            values["vouchers"] = tuple(vouchers)
+
+        invoices = frappe.db.sql(
+            """
+            SELECT
+                si.name,
+                si.posting_date,
+                si.due_date,
+                si.grand_total,
+                SUM(ple.{amount_field}) as outstanding_amount
+            FROM `tabPayment Ledger Entry` ple
+            INNER JOIN `tabSales Invoice` si
+                ON si.name = ple.against_voucher_no
+            WHERE ple.against_voucher_type = 'Sales Invoice'
+                AND ple.company = %(company)s
+                AND ple.party_type = 'Customer'
+                AND ple.party IN %(customers)s
+                AND ple.posting_date <= %(as_of_date)s
+                AND ple.delinked = 0
+                AND si.docstatus = 1
+                AND si.posting_date <= %(as_of_date)s
+                {conditions}
+            GROUP BY si.name, si.posting_date, si.due_date, si.grand_total
+            HAVING ROUND(outstanding_amount, 2) != 0
+        """.format(
+                amount_field="amount_in_account_currency" if in_account_currency else "amount",
+                conditions=conditions,
+            ),
+            values,
+            as_dict=1,
+        )
+
+    for invoice in invoices:
+        outstanding_amount = flt(invoice.outstanding_amount)
+
+        age = date_diff(as_of_date, invoice.due_date or invoice.posting_date)
+        bucket = next(
+            label for limit, label in AGING_BUCKETS if limit is None or age <= limit
+        )
+        buckets[bucket] += outstanding_amount
+
+        open_invoices.append(
+            {
+                "invoice": invoice.name,
+                "posting_date": invoice.posting_date,
+                "due_date": invoice.due_date,
+                "grand_total": flt(invoice.grand_total),
+                "outstanding_amount": outstanding_amount,
+                "age": age,
+                "bucket": bucket,
+            }
+        )
+
+    open_invoices.sort(key=lambda row: (row["due_date"] or row["posting_date"], row["invoice"]))
+
+    return frappe._dict(buckets=buckets, open_invoices=open_invoices)
+
+
+def get_gl_filter_condition(filters, receivable_accounts):
+    """
+    شرط فلاتر المستخدمين ومراكز التكلفة والمخازن: تُحل الفلاتر أولاً إلى مجموعة
+    أرقام المستندات المطابقة (استعلام واحد)، ثم يستخدم الرصيد الافتتاحي وحركات الفترة
+    نفس المجموعة بدلاً من تكرار الاستعلامات الفرعية لكل حركة
+    """
+    vouchers = get_filtered_vouchers(filters, receivable_accounts)
+
+    if vouchers is None:
         return "", []
 
-    users = filters.get("users")
-    if not isinstance(users, list):
-        users = [users]
+    if not vouchers:
+        return "AND 1 = 0", []
+
+    return "AND voucher_no IN %s", [vouchers]
+
+
+def get_filtered_vouchers(filters, receivable_accounts):
+    """أرقام مستندات العميل المطابقة للفلاتر، أو None إذا لم يتم تحديد أي فلتر"""
+    conditions = []
+    values = []
+
+    for get_condition in (
+        get_user_condition,
+        get_cost_center_condition,
+        get_warehouse_condition,
+    ):
+        condition, condition_values = get_condition(filters)
+        if condition:
+            conditions.append(condition)
+            values.extend(condition_values)
 
+    if not conditions:
+        return None
+
+    vouchers = frappe.db.sql_list(
+        """
+        SELECT DISTINCT gl.voucher_no
+        FROM
+            `tabGL Entry` gl
+        LEFT JOIN `tabSales Invoice` si
+            ON gl.voucher_type = 'Sales Invoice' AND si.name = gl.voucher_no
+        LEFT JOIN `tabPayment Entry` pe
+            ON gl.voucher_type = 'Payment Entry' AND pe.name = gl.voucher_no
+        LEFT JOIN `tabJournal Entry` je
+            ON gl.voucher_type = 'Journal Entry' AND je.name = gl.voucher_no
+        WHERE
+            gl.account IN %s
+            AND gl.party_type = 'Customer'
+            AND gl.party = %s
+            AND gl.company = %s
+            AND gl.posting_date <= %s
+            AND gl.is_cancelled = 0
+            AND {conditions}
+    """.format(
+            conditions=" AND ".join(conditions)
+        ),
+        tuple(
+            [
+                tuple(receivable_accounts),
+                filters.get("customer"),
+                filters.get("company"),
+                filters.get("to_date"),
+                *values,
+            ]
+        ),
+    )
+
+    return tuple(vouchers)
+
+
+def get_filter_list(filters, fieldname):
+    values = filters.get(fieldname) or []
+    if not isinstance(values, list):
+        values = [values]
+
+    return values
+
+
+def get_user_condition(filters):
+    users = get_filter_list(filters, "users")
     if not users:
         return "", []
 
     placeholders = ", ".join(["%s"] * len(users))
     condition = """(
-        CASE
-            WHEN voucher_type = 'Sales Invoice' THEN 
-                (SELECT owner FROM `tabSales Invoice` WHERE name = voucher_no)
-            WHEN voucher_type = 'Payment Entry' THEN 
-                (SELECT owner FROM `tabPayment Entry` WHERE name = voucher_no)
-            WHEN voucher_type = 'Journal Entry' THEN 
-                (SELECT owner FROM `tabJournal Entry` WHERE name = voucher_no)
-            ELSE owner
+        CASE gl.voucher_type
+            WHEN 'Sales Invoice' THEN si.owner
+            WHEN 'Payment Entry' THEN pe.owner
+            WHEN 'Journal Entry' THEN je.owner
+            ELSE gl.owner
         END IN ({0})
     )""".format(
         placeholders
@@ -560,31 +1444,23 @@ def get_user_condition(filters):
 
 
 def get_cost_center_condition(filters):
-    if not filters.get("cost_centers"):
-        return "", []
-
-    cost_centers = filters.get("cost_centers")
-    if not isinstance(cost_centers, list):
-        cost_centers = [cost_centers]
-
+    cost_centers = get_filter_list(filters, "cost_centers")
     if not cost_centers:
         return "", []
 
     placeholders = ", ".join(["%s"] * len(cost_centers))
     condition = """(
-        CASE
-            WHEN voucher_type = 'Sales Invoice' THEN 
-                (SELECT cost_center FROM `tabSales Invoice` WHERE name = voucher_no)
-            WHEN voucher_type = 'Payment Entry' THEN 
-                (SELECT cost_center FROM `tabPayment Entry` WHERE name = voucher_no)
-            WHEN voucher_type = 'Journal Entry' THEN 
-                (SELECT cost_center FROM `tabJournal Entry` WHERE name = voucher_no)
-            ELSE cost_center
+        CASE gl.voucher_type
+            WHEN 'Sales Invoice' THEN si.cost_center
+            WHEN 'Payment Entry' THEN pe.cost_center
+            WHEN 'Journal Entry' THEN je.cost_center
+            ELSE gl.cost_center
         END IN ({0})
-        OR 
-        (voucher_type = 'Sales Invoice' AND voucher_no IN 
-            (SELECT parent FROM `tabSales Invoice Item` WHERE cost_center IN ({0}))
-        )
+        OR
+        (gl.voucher_type = 'Sales Invoice' AND EXISTS (
+            SELECT 1 FROM `tabSales Invoice Item` sii
+            WHERE sii.parent = gl.voucher_no AND sii.cost_center IN ({0})
+        ))
     )""".format(
         placeholders
     )
@@ -595,20 +1471,15 @@ def get_cost_center_condition(filters):
 
 
 def get_warehouse_condition(filters):
-    if not filters.get("warehouses"):
-        return "", []
-
-    warehouses = filters.get("warehouses")
-    if not isinstance(warehouses, list):
-        warehouses = [warehouses]
-
+    warehouses = get_filter_list(filters, "warehouses")
     if not warehouses:
         return "", []
 
     placeholders = ", ".join(["%s"] * len(warehouses))
     condition = """(
-        (voucher_type = 'Sales Invoice' AND voucher_no IN 
-            (SELECT parent FROM `tabSales Invoice Item` WHERE warehouse IN ({0}))
+        gl.voucher_type = 'Sales Invoice' AND EXISTS (
+            SELECT 1 FROM `tabSales Invoice Item` sii
+            WHERE sii.parent = gl.voucher_no AND sii.warehouse IN ({0})
         )
     )""".format(
         placeholders
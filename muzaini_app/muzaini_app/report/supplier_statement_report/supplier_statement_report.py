@@ -6,6 +6,10 @@ from frappe import _
 from frappe.utils import flt, getdate, add_days, cint
 import datetime
 
+from muzaini_app.muzaini_app.doctype.party_balance_checkpoint.party_balance_checkpoint import (
+    get_party_opening_balance,
+)
+
 
 def execute(filters=None):
     """Main execution function for the report"""
@@ -306,31 +310,13 @@ def get_gl_entries(filters):
 
 def get_opening_balance(filters):
     """Calculate opening balance before the from_date"""
-    opening_balance = 0
-    values = {
-        "company": filters.get("company"),
-        "from_date": filters.get("from_date"),
-        "supplier": filters.get("supplier"),
-    }
-
-    # Direct query to calculate opening balance from GL entries
-    query = """
-        SELECT
-            SUM(debit) - SUM(credit) as opening_balance
-        FROM
-            `tabGL Entry` gle
-        WHERE
-            gle.company = %(company)s
-            AND gle.posting_date < %(from_date)s
-            AND gle.party_type = 'Supplier'
-            AND gle.party = %(supplier)s
-            AND gle.is_cancelled = 0
-    """
-
-    opening_balance_data = frappe.db.sql(query, values, as_dict=1)
-
-    if opening_balance_data and opening_balance_data[0].opening_balance is not None:
-        opening_balance = flt(opening_balance_data[0].opening_balance)
+    # Latest monthly checkpoint plus the GL movements of the current month only
+    opening_balance = get_party_opening_balance(
+        filters.get("company"),
+        "Supplier",
+        filters.get("supplier"),
+        add_days(getdate(filters.get("from_date")), -1),
+    )
 
     # Double-check against supplier ledger if available
     try:
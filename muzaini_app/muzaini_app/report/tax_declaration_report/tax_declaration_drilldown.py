@@ -0,0 +1,268 @@
+# Copyright (c) 2026, Mohamed AbdElsabour and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import add_months, cint, get_last_day, getdate
+
+from muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_report import (
+    TAX_BUCKET_CONDITIONS,
+    can_use_vat_period_ledger,
+    check_report_permission,
+    get_expense_query_parts,
+    get_expense_row_code,
+    get_expense_voucher_types,
+    get_frozen_declaration,
+    get_invoice_query_parts,
+    get_tax_accounts,
+)
+
+DEFAULT_PAGE_LENGTH = 500
+MAX_PAGE_LENGTH = 5000
+
+ALL_BUCKETS = ("taxable", "non_taxable", "taxable_returns", "non_taxable_returns")
+
+# صفوف الإقرار المبنية على الفواتير: (نوع الفاتورة، التصنيفات الضريبية الداخلة في الصف)
+INVOICE_ROW_BUCKETS = {
+    "sales_taxable": ("Sales Invoice", ("taxable",)),
+    "sales_non_taxable": ("Sales Invoice", ("non_taxable",)),
+    "sales_total": ("Sales Invoice", ("taxable", "non_taxable")),
+    "sales_returns_taxable": ("Sales Invoice", ("taxable_returns",)),
+    "sales_returns_non_taxable": ("Sales Invoice", ("non_taxable_returns",)),
+    "sales_returns_total": ("Sales Invoice", ("taxable_returns", "non_taxable_returns")),
+    "sales_net": ("Sales Invoice", ALL_BUCKETS),
+    "purchase_taxable": ("Purchase Invoice", ("taxable",)),
+    "purchase_non_taxable": ("Purchase Invoice", ("non_taxable",)),
+    "purchase_total": ("Purchase Invoice", ("taxable", "non_taxable")),
+    "purchase_returns_taxable": ("Purchase Invoice", ("taxable_returns",)),
+    "purchase_returns_non_taxable": ("Purchase Invoice", ("non_taxable_returns",)),
+    "purchase_returns_total": ("Purchase Invoice", ("taxable_returns", "non_taxable_returns")),
+    "purchase_net": ("Purchase Invoice", ALL_BUCKETS),
+}
+
+PARTY_FIELDS = {"Sales Invoice": "customer", "Purchase Invoice": "supplier"}
+
+
+@frappe.whitelist()
+def get_drilldown(filters, row_code, period=None, after=None, page_length=DEFAULT_PAGE_LENGTH):
+    """
+    المستندات المكوّنة لصف من صفوف الإقرار، صفحة واحدة في كل طلب.
+    الترقيم بالمفتاح (تاريخ الترحيل، رقم المستند): يمرر العميل next_cursor
+    من الصفحة السابقة في after، فتكلفة أي صفحة مثل تكلفة الصفحة الأولى.
+
+    التفصيل يُحسب دائماً من الفواتير والقيود الحالية: إذا كان الإقرار معروضاً من نسخة مجمّدة
+    أو من سجل الفترات الضريبية فقد لا يطابق مجموع المستندات رقم الصف، ويُبين ذلك في
+    frozen_snapshot و served_from_ledger و message.
+    """
+    check_report_permission()
+
+    report_filters = frappe._dict(frappe.parse_json(filters))
+    filters = get_drilldown_filters(filters, period)
+    page_length = min(cint(page_length) or DEFAULT_PAGE_LENGTH, MAX_PAGE_LENGTH)
+
+    vouchers = get_drilldown_page(filters, row_code, parse_cursor(after), page_length)
+
+    next_cursor = None
+    if len(vouchers) == page_length:
+        next_cursor = "{0}|{1}".format(vouchers[-1].posting_date, vouchers[-1].voucher_no)
+
+    return {
+        "vouchers": vouchers,
+        "next_cursor": next_cursor,
+        **get_drilldown_source(report_filters),
+    }
+
+
+def get_drilldown_source(report_filters):
+    """مصدر رقم الصف في الإقرار المعروض مقارنة بالتفصيل المحسوب من البيانات الحالية"""
+    frozen_declaration = get_frozen_declaration(report_filters)
+    if frozen_declaration:
+        return {
+            "is_live": 1,
+            "frozen_snapshot": frozen_declaration.name,
+            "served_from_ledger": 0,
+            "message": _(
+                "الإقرار مجمّد بتاريخ {0}؛ التفصيل من البيانات الحالية وقد لا يطابق الأرقام المجمّدة"
+            ).format(frozen_declaration.frozen_on),
+        }
+
+    served_from_ledger = cint(
+        not report_filters.get("reconcile") and can_use_vat_period_ledger(report_filters)
+    )
+    return {
+        "is_live": 1,
+        "frozen_snapshot": None,
+        "served_from_ledger": served_from_ledger,
+        "message": _(
+            "ملخص الإقرار من سجل الفترات الضريبية؛ التفصيل من الفواتير الحالية"
+        )
+        if served_from_ledger
+        else None,
+    }
+
+
+def iter_drilldown_vouchers(filters, row_code, page_length=DEFAULT_PAGE_LENGTH):
+    """كل مستندات الصف صفحة بعد صفحة (ذاكرة ثابتة بحجم الصفحة مهما كان عدد المستندات)"""
+    cursor = None
+    while True:
+        vouchers = get_drilldown_page(filters, row_code, cursor, page_length)
+        yield from vouchers
+
+        if len(vouchers) < page_length:
+            break
+
+        cursor = (vouchers[-1].posting_date, vouchers[-1].voucher_no)
+
+
+def get_drilldown_filters(filters, period=None):
+    filters = frappe._dict(frappe.parse_json(filters))
+
+    # فترة من أعمدة الإقرار المقارن (مثل 2026-03 أو 2026-Q1) داخل حدود الفلتر
+    if period:
+        from_date, to_date = get_period_dates(period)
+        filters.from_date = max(from_date, getdate(filters.from_date or from_date))
+        filters.to_date = min(to_date, getdate(filters.to_date or to_date))
+
+    if not filters.get("from_date") or not filters.get("to_date"):
+        frappe.throw(_("يرجى تحديد الفترة"))
+
+    return filters
+
+
+def get_period_dates(period):
+    """تاريخ بداية ونهاية مفتاح الفترة الناتج من get_period_key"""
+    try:
+        year, part = period.split("-")
+        if part.startswith("Q"):
+            from_date = getdate("{0}-{1:02d}-01".format(year, (int(part[1:]) - 1) * 3 + 1))
+            return from_date, get_last_day(add_months(from_date, 2))
+
+        from_date = getdate("{0}-{1}-01".format(year, part))
+        return from_date, get_last_day(from_date)
+    except ValueError:
+        frappe.throw(_("فترة غير صحيحة: {0}").format(period))
+
+
+def parse_cursor(after):
+    if not after:
+        return None
+
+    # المؤشر بالصيغة "التاريخ|رقم المستند" كما يعيده next_cursor
+    parts = str(after).split("|", 1)
+    if len(parts) != 2 or not parts[1]:
+        frappe.throw(_("مؤشر صفحة غير صحيح: {0}").format(after))
+
+    try:
+        posting_date = getdate(parts[0])
+    except Exception:
+        frappe.throw(_("مؤشر صفحة غير صحيح: {0}").format(after))
+
+    return posting_date, parts[1]
+
+
+def get_drilldown_page(filters, row_code, cursor, page_length):
+    if row_code in INVOICE_ROW_BUCKETS:
+        doctype, buckets = INVOICE_ROW_BUCKETS[row_code]
+        return get_invoice_vouchers(doctype, buckets, filters, cursor, page_length)
+
+    for voucher_type in get_expense_voucher_types(filters):
+        if get_expense_row_code(voucher_type) == row_code:
+            return get_expense_vouchers(voucher_type, filters, cursor, page_length)
+
+    frappe.throw(_("لا يوجد تفصيل مستندات لهذا الصف: {0}").format(row_code))
+
+
+def get_keyset_condition(date_field, name_field, cursor, values):
+    if not cursor:
+        return ""
+
+    values["after_date"], values["after_name"] = cursor
+    return """AND ({0} > %(after_date)s
+            OR ({0} = %(after_date)s AND {1} > %(after_name)s))""".format(date_field, name_field)
+
+
+def get_invoice_vouchers(doctype, buckets, filters, cursor, page_length):
+    """فواتير الصف بنفس شروط ملخص الإقرار (get_invoice_query_parts وTAX_BUCKET_CONDITIONS)"""
+    query = get_invoice_query_parts(doctype, filters)
+    if not query:
+        return []
+
+    values = dict(query.values, voucher_type=doctype, page_length=page_length)
+    bucket_condition = " OR ".join(
+        "({0})".format(TAX_BUCKET_CONDITIONS[bucket]) for bucket in buckets
+    )
+
+    return frappe.db.sql(
+        """
+        SELECT
+            %(voucher_type)s as voucher_type,
+            name as voucher_no,
+            posting_date,
+            {party_field} as party,
+            base_grand_total * {weight} as amount,
+            (base_grand_total - base_net_total) * {weight} as adjustments,
+            base_net_total * {weight} as net_amount,
+            total_taxes_and_charges * {weight} as tax_amount
+        FROM
+            `tab{doctype}`
+            {cost_center_join}
+        WHERE
+            {conditions}
+            AND ({bucket_condition})
+            {keyset_condition}
+        ORDER BY
+            posting_date, name
+        LIMIT %(page_length)s
+    """.format(
+            party_field=PARTY_FIELDS[doctype],
+            weight=query.weight,
+            doctype=doctype,
+            cost_center_join=query.cost_center_join,
+            conditions=query.conditions,
+            bucket_condition=bucket_condition,
+            keyset_condition=get_keyset_condition("posting_date", "name", cursor, values),
+        ),
+        values,
+        as_dict=1,
+    )
+
+
+def get_expense_vouchers(voucher_type, filters, cursor, page_length):
+    """مستندات المصروفات بنفس شروط ملخص الإقرار (get_expense_query_parts)"""
+    query = get_expense_query_parts(filters, get_tax_accounts(filters), [voucher_type])
+    if not query:
+        return []
+
+    values = dict(query.values, page_length=page_length)
+
+    return frappe.db.sql(
+        """
+        SELECT
+            gl.voucher_type,
+            gl.voucher_no,
+            gl.posting_date,
+            MAX(gl.party) as party,
+            SUM(gl.debit) as amount,
+            0 as adjustments,
+            SUM(gl.debit) as net_amount,
+            SUM(gl.debit) as tax_amount
+        FROM
+            {tables}
+        WHERE
+            {conditions}
+            {keyset_condition}
+        GROUP BY
+            gl.posting_date, gl.voucher_type, gl.voucher_no
+        ORDER BY
+            gl.posting_date, gl.voucher_no
+        LIMIT %(page_length)s
+    """.format(
+            tables=query.tables,
+            conditions=query.conditions,
+            keyset_condition=get_keyset_condition(
+                "gl.posting_date", "gl.voucher_no", cursor, values
+            ),
+        ),
+        values,
+        as_dict=1,
+    )
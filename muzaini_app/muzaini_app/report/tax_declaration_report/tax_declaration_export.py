@@ -0,0 +1,202 @@
+# Copyright (c) 2026, Mohamed AbdElsabour and contributors
+# For license information, please see license.txt
+
+import csv
+import hashlib
+import os
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, cint, now_datetime
+
+from muzaini_app.muzaini_app.doctype.vat_declaration_snapshot.vat_declaration_snapshot import (
+    get_filters_hash,
+)
+from muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_drilldown import (
+    iter_drilldown_vouchers,
+)
+from muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_report import (
+    check_report_permission,
+    execute,
+    get_expense_row_code,
+    get_frozen_declaration,
+    get_expense_voucher_types,
+)
+
+EXPORT_CACHE_KEY = "muzaini_vat_export"
+EXPORT_CACHE_EXPIRY = 60 * 60
+
+EXPORT_FILE_PREFIX = "vat-declaration-"
+
+# ملفات التصدير مؤقتة وتُحذف بعد هذه المدة
+EXPORT_RETENTION_DAYS = 1
+
+# صفوف الإقرار التفصيلية (بدون الإجماليات حتى لا يتكرر المستند في ملف التفصيل)
+DETAIL_ROW_CODES = (
+    "sales_taxable",
+    "sales_non_taxable",
+    "sales_returns_taxable",
+    "sales_returns_non_taxable",
+    "purchase_taxable",
+    "purchase_non_taxable",
+    "purchase_returns_taxable",
+    "purchase_returns_non_taxable",
+)
+
+DETAIL_FIELDS = (
+    "voucher_type",
+    "voucher_no",
+    "posting_date",
+    "party",
+    "amount",
+    "adjustments",
+    "net_amount",
+    "tax_amount",
+)
+
+
+@frappe.whitelist()
+def export_declaration(filters, file_format="xlsx", include_detail=0):
+    """
+    تصدير الإقرار والملخص (واختيارياً تفصيل المستندات) إلى ملف XLSX أو CSV على الخادم.
+    الكتابة تتم صفاً بصف فالذاكرة ثابتة، والملف يعاد استخدامه لنفس الفلاتر لمدة ساعة.
+    """
+    check_report_permission()
+
+    filters = frappe._dict(frappe.parse_json(filters))
+    include_detail = cint(include_detail)
+    if file_format not in ("xlsx", "csv"):
+        frappe.throw(_("صيغة التصدير غير مدعومة: {0}").format(file_format))
+
+    # الملف خاص ومملوك لمن قام بالتصدير، فالتخزين المؤقت لكل مستخدم
+    cache_key = "{0}-{1}-{2}-{3}-{4}".format(
+        get_filters_hash(filters),
+        file_format,
+        include_detail,
+        cint(filters.get("reconcile")),
+        frappe.session.user,
+    )
+    # يعاد استخدام الملف فقط للإقرارات المجمّدة؛ غيرها قد يتغير مع أي ترحيل جديد
+    is_frozen = bool(get_frozen_declaration(filters))
+    file_url = is_frozen and frappe.cache().get_value(EXPORT_CACHE_KEY + cache_key)
+    if file_url and frappe.db.exists("File", {"file_url": file_url}):
+        return file_url
+
+    columns, data, _message, _chart, summary = execute(filters)
+    detail_rows = iter_detail_rows(filters) if include_detail else None
+
+    file_name = "{0}{1}-{2}-{3}.{4}".format(
+        EXPORT_FILE_PREFIX,
+        frappe.scrub(filters.get("company") or ""),
+        filters.get("from_date"),
+        filters.get("to_date"),
+        file_format,
+    )
+
+    # مسار ثابت لكل مفتاح: التصدير الجديد يستبدل الملف السابق لنفس الفلاتر والمستخدم
+    file_path = frappe.get_site_path(
+        "private",
+        "files",
+        "{0}-{1}".format(hashlib.md5(cache_key.encode("utf-8")).hexdigest()[:10], file_name),
+    )
+    delete_export_files({"file_url": "/private/files/" + os.path.basename(file_path)})
+
+    if file_format == "xlsx":
+        write_xlsx(file_path, columns, data, summary, detail_rows)
+    else:
+        write_csv(file_path, columns, data, summary, detail_rows)
+
+    file_doc = frappe.get_doc(
+        {
+            "doctype": "File",
+            "file_name": file_name,
+            "file_url": "/private/files/" + os.path.basename(file_path),
+            "is_private": 1,
+        }
+    ).insert(ignore_permissions=True)
+
+    if is_frozen:
+        frappe.cache().set_value(
+            EXPORT_CACHE_KEY + cache_key, file_doc.file_url, expires_in_sec=EXPORT_CACHE_EXPIRY
+        )
+
+    return file_doc.file_url
+
+
+def delete_export_files(filters):
+    """حذف سجلات ملفات التصدير (ومعها الملفات على القرص)"""
+    for file_name in frappe.get_all("File", filters=filters, pluck="name"):
+        frappe.delete_doc("File", file_name, ignore_permissions=True, force=True)
+
+
+def delete_old_exports():
+    """مهمة يومية: حذف ملفات تصدير الإقرار الأقدم من مدة الاحتفاظ"""
+    delete_export_files(
+        {
+            "file_name": ["like", EXPORT_FILE_PREFIX + "%"],
+            "is_private": 1,
+            "attached_to_doctype": ["is", "not set"],
+            "creation": ["<", add_days(now_datetime(), -EXPORT_RETENTION_DAYS)],
+        }
+    )
+
+
+def iter_detail_rows(filters):
+    """مستندات كل صف تفصيلي في الإقرار، تُقرأ صفحة بعد صفحة"""
+    row_codes = list(DETAIL_ROW_CODES)
+    row_codes.extend(
+        get_expense_row_code(voucher_type) for voucher_type in get_expense_voucher_types(filters)
+    )
+
+    for row_code in row_codes:
+        for voucher in iter_drilldown_vouchers(filters, row_code):
+            yield [row_code] + [voucher.get(field) for field in DETAIL_FIELDS]
+
+
+def get_detail_header():
+    return [_("رمز الصف")] + [_(frappe.unscrub(field)) for field in DETAIL_FIELDS]
+
+
+def write_xlsx(file_path, columns, data, summary, detail_rows=None):
+    from openpyxl import Workbook
+
+    # وضع الكتابة فقط: الصفوف تُكتب للملف مباشرة ولا تبقى في الذاكرة
+    workbook = Workbook(write_only=True)
+
+    sheet = workbook.create_sheet(_("الإقرار"))
+    sheet.sheet_view.rightToLeft = True
+    sheet.append([column["label"] for column in columns])
+    for row in data:
+        sheet.append([row.get(column["fieldname"]) for column in columns])
+
+    sheet = workbook.create_sheet(_("الملخص"))
+    sheet.sheet_view.rightToLeft = True
+    for item in summary or []:
+        sheet.append([item.get("label"), item.get("value")])
+
+    if detail_rows is not None:
+        sheet = workbook.create_sheet(_("تفصيل المستندات"))
+        sheet.sheet_view.rightToLeft = True
+        sheet.append(get_detail_header())
+        for row in detail_rows:
+            sheet.append(row)
+
+    workbook.save(file_path)
+
+
+def write_csv(file_path, columns, data, summary, detail_rows=None):
+    with open(file_path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+
+        writer.writerow([column["label"] for column in columns])
+        for row in data:
+            writer.writerow([row.get(column["fieldname"]) for column in columns])
+
+        writer.writerow([])
+        for item in summary or []:
+            writer.writerow([item.get("label"), item.get("value")])
+
+        if detail_rows is not None:
+            writer.writerow([])
+            writer.writerow(get_detail_header())
+            writer.writerows(detail_rows)
@@ -12,6 +12,16 @@ frappe.query_reports["Tax Declaration Report"] = {
 			reqd: 1,
 			width: "200px",
 		},
+		{
+			fieldname: "companies",
+			label: __("الشركات (إقرار موحد)"),
+			fieldtype: "MultiSelectList",
+			width: "200px",
+			get_data: function (txt) {
+				return frappe.db.get_link_options("Company", txt);
+			},
+			description: __("اختياري: إقرار موحد لعدة شركات مع أعمدة لكل شركة وإجمالي المجموعة"),
+		},
 		{
 			fieldname: "cost_center",
 			label: __("مركز التكلفة"),
@@ -28,6 +38,16 @@ frappe.query_reports["Tax Declaration Report"] = {
 			},
 			width: "200px",
 		},
+		{
+			fieldname: "apportion_cost_center",
+			label: __("توزيع نسبي على مركز التكلفة"),
+			fieldtype: "Check",
+			default: 0,
+			depends_on: "cost_center",
+			description: __(
+				"توزيع قيم وضريبة الفاتورة حسب صافي بنود مركز التكلفة بدلاً من احتساب الفاتورة كاملة"
+			),
+		},
 		{
 			fieldname: "from_date",
 			label: __("من تاريخ"),
@@ -44,6 +64,15 @@ frappe.query_reports["Tax Declaration Report"] = {
 			reqd: 1,
 			width: "100px",
 		},
+		{
+			fieldname: "compare_periods",
+			label: __("مقارنة الفترات"),
+			fieldtype: "Select",
+			options: "\nشهري\nربع سنوي",
+			default: "",
+			width: "100px",
+			description: __("اختياري: عرض الإقرار بأعمدة منفصلة لكل شهر أو ربع سنة"),
+		},
 		{
 			fieldname: "tax_account",
 			label: __("حساب الضريبة"),
@@ -80,6 +109,38 @@ frappe.query_reports["Tax Declaration Report"] = {
 			hidden: 1,
 			description: __("اختياري: يستخدم لتصفية ضريبة المصروفات حسب حساب محدد"),
 		},
+		{
+			fieldname: "reconcile",
+			label: __("مطابقة مع الأستاذ العام"),
+			fieldtype: "Check",
+			default: 0,
+			description: __(
+				"عرض الفواتير التي تختلف ضريبتها عن القيود المرحّلة على الحسابات الضريبية"
+			),
+		},
+		{
+			fieldname: "rate_breakdown",
+			label: __("تفصيل حسب نسبة الضريبة"),
+			fieldtype: "Check",
+			default: 0,
+			depends_on: "eval:!(doc.companies || []).length && !doc.compare_periods",
+			description: __("إضافة تفصيل لبنود الفواتير حسب قالب ضريبة الصنف والنسبة الفعلية"),
+		},
+		{
+			fieldname: "expense_voucher_types",
+			label: __("مستندات مصروفات إضافية"),
+			fieldtype: "MultiSelectList",
+			width: "200px",
+			get_data: function (txt) {
+				return frappe.db.get_link_options("DocType", txt, {
+					name: ["not in", ["Sales Invoice", "Purchase Invoice"]],
+					is_submittable: 1,
+				});
+			},
+			description: __(
+				"اختياري: أنواع مستندات أخرى تُحتسب ضريبتها المدينة كمصروفات (بالإضافة إلى القيود اليومية وسندات الصرف)"
+			),
+		},
 		{
 			fieldname: "report_type",
 			label: __("نوع التقرير"),
@@ -118,7 +179,7 @@ frappe.query_reports["Tax Declaration Report"] = {
 			// تخصيص التنسيق للصفوف الهامة مع الحفاظ على التنسيق المالي
 			if (data) {
 				// التعرف على عناوين الأقسام
-				if (data.description && data.description.startsWith("---")) {
+				if (data.row_code && data.row_code.endsWith("_section")) {
 					return (
 						'<span style="font-weight: bold; font-size: 1.2em; color: #34495e; background-color: #f8f9fa; padding: 5px 10px; display: block; border-radius: 3px;">' +
 						data.description.replace(/---/g, "") +
@@ -186,8 +247,8 @@ frappe.query_reports["Tax Declaration Report"] = {
 				// إبراز صفوف إجمالي المرتجعات
 				if (
 					data.description &&
-					(data.description === "اجمالي مرتجعات المبيعات" ||
-						data.description === "اجمالي مرتجعات المشتريات")
+					(data.row_code === "sales_returns_total" ||
+						data.row_code === "purchase_returns_total")
 				) {
 					return (
 						'<span style="color: #e74c3c; font-weight: bold; font-size: 1.05em;">' +
@@ -208,8 +269,7 @@ frappe.query_reports["Tax Declaration Report"] = {
 				// تنسيق قيم الضرائب
 				if (column.fieldname === "tax_amount") {
 					if (
-						data.description ===
-						"اجمالي ضريبة القيمة المضافة المستحقة عن الفترة الضريبية الحالية"
+						data.row_code === "vat_due"
 					) {
 						var tax_value = parseFloat(value || 0);
 						return tax_value < 0
@@ -219,13 +279,11 @@ frappe.query_reports["Tax Declaration Report"] = {
 							: '<span style="color: #27ae60; font-weight: bold; font-size: 1.2em;">' +
 									formatted_value +
 									"</span>";
-					} else if (data.description === "المصروفات (القيود اليومية)") {
-						return (
-							'<span style="color: #8e44ad; font-weight: bold;">' +
-							formatted_value +
-							"</span>"
-						);
-					} else if (data.description === "المصروفات (سندات الصرف)") {
+					} else if (
+						data.row_code &&
+						data.row_code.startsWith("expenses_") &&
+						data.row_code !== "expenses_section"
+					) {
 						return (
 							'<span style="color: #8e44ad; font-weight: bold;">' +
 							formatted_value +
@@ -238,8 +296,7 @@ frappe.query_reports["Tax Declaration Report"] = {
 
 				// تلوين صف الضريبة المستحقة بالكامل
 				if (
-					data.description ===
-					"اجمالي ضريبة القيمة المضافة المستحقة عن الفترة الضريبية الحالية"
+					data.row_code === "vat_due"
 				) {
 					return (
 						'<span style="font-weight: bold; font-size: 1.1em; color: #34495e;">' +
@@ -358,6 +415,72 @@ frappe.query_reports["Tax Declaration Report"] = {
 			}
 		});
 
+		// إضافة زر لتجميد الإقرار للفترة المقدمة
+		report.page.add_inner_button(__("تجميد الإقرار"), function () {
+			var filters = report.get_values();
+			frappe.confirm(
+				__("سيتم حفظ أرقام الإقرار لهذه الفترة ولن يعاد احتسابها. هل تريد المتابعة؟"),
+				function () {
+					frappe.call({
+						method: "muzaini_app.muzaini_app.doctype.vat_declaration_snapshot.vat_declaration_snapshot.freeze_declaration",
+						args: { filters: filters },
+						freeze: true,
+						callback: function (r) {
+							if (r.message) {
+								frappe.show_alert({
+									message: __("تم تجميد الإقرار"),
+									indicator: "green",
+								});
+								report.refresh();
+							}
+						},
+					});
+				},
+			);
+		});
+
+		// تصدير الإقرار من الخادم (مع تفصيل المستندات اختيارياً)
+		report.page.add_inner_button(__("تصدير من الخادم"), function () {
+			var dialog = new frappe.ui.Dialog({
+				title: __("تصدير الإقرار"),
+				fields: [
+					{
+						fieldname: "file_format",
+						label: __("الصيغة"),
+						fieldtype: "Select",
+						options: "xlsx\ncsv",
+						default: "xlsx",
+					},
+					{
+						fieldname: "include_detail",
+						label: __("تضمين تفصيل المستندات"),
+						fieldtype: "Check",
+						default: 0,
+					},
+				],
+				primary_action_label: __("تصدير"),
+				primary_action: function (values) {
+					dialog.hide();
+					frappe.call({
+						method: "muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_export.export_declaration",
+						args: {
+							filters: report.get_values(),
+							file_format: values.file_format,
+							include_detail: values.include_detail,
+						},
+						freeze: true,
+						freeze_message: __("جاري تجهيز الملف..."),
+						callback: function (r) {
+							if (r.message) {
+								window.open(r.message);
+							}
+						},
+					});
+				},
+			});
+			dialog.show();
+		});
+
 		// تحديث البيانات عند التحميل
 		var originalRefresh = report.refresh;
 		report.refresh = function () {
@@ -383,8 +506,8 @@ frappe.query_reports["Tax Declaration Report"] = {
 
 						if (
 							rowData &&
-							rowData.description &&
-							rowData.description.startsWith("---")
+							rowData.row_code &&
+							rowData.row_code.endsWith("_section")
 						) {
 							$row.addClass("section-header");
 							$row.css({
@@ -419,8 +542,7 @@ frappe.query_reports["Tax Declaration Report"] = {
 							}
 
 							if (
-								rowData.description ===
-								"اجمالي ضريبة القيمة المضافة المستحقة عن الفترة الضريبية الحالية"
+								rowData.row_code === "vat_due"
 							) {
 								$row.css({
 									"background-color": "#f1f5f9",
@@ -461,31 +583,35 @@ function createTaxDeclarationForm(data, filters) {
 
 	// البحث عن الصفوف المطلوبة في البيانات الجديدة
 	// إنشاء وظيفة للبحث عن المعلومات حسب الوصف
-	var findRow = function (description) {
-		return data.find((row) => row.description === description);
+	var rowsByCode = {};
+	data.forEach(function (row) {
+		if (row.row_code) rowsByCode[row.row_code] = row;
+	});
+	var findRow = function (rowCode) {
+		return rowsByCode[rowCode];
 	};
 
 	// المبيعات
-	var taxableSalesRow = findRow("المبيعات الخاضعة للنسبة الأساسية");
-	var nonTaxableSalesRow = findRow("المبيعات غير الخاضعة أو الضريبة الصفرية");
-	var totalSalesRow = findRow("اجمالي المبيعات");
-	var salesReturnsRow = findRow("مرتجعات المبيعات الخاضعة للنسبة الأساسية");
-	var salesNetRow = findRow("صافي المبيعات (بعد خصم المرتجعات)");
+	var taxableSalesRow = findRow("sales_taxable");
+	var nonTaxableSalesRow = findRow("sales_non_taxable");
+	var totalSalesRow = findRow("sales_total");
+	var salesReturnsRow = findRow("sales_returns_taxable");
+	var salesNetRow = findRow("sales_net");
 
 	// المشتريات
-	var taxablePurchaseRow = findRow("المشتريات الخاضعة للنسبة الأساسية");
-	var nonTaxablePurchaseRow = findRow("المشتريات غير الخاضعة أو الضريبة الصفرية");
-	var totalPurchaseRow = findRow("اجمالي المشتريات");
-	var purchaseReturnsRow = findRow("مرتجعات المشتريات الخاضعة للنسبة الأساسية");
-	var purchaseNetRow = findRow("صافي المشتريات (بعد خصم المرتجعات)");
+	var taxablePurchaseRow = findRow("purchase_taxable");
+	var nonTaxablePurchaseRow = findRow("purchase_non_taxable");
+	var totalPurchaseRow = findRow("purchase_total");
+	var purchaseReturnsRow = findRow("purchase_returns_taxable");
+	var purchaseNetRow = findRow("purchase_net");
 
 	// المصروفات
-	var expensesJERow = findRow("المصروفات (القيود اليومية)");
-	var expensesPERow = findRow("المصروفات (سندات الصرف)");
-	var totalRecoverableRow = findRow("اجمالي الضريبة المستردة (المشتريات والمصروفات)");
+	var expensesJERow = findRow("expenses_journal_entry");
+	var expensesPERow = findRow("expenses_payment_entry");
+	var totalRecoverableRow = findRow("recoverable_total");
 
 	// الضريبة المستحقة
-	var vatDueRow = findRow("اجمالي ضريبة القيمة المضافة المستحقة عن الفترة الضريبية الحالية");
+	var vatDueRow = findRow("vat_due");
 
 	// إنشاء جداول ملخصة
 	var salesPanel = `
@@ -606,7 +732,7 @@ function createTaxDeclarationForm(data, filters) {
 
 	// إعداد صفوف جدول التفاصيل - استبعاد الصفوف الفرعية
 	var detailRows = data
-		.filter((row) => row.description && !row.description.startsWith("---")) // استبعاد صفوف العناوين
+		.filter((row) => row.row_code && !row.row_code.endsWith("_section")) // استبعاد صفوف العناوين
 		.map(function (row) {
 			// تطبيق تنسيق خاص على صفوف المجاميع
 			var rowStyle = "";
@@ -617,8 +743,7 @@ function createTaxDeclarationForm(data, filters) {
 				rowStyle = "font-weight: bold; background-color: #f8fafc;";
 			}
 			if (
-				row.description ===
-				"اجمالي ضريبة القيمة المضافة المستحقة عن الفترة الضريبية الحالية"
+				row.row_code === "vat_due"
 			) {
 				rowStyle =
 					"font-weight: bold; background-color: #f1f5f9; border-top: 2px solid #cbd5e1; border-bottom: 2px solid #cbd5e1;";
@@ -900,7 +1025,7 @@ function downloadCSV(data, filename) {
 	// إضافة البيانات
 	data.forEach(function (row) {
 		// تخطي صفوف العناوين
-		if (row.description && !row.description.startsWith("---")) {
+		if (row.row_code && !row.row_code.endsWith("_section")) {
 			var rowData = [
 				'"' + (row.description || "") + '"', // إضافة علامات اقتباس لمنع مشاكل الفواصل في النص العربي
 				row.amount
@@ -934,32 +1059,36 @@ function downloadCSV(data, filename) {
 // دالة لتحديث ملخص الضرائب
 function updateTaxSummary(data) {
 	// البحث عن الصفوف المطلوبة في البيانات باستخدام الوصف
-	var findRow = function (description) {
-		return data.find((row) => row.description === description);
+	var rowsByCode = {};
+	data.forEach(function (row) {
+		if (row.row_code) rowsByCode[row.row_code] = row;
+	});
+	var findRow = function (rowCode) {
+		return rowsByCode[rowCode];
 	};
 
 	// الحصول على بيانات الصفوف المهمة
-	var taxableSales = findRow("المبيعات الخاضعة للنسبة الأساسية");
-	var nonTaxableSales = findRow("المبيعات غير الخاضعة أو الضريبة الصفرية");
-	var totalSales = findRow("اجمالي المبيعات");
-	var salesReturns = findRow("مرتجعات المبيعات الخاضعة للنسبة الأساسية");
-	var nonTaxableSalesReturns = findRow("مرتجعات المبيعات غير الخاضعة للضريبة");
-	var totalSalesReturns = findRow("اجمالي مرتجعات المبيعات");
-	var salesNet = findRow("صافي المبيعات (بعد خصم المرتجعات)");
-
-	var taxablePurchases = findRow("المشتريات الخاضعة للنسبة الأساسية");
-	var nonTaxablePurchases = findRow("المشتريات غير الخاضعة أو الضريبة الصفرية");
-	var totalPurchases = findRow("اجمالي المشتريات");
-	var purchaseReturns = findRow("مرتجعات المشتريات الخاضعة للنسبة الأساسية");
-	var nonTaxablePurchaseReturns = findRow("مرتجعات المشتريات غير الخاضعة للضريبة");
-	var totalPurchaseReturns = findRow("اجمالي مرتجعات المشتريات");
-	var purchaseNet = findRow("صافي المشتريات (بعد خصم المرتجعات)");
-
-	var journalEntries = findRow("المصروفات (القيود اليومية)");
-	var paymentEntries = findRow("المصروفات (سندات الصرف)");
-	var totalRecoverable = findRow("اجمالي الضريبة المستردة (المشتريات والمصروفات)");
-
-	var vatDue = findRow("اجمالي ضريبة القيمة المضافة المستحقة عن الفترة الضريبية الحالية");
+	var taxableSales = findRow("sales_taxable");
+	var nonTaxableSales = findRow("sales_non_taxable");
+	var totalSales = findRow("sales_total");
+	var salesReturns = findRow("sales_returns_taxable");
+	var nonTaxableSalesReturns = findRow("sales_returns_non_taxable");
+	var totalSalesReturns = findRow("sales_returns_total");
+	var salesNet = findRow("sales_net");
+
+	var taxablePurchases = findRow("purchase_taxable");
+	var nonTaxablePurchases = findRow("purchase_non_taxable");
+	var totalPurchases = findRow("purchase_total");
+	var purchaseReturns = findRow("purchase_returns_taxable");
+	var nonTaxablePurchaseReturns = findRow("purchase_returns_non_taxable");
+	var totalPurchaseReturns = findRow("purchase_returns_total");
+	var purchaseNet = findRow("purchase_net");
+
+	var journalEntries = findRow("expenses_journal_entry");
+	var paymentEntries = findRow("expenses_payment_entry");
+	var totalRecoverable = findRow("recoverable_total");
+
+	var vatDue = findRow("vat_due");
 
 	// إنشاء القسم
 	var $taxSummarySection = $(".tax-summary-section");
@@ -4,7 +4,8 @@
 
 import frappe
 from frappe import _
-from frappe.utils import flt, fmt_money
+from frappe.utils import add_months, flt, fmt_money, get_first_day, get_last_day, getdate
+from frappe.utils.caching import request_cache
 import datetime
 
 
@@ -24,9 +25,36 @@ def execute(filters=None):
     if not filters.get("to_date"):
         filters["to_date"] = datetime.date.today()
 
+    # وضع المطابقة: مقارنة ضريبة الفواتير مع قيود الحسابات الضريبية (دائماً من البيانات الحالية)
+    if filters.get("reconcile"):
+        from muzaini_app.muzaini_app.report.tax_declaration_report.vat_reconciliation import (
+            get_reconciliation,
+        )
+
+        columns, data, summary = get_reconciliation(filters)
+        return columns, data, None, None, summary
+
+    # الفترات المجمّدة تُعرض من النسخة المحفوظة ولا يعاد احتسابها
+    if not filters.get("ignore_snapshot"):
+        frozen_declaration = get_frozen_declaration(filters)
+        if frozen_declaration:
+            return get_frozen_declaration_result(frozen_declaration)
+
     # الحصول على البيانات
-    columns = get_columns()
-    data = get_tax_declaration_data(filters)
+    if filters.get("companies") and filters.get("compare_periods"):
+        frappe.throw(_("لا يمكن الجمع بين الإقرار الموحد ومقارنة الفترات"))
+
+    if filters.get("companies"):
+        columns, data = get_consolidated_declaration(filters)
+    elif filters.get("compare_periods"):
+        columns, data = get_comparative_declaration(filters)
+    else:
+        columns = get_columns()
+        data = get_tax_declaration_data(filters)
+
+        # تفصيل على مستوى البنود حسب قالب ونسبة الضريبة
+        if filters.get("rate_breakdown"):
+            data.extend(get_rate_breakdown_rows(filters))
 
     # إنشاء الملخص
     summary = get_summary(data)
@@ -34,6 +62,34 @@ def execute(filters=None):
     return columns, data, None, None, summary
 
 
+def get_frozen_declaration(filters):
+    from muzaini_app.muzaini_app.doctype.vat_declaration_snapshot.vat_declaration_snapshot import (
+        get_frozen_declaration,
+    )
+
+    return get_frozen_declaration(filters)
+
+
+def get_frozen_declaration_result(frozen_declaration):
+    from muzaini_app.muzaini_app.doctype.vat_declaration_snapshot.vat_declaration_snapshot import (
+        verify_content_hash,
+    )
+
+    verify_content_hash(frozen_declaration)
+
+    message = _("إقرار مجمّد بتاريخ {0}").format(frozen_declaration.frozen_on)
+    if frozen_declaration.is_stale:
+        message += " - " + _("تنبيه: توجد مستندات بتاريخ داخل الفترة تم تعديلها بعد التجميد")
+
+    return (
+        frappe.parse_json(frozen_declaration.columns_json),
+        frappe.parse_json(frozen_declaration.data_json),
+        message,
+        None,
+        frappe.parse_json(frozen_declaration.summary_json),
+    )
+
+
 def get_columns():
     return [
         {
@@ -70,29 +126,40 @@ def get_columns():
 
 
 def get_tax_declaration_data(filters):
-    # الحصول على بيانات المبيعات والمشتريات
+    # الحصول على بيانات المبيعات والمشتريات (استعلام واحد لكل نوع فاتورة)
+    sales_summary = get_invoice_tax_summary("Sales Invoice", filters)
+    purchase_summary = get_invoice_tax_summary("Purchase Invoice", filters)
+
+    # الحصول على ضريبة المصروفات لكل نوع مستند من قيود الأستاذ العام (استعلام واحد)
+    tax_accounts = get_tax_accounts(filters)
+    expense_voucher_types = get_expense_voucher_types(filters)
+    expense_summary = get_expense_tax_summary(filters, tax_accounts, expense_voucher_types)
+
+    return build_tax_declaration_rows(
+        sales_summary, purchase_summary, expense_summary, expense_voucher_types
+    )
+
+
+def build_tax_declaration_rows(
+    sales_summary, purchase_summary, expense_summary, expense_voucher_types
+):
+    """بناء صفوف الإقرار الضريبي من الملخصات المجمّعة (بدون استعلامات)"""
     # المبيعات الخاضعة للضريبة
-    taxable_sales_data = get_taxable_sales_summary(filters)
+    taxable_sales_data = sales_summary["taxable"]
     # المبيعات غير الخاضعة للضريبة
-    non_taxable_sales_data = get_non_taxable_sales_summary(filters)
+    non_taxable_sales_data = sales_summary["non_taxable"]
     # المشتريات الخاضعة للضريبة
-    taxable_purchase_data = get_taxable_purchase_summary(filters)
+    taxable_purchase_data = purchase_summary["taxable"]
     # المشتريات غير الخاضعة للضريبة
-    non_taxable_purchase_data = get_non_taxable_purchase_summary(filters)
+    non_taxable_purchase_data = purchase_summary["non_taxable"]
     # مرتجعات المبيعات الخاضعة للضريبة
-    taxable_sales_returns_data = get_returns_summary(filters)
+    taxable_sales_returns_data = sales_summary["taxable_returns"]
     # مرتجعات المبيعات غير الخاضعة للضريبة
-    non_taxable_sales_returns_data = get_non_taxable_returns_summary(filters)
+    non_taxable_sales_returns_data = sales_summary["non_taxable_returns"]
     # مرتجعات المشتريات الخاضعة للضريبة
-    taxable_purchase_returns_data = get_purchase_returns_summary(filters)
+    taxable_purchase_returns_data = purchase_summary["taxable_returns"]
     # مرتجعات المشتريات غير الخاضعة للضريبة
-    non_taxable_purchase_returns_data = get_non_taxable_purchase_returns_summary(
-        filters
-    )
-
-    # الحصول على بيانات الضرائب من القيود اليومية وسندات الصرف بشكل منفصل
-    journal_entries_data = get_journal_entries_tax_summary(filters)
-    payment_entries_data = get_payment_entries_tax_summary(filters)
+    non_taxable_purchase_returns_data = purchase_summary["non_taxable_returns"]
 
     # دالة مساعدة للتنسيق مع رقمين عشريين
     def format_num(num):
@@ -193,22 +260,33 @@ def get_tax_declaration_data(filters):
         taxable_purchase_net_total + non_taxable_purchase_net_total
     )
 
-    # تحضير كميات الضرائب من القيود اليومية وسندات الصرف
-    journal_entries_amount = format_num(journal_entries_data["base_total"])
-    journal_entries_tax = format_num(journal_entries_data["tax_amount"])
+    # تحضير صفوف ضريبة المصروفات لكل نوع مستند (القيود اليومية، سندات الصرف، ...)
+    expense_rows = []
+    for voucher_type in expense_voucher_types:
+        expense_data = expense_summary.get(voucher_type) or get_empty_expense_summary()
+        expense_amount = format_num(expense_data["base_total"])
+        expense_rows.append(
+            {
+                "row_code": get_expense_row_code(voucher_type),
+                "description": get_expense_row_label(voucher_type),
+                "amount": expense_amount,
+                "adjustments": 0.00,
+                "net_amount": expense_amount,
+                "tax_amount": format_num(expense_data["tax_amount"]),
+            }
+        )
 
-    payment_entries_amount = format_num(payment_entries_data["base_total"])
-    payment_entries_tax = format_num(payment_entries_data["tax_amount"])
+    expenses_amount = format_num(sum(row["amount"] for row in expense_rows))
+    expenses_tax = format_num(sum(row["tax_amount"] for row in expense_rows))
 
-    # حساب إجمالي الضريبة المستردة (المشتريات + القيود اليومية + سندات الصرف)
-    total_recoverable_tax = format_num(
-        taxable_purchase_tax + journal_entries_tax + payment_entries_tax
-    )
+    # حساب إجمالي الضريبة المستردة (المشتريات + المصروفات)
+    total_recoverable_tax = format_num(taxable_purchase_tax + expenses_tax)
 
     # إنشاء بيانات الإقرار الضريبي
     tax_data = [
         # قسم المبيعات
         {
+            "row_code": "sales_section",
             "description": "--- قسم المبيعات ---",
             "amount": "",
             "adjustments": "",
@@ -216,6 +294,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": "",
         },
         {
+            "row_code": "sales_taxable",
             "description": "المبيعات الخاضعة للنسبة الأساسية",
             "amount": format_num(taxable_sales_data["base_total"]),
             "adjustments": format_num(taxable_sales_data["adjustments"]),
@@ -223,6 +302,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": format_num(taxable_sales_data["tax_amount"]),
         },
         {
+            "row_code": "sales_non_taxable",
             "description": "المبيعات غير الخاضعة أو الضريبة الصفرية",
             "amount": format_num(non_taxable_sales_data["base_total"]),
             "adjustments": format_num(non_taxable_sales_data["adjustments"]),
@@ -230,6 +310,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": 0.00,
         },
         {
+            "row_code": "sales_total",
             "description": "اجمالي المبيعات",
             "amount": total_sales,
             "adjustments": format_num(
@@ -242,6 +323,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": format_num(taxable_sales_data["tax_amount"]),
         },
         {
+            "row_code": "sales_returns_taxable",
             "description": "مرتجعات المبيعات الخاضعة للنسبة الأساسية",
             "amount": format_num(taxable_sales_returns_data["base_total"]),
             "adjustments": format_num(taxable_sales_returns_data["adjustments"]),
@@ -249,6 +331,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": format_num(taxable_sales_returns_data["tax_amount"]),
         },
         {
+            "row_code": "sales_returns_non_taxable",
             "description": "مرتجعات المبيعات غير الخاضعة للضريبة",
             "amount": format_num(non_taxable_sales_returns_data["base_total"]),
             "adjustments": format_num(non_taxable_sales_returns_data["adjustments"]),
@@ -256,6 +339,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": 0.00,
         },
         {
+            "row_code": "sales_returns_total",
             "description": "اجمالي مرتجعات المبيعات",
             "amount": total_sales_returns,
             "adjustments": format_num(
@@ -269,6 +353,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": format_num(taxable_sales_returns_data["tax_amount"]),
         },
         {
+            "row_code": "sales_net",
             "description": "صافي المبيعات (بعد خصم المرتجعات)",
             "amount": total_sales_net,
             "adjustments": format_num(
@@ -295,6 +380,7 @@ def get_tax_declaration_data(filters):
         },
         # قسم المشتريات
         {
+            "row_code": "purchase_section",
             "description": "--- قسم المشتريات ---",
             "amount": "",
             "adjustments": "",
@@ -302,6 +388,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": "",
         },
         {
+            "row_code": "purchase_taxable",
             "description": "المشتريات الخاضعة للنسبة الأساسية",
             "amount": format_num(taxable_purchase_data["base_total"]),
             "adjustments": format_num(taxable_purchase_data["adjustments"]),
@@ -309,6 +396,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": format_num(taxable_purchase_data["tax_amount"]),
         },
         {
+            "row_code": "purchase_non_taxable",
             "description": "المشتريات غير الخاضعة أو الضريبة الصفرية",
             "amount": format_num(non_taxable_purchase_data["base_total"]),
             "adjustments": format_num(non_taxable_purchase_data["adjustments"]),
@@ -316,6 +404,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": 0.00,
         },
         {
+            "row_code": "purchase_total",
             "description": "اجمالي المشتريات",
             "amount": total_purchases,
             "adjustments": format_num(
@@ -329,6 +418,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": format_num(taxable_purchase_data["tax_amount"]),
         },
         {
+            "row_code": "purchase_returns_taxable",
             "description": "مرتجعات المشتريات الخاضعة للنسبة الأساسية",
             "amount": format_num(taxable_purchase_returns_data["base_total"]),
             "adjustments": format_num(taxable_purchase_returns_data["adjustments"]),
@@ -336,6 +426,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": format_num(taxable_purchase_returns_data["tax_amount"]),
         },
         {
+            "row_code": "purchase_returns_non_taxable",
             "description": "مرتجعات المشتريات غير الخاضعة للضريبة",
             "amount": format_num(non_taxable_purchase_returns_data["base_total"]),
             "adjustments": format_num(non_taxable_purchase_returns_data["adjustments"]),
@@ -343,6 +434,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": 0.00,
         },
         {
+            "row_code": "purchase_returns_total",
             "description": "اجمالي مرتجعات المشتريات",
             "amount": total_purchase_returns,
             "adjustments": format_num(
@@ -356,6 +448,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": format_num(taxable_purchase_returns_data["tax_amount"]),
         },
         {
+            "row_code": "purchase_net",
             "description": "صافي المشتريات (بعد خصم المرتجعات)",
             "amount": total_purchase_net,
             "adjustments": format_num(
@@ -382,41 +475,25 @@ def get_tax_declaration_data(filters):
         },
         # قسم المصروفات
         {
+            "row_code": "expenses_section",
             "description": "--- قسم المصروفات ---",
             "amount": "",
             "adjustments": "",
             "net_amount": "",
             "tax_amount": "",
         },
+        *expense_rows,
         {
-            "description": "المصروفات (القيود اليومية)",
-            "amount": journal_entries_amount,
-            "adjustments": 0.00,
-            "net_amount": journal_entries_amount,
-            "tax_amount": journal_entries_tax,
-        },
-        {
-            "description": "المصروفات (سندات الصرف)",
-            "amount": payment_entries_amount,
-            "adjustments": 0.00,
-            "net_amount": payment_entries_amount,
-            "tax_amount": payment_entries_tax,
-        },
-        {
+            "row_code": "recoverable_total",
             "description": "اجمالي الضريبة المستردة (المشتريات والمصروفات)",
-            "amount": format_num(
-                taxable_purchase_net_total
-                + journal_entries_amount
-                + payment_entries_amount
-            ),
+            "amount": format_num(taxable_purchase_net_total + expenses_amount),
             "adjustments": taxable_purchase_adjustments,
-            "net_amount": format_num(
-                taxable_purchase_net + journal_entries_amount + payment_entries_amount
-            ),
+            "net_amount": format_num(taxable_purchase_net + expenses_amount),
             "tax_amount": total_recoverable_tax,
         },
         # الملخص النهائي
         {
+            "row_code": "summary_section",
             "description": "--- الملخص النهائي ---",
             "amount": "",
             "adjustments": "",
@@ -424,6 +501,7 @@ def get_tax_declaration_data(filters):
             "tax_amount": "",
         },
         {
+            "row_code": "vat_due",
             "description": "اجمالي ضريبة القيمة المضافة المستحقة عن الفترة الضريبية الحالية",
             "amount": "",
             "adjustments": "",
@@ -435,447 +513,521 @@ def get_tax_declaration_data(filters):
     return tax_data
 
 
-def get_taxable_sales_summary(filters):
-    """الحصول على ملخص المبيعات الخاضعة للضريبة"""
-    # استعلام موجز للمبيعات
-    conditions = []
-    values = {"from_date": filters.get("from_date"), "to_date": filters.get("to_date")}
+# تعبيرات تجميع الفترات للإقرار المقارن
+PERIOD_EXPRESSIONS = {
+    "شهري": "DATE_FORMAT({date_field}, '%%Y-%%m')",
+    "ربع سنوي": "CONCAT(YEAR({date_field}), '-Q', QUARTER({date_field}))",
+}
 
-    if filters.get("company"):
-        conditions.append("company = %(company)s")
-        values["company"] = filters.get("company")
 
-    if filters.get("cost_center"):
-        conditions.append(
-            "EXISTS (SELECT name FROM `tabSales Invoice Item` WHERE parent = `tabSales Invoice`.name AND cost_center = %(cost_center)s)"
-        )
-        values["cost_center"] = filters.get("cost_center")
+def get_period_key(date, periodicity):
+    """نفس مفتاح الفترة الناتج من PERIOD_EXPRESSIONS لتاريخ واحد"""
+    if periodicity == "ربع سنوي":
+        return "{0}-Q{1}".format(date.year, (date.month - 1) // 3 + 1)
 
-    # إضافة شرط للتأكد من وجود ضريبة على الفاتورة
-    conditions.append("total_taxes_and_charges > 0")
+    return date.strftime("%Y-%m")
 
-    condition_str = " AND ".join(conditions)
-    if condition_str:
-        condition_str = " AND " + condition_str
 
-    sales_summary = frappe.db.sql(
-        """
-        SELECT 
-            COALESCE(SUM(base_grand_total), 0) as base_total,
-            COALESCE(SUM(base_net_total), 0) as net_amount,
-            COALESCE(SUM(base_grand_total - base_net_total), 0) as adjustments,
-            COALESCE(SUM(total_taxes_and_charges), 0) as tax_amount
-        FROM 
-            `tabSales Invoice`
-        WHERE 
-            docstatus = 1
-            AND is_return = 0
-            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
-            {condition_str}
-    """.format(
-            condition_str=condition_str
-        ),
-        values,
-        as_dict=1,
-    )
+def get_periods(filters):
+    """قائمة الفترات (شهر أو ربع) الواقعة بين تاريخ البداية والنهاية"""
+    periodicity = filters.get("compare_periods")
+    date = get_first_day(filters.get("from_date"))
+    to_date = getdate(filters.get("to_date"))
 
-    return (
-        sales_summary[0]
-        if sales_summary
-        else {"base_total": 0, "net_amount": 0, "adjustments": 0, "tax_amount": 0}
-    )
+    periods = []
+    while date <= to_date:
+        key = get_period_key(date, periodicity)
+        if key not in periods:
+            periods.append(key)
+        date = add_months(date, 1)
 
+    return periods
 
-def get_non_taxable_sales_summary(filters):
-    """الحصول على ملخص المبيعات غير الخاضعة للضريبة أو ذات الضريبة الصفرية"""
-    # استعلام موجز للمبيعات غير الخاضعة للضريبة
-    conditions = []
-    values = {"from_date": filters.get("from_date"), "to_date": filters.get("to_date")}
 
-    if filters.get("company"):
-        conditions.append("company = %(company)s")
-        values["company"] = filters.get("company")
+def get_comparative_declaration(filters):
+    """
+    إقرار مقارن: مجموعة أعمدة لكل فترة، محسوبة من نفس الاستعلامات
+    مع التجميع حسب الفترة بدلاً من تشغيل التقرير لكل فترة
+    """
+    periodicity = filters.get("compare_periods")
+    if periodicity not in PERIOD_EXPRESSIONS:
+        frappe.throw(_("نوع المقارنة غير مدعوم: {0}").format(periodicity))
 
-    if filters.get("cost_center"):
-        conditions.append(
-            "EXISTS (SELECT name FROM `tabSales Invoice Item` WHERE parent = `tabSales Invoice`.name AND cost_center = %(cost_center)s)"
-        )
-        values["cost_center"] = filters.get("cost_center")
+    periods = [(period, period) for period in get_periods(filters)]
 
-    # إضافة شرط للتأكد من عدم وجود ضريبة على الفاتورة أو ضريبة صفرية
-    conditions.append(
-        "(total_taxes_and_charges = 0 OR total_taxes_and_charges IS NULL)"
-    )
+    return get_grouped_declaration(filters, PERIOD_EXPRESSIONS[periodicity], periods)
 
-    condition_str = " AND ".join(conditions)
-    if condition_str:
-        condition_str = " AND " + condition_str
 
-    non_taxable_sales_summary = frappe.db.sql(
-        """
-        SELECT 
-            COALESCE(SUM(base_grand_total), 0) as base_total,
-            COALESCE(SUM(base_net_total), 0) as net_amount,
-            COALESCE(SUM(base_grand_total - base_net_total), 0) as adjustments,
-            0 as tax_amount
-        FROM 
-            `tabSales Invoice`
-        WHERE 
-            docstatus = 1
-            AND is_return = 0
-            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
-            {condition_str}
-    """.format(
-            condition_str=condition_str
-        ),
-        values,
-        as_dict=1,
-    )
+def get_consolidated_declaration(filters):
+    """
+    إقرار موحد لعدة شركات: مجموعة أعمدة لكل شركة وإجمالي للمجموعة،
+    من نفس الاستعلامات مع التجميع حسب الشركة
+    """
+    companies = [(company, company) for company in get_filter_companies(filters)]
 
-    return (
-        non_taxable_sales_summary[0]
-        if non_taxable_sales_summary
-        else {"base_total": 0, "net_amount": 0, "adjustments": 0, "tax_amount": 0}
-    )
+    return get_grouped_declaration(filters, "{company_field}", companies)
 
 
-def get_non_taxable_returns_summary(filters):
-    """الحصول على ملخص مرتجعات المبيعات غير الخاضعة للضريبة"""
-    # استعلام موجز لمرتجعات المبيعات غير الخاضعة للضريبة
-    conditions = []
-    values = {"from_date": filters.get("from_date"), "to_date": filters.get("to_date")}
+def get_grouped_declaration(filters, group_by, groups):
+    """بناء صفوف الإقرار لكل مجموعة (فترة أو شركة) من استعلامات مجمّعة حسب group_by"""
+    sales_by_group = get_invoice_tax_summary("Sales Invoice", filters, group_by)
+    purchase_by_group = get_invoice_tax_summary("Purchase Invoice", filters, group_by)
 
-    if filters.get("company"):
-        conditions.append("company = %(company)s")
-        values["company"] = filters.get("company")
+    tax_accounts = get_tax_accounts(filters)
+    expense_voucher_types = get_expense_voucher_types(filters)
+    expense_by_group = get_expense_tax_summary(
+        filters, tax_accounts, expense_voucher_types, group_by
+    )
 
-    if filters.get("cost_center"):
-        conditions.append(
-            "EXISTS (SELECT name FROM `tabSales Invoice Item` WHERE parent = `tabSales Invoice`.name AND cost_center = %(cost_center)s)"
+    grouped_rows = []
+    for key, label in groups:
+        grouped_rows.append(
+            (
+                label,
+                build_tax_declaration_rows(
+                    sales_by_group.get(key) or get_bucket_summary([]),
+                    purchase_by_group.get(key) or get_bucket_summary([]),
+                    expense_by_group.get(key) or {},
+                    expense_voucher_types,
+                ),
+            )
         )
-        values["cost_center"] = filters.get("cost_center")
 
-    # إضافة شرط للتأكد من عدم وجود ضريبة على الفاتورة أو ضريبة صفرية
-    conditions.append(
-        "(total_taxes_and_charges = 0 OR total_taxes_and_charges IS NULL)"
+    # الإجمالي يُحسب بجمع المجموعات دون استعلام إضافي
+    total_rows = build_tax_declaration_rows(
+        merge_bucket_summaries(sales_by_group.values()),
+        merge_bucket_summaries(purchase_by_group.values()),
+        merge_expense_summaries(expense_by_group.values()),
+        expense_voucher_types,
     )
 
-    condition_str = " AND ".join(conditions)
-    if condition_str:
-        condition_str = " AND " + condition_str
+    return get_grouped_columns(grouped_rows), merge_grouped_rows(total_rows, grouped_rows)
+
+
+def get_grouped_columns(groups):
+    """أعمدة البيان ثم مجموعة أعمدة لكل فترة / شركة ثم الإجمالي"""
+    columns = [get_columns()[0]]
+
+    for idx, (label, _rows) in enumerate(groups):
+        for column in get_columns()[1:]:
+            if column["fieldname"] == "adjustments":
+                continue
+            columns.append(
+                {
+                    **column,
+                    "fieldname": "{0}_{1}".format(column["fieldname"], idx),
+                    "label": "{0} ({1})".format(column["label"], label),
+                    "width": 150,
+                }
+            )
+
+    for column in get_columns()[1:]:
+        if column["fieldname"] == "adjustments":
+            continue
+        columns.append(
+            {**column, "label": "{0} ({1})".format(column["label"], _("الإجمالي"))}
+        )
 
-    non_taxable_returns_summary = frappe.db.sql(
-        """
-        SELECT 
-            ABS(COALESCE(SUM(base_grand_total), 0)) as base_total,
-            ABS(COALESCE(SUM(base_net_total), 0)) as net_amount,
-            ABS(COALESCE(SUM(base_grand_total - base_net_total), 0)) as adjustments,
-            0 as tax_amount
-        FROM 
-            `tabSales Invoice`
-        WHERE 
-            docstatus = 1
-            AND is_return = 1
-            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
-            {condition_str}
-    """.format(
-            condition_str=condition_str
-        ),
-        values,
-        as_dict=1,
-    )
+    return columns
 
-    return (
-        non_taxable_returns_summary[0]
-        if non_taxable_returns_summary
-        else {"base_total": 0, "net_amount": 0, "adjustments": 0, "tax_amount": 0}
-    )
 
+def merge_grouped_rows(total_rows, groups):
+    """دمج صفوف كل مجموعة في صفوف الإجمالي كأعمدة إضافية"""
+    data = []
+    for idx, total_row in enumerate(total_rows):
+        row = dict(total_row)
+        for group_idx, (_label, rows) in enumerate(groups):
+            for field in ("amount", "net_amount", "tax_amount"):
+                row["{0}_{1}".format(field, group_idx)] = rows[idx][field]
+        data.append(row)
 
-def get_taxable_purchase_summary(filters):
-    """الحصول على ملخص المشتريات الخاضعة للضريبة"""
-    # استعلام موجز للمشتريات
-    conditions = []
-    values = {"from_date": filters.get("from_date"), "to_date": filters.get("to_date")}
+    return data
 
-    if filters.get("company"):
-        conditions.append("company = %(company)s")
-        values["company"] = filters.get("company")
 
-    if filters.get("cost_center"):
-        conditions.append(
-            "EXISTS (SELECT name FROM `tabPurchase Invoice Item` WHERE parent = `tabPurchase Invoice`.name AND cost_center = %(cost_center)s)"
-        )
-        values["cost_center"] = filters.get("cost_center")
+def merge_bucket_summaries(summaries):
+    total = get_bucket_summary([])
+    for summary in summaries:
+        for bucket, values in summary.items():
+            for key in values:
+                total[bucket][key] = flt(total[bucket][key]) + flt(values[key])
 
-    # إضافة شرط للتأكد من وجود ضريبة على الفاتورة
-    conditions.append("total_taxes_and_charges > 0")
+    return total
 
-    condition_str = " AND ".join(conditions)
-    if condition_str:
-        condition_str = " AND " + condition_str
 
-    purchase_summary = frappe.db.sql(
-        """
-        SELECT 
-            COALESCE(SUM(base_grand_total), 0) as base_total,
-            COALESCE(SUM(base_net_total), 0) as net_amount,
-            COALESCE(SUM(base_grand_total - base_net_total), 0) as adjustments,
-            COALESCE(SUM(total_taxes_and_charges), 0) as tax_amount
-        FROM 
-            `tabPurchase Invoice`
-        WHERE 
-            docstatus = 1
-            AND is_return = 0
-            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
-            {condition_str}
-    """.format(
-            condition_str=condition_str
-        ),
-        values,
-        as_dict=1,
-    )
+def get_empty_expense_summary():
+    return {"base_total": 0, "tax_amount": 0}
 
-    return (
-        purchase_summary[0]
-        if purchase_summary
-        else {"base_total": 0, "net_amount": 0, "adjustments": 0, "tax_amount": 0}
+
+def merge_expense_summaries(summaries):
+    """جمع ملخصات المصروفات (لكل نوع مستند) من عدة مجموعات"""
+    total = {}
+    for summary in summaries:
+        for voucher_type, values in summary.items():
+            voucher_total = total.setdefault(voucher_type, get_empty_expense_summary())
+            for key in voucher_total:
+                voucher_total[key] = flt(voucher_total[key]) + flt(values.get(key))
+
+    return total
+
+
+# شروط تصنيف الفواتير إلى خاضعة / غير خاضعة ومرتجعات
+# (تُستخدم في استعلام التجميع الموحد لكل نوع فاتورة)
+TAX_BUCKET_CONDITIONS = {
+    "taxable": "is_return = 0 AND total_taxes_and_charges > 0",
+    "non_taxable": "is_return = 0 AND (total_taxes_and_charges = 0 OR total_taxes_and_charges IS NULL)",
+    "taxable_returns": "is_return = 1 AND ABS(total_taxes_and_charges) > 0",
+    "non_taxable_returns": "is_return = 1 AND (total_taxes_and_charges = 0 OR total_taxes_and_charges IS NULL)",
+}
+
+
+def get_empty_summary():
+    return {"base_total": 0, "net_amount": 0, "adjustments": 0, "tax_amount": 0}
+
+
+def get_tax_bucket_case():
+    """تعبير CASE يعيد اسم التصنيف الضريبي لكل فاتورة"""
+    return " ".join(
+        "WHEN {0} THEN '{1}'".format(condition, bucket)
+        for bucket, condition in TAX_BUCKET_CONDITIONS.items()
     )
 
 
-def get_non_taxable_purchase_summary(filters):
-    """الحصول على ملخص المشتريات غير الخاضعة للضريبة أو ذات الضريبة الصفرية"""
-    # استعلام موجز للمشتريات غير الخاضعة للضريبة
-    conditions = []
-    values = {"from_date": filters.get("from_date"), "to_date": filters.get("to_date")}
+def get_tax_bucket(is_return, tax_amount):
+    """نفس منطق TAX_BUCKET_CONDITIONS لفاتورة واحدة في بايثون"""
+    tax_amount = flt(tax_amount)
 
-    if filters.get("company"):
-        conditions.append("company = %(company)s")
-        values["company"] = filters.get("company")
+    if is_return:
+        return "taxable_returns" if abs(tax_amount) > 0 else "non_taxable_returns"
+
+    if tax_amount > 0:
+        return "taxable"
+    if tax_amount == 0:
+        return "non_taxable"
+
+    return None
 
-    if filters.get("cost_center"):
-        conditions.append(
-            "EXISTS (SELECT name FROM `tabPurchase Invoice Item` WHERE parent = `tabPurchase Invoice`.name AND cost_center = %(cost_center)s)"
-        )
-        values["cost_center"] = filters.get("cost_center")
 
-    # إضافة شرط للتأكد من عدم وجود ضريبة على الفاتورة أو ضريبة صفرية
-    conditions.append(
-        "(total_taxes_and_charges = 0 OR total_taxes_and_charges IS NULL)"
+def can_use_vat_period_ledger(filters):
+    """
+    يمكن قراءة الملخص من سجل الفترات الضريبية إذا تم بناؤه وكانت الفترة
+    أشهراً كاملة ولا يوجد فلتر مركز تكلفة (إلا في وضع التوزيع النسبي)
+    """
+    from muzaini_app.muzaini_app.doctype.vat_period_ledger.vat_period_ledger import (
+        is_ledger_ready,
     )
 
-    condition_str = " AND ".join(conditions)
-    if condition_str:
-        condition_str = " AND " + condition_str
+    companies = get_filter_companies(filters)
+    if not companies:
+        return False
+
+    # السجل موزع نسبياً على مراكز التكلفة، فلا يصلح إلا في وضع التوزيع النسبي
+    if filters.get("cost_center") and not filters.get("apportion_cost_center"):
+        return False
+
+    from_date = getdate(filters.get("from_date"))
+    to_date = getdate(filters.get("to_date"))
+
+    if from_date != get_first_day(from_date) or to_date != get_last_day(to_date):
+        return False
+
+    return is_ledger_ready(companies)
+
+
+def get_invoice_tax_summary(doctype, filters, group_by=None):
+    """
+    ملخص فواتير المبيعات أو المشتريات في استعلام واحد:
+    يتم تجميع الفواتير حسب التصنيف (خاضعة / غير خاضعة / مرتجعات) بدلاً من
+    تنفيذ استعلام منفصل لكل تصنيف على نفس الجدول.
+
+    عند تمرير group_by (تعبير SQL يحتوي على {date_field}) يتم التجميع
+    أيضاً حسب قيمته وتعاد النتيجة كقاموس لكل قيمة.
+    """
+    if can_use_vat_period_ledger(filters):
+        return get_ledger_tax_summary(doctype, filters, group_by)
+
+    query = get_invoice_query_parts(doctype, filters)
+    if not query:
+        return get_grouped_bucket_summary([], group_by)
 
-    non_taxable_purchase_summary = frappe.db.sql(
+    rows = frappe.db.sql(
         """
         SELECT 
-            COALESCE(SUM(base_grand_total), 0) as base_total,
-            COALESCE(SUM(base_net_total), 0) as net_amount,
-            COALESCE(SUM(base_grand_total - base_net_total), 0) as adjustments,
-            0 as tax_amount
+            {group_key} as group_key,
+            CASE {bucket_case} END as bucket,
+            COALESCE(SUM(base_grand_total * {weight}), 0) as base_total,
+            COALESCE(SUM(base_net_total * {weight}), 0) as net_amount,
+            COALESCE(SUM((base_grand_total - base_net_total) * {weight}), 0) as adjustments,
+            COALESCE(SUM(total_taxes_and_charges * {weight}), 0) as tax_amount
         FROM 
-            `tabPurchase Invoice`
+            `tab{doctype}`
+            {cost_center_join}
         WHERE 
-            docstatus = 1
-            AND is_return = 0
-            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
-            {condition_str}
+            {conditions}
+        GROUP BY
+            group_key, bucket
     """.format(
-            condition_str=condition_str
+            group_key=(group_by or "''").format(
+                date_field="posting_date", company_field="company"
+            ),
+            bucket_case=get_tax_bucket_case(),
+            weight=query.weight,
+            doctype=doctype,
+            cost_center_join=query.cost_center_join,
+            conditions=query.conditions,
         ),
-        values,
+        query.values,
         as_dict=1,
     )
 
-    return (
-        non_taxable_purchase_summary[0]
-        if non_taxable_purchase_summary
-        else {"base_total": 0, "net_amount": 0, "adjustments": 0, "tax_amount": 0}
-    )
+    return get_grouped_bucket_summary(rows, group_by)
 
 
-def get_non_taxable_purchase_returns_summary(filters):
-    """الحصول على ملخص مرتجعات المشتريات غير الخاضعة للضريبة"""
-    # استعلام موجز لمرتجعات المشتريات غير الخاضعة للضريبة
-    conditions = []
+def get_invoice_query_parts(doctype, filters):
+    """
+    شروط استعلام الفواتير المشتركة بين ملخص الإقرار وتفصيل المستندات
+    حتى تتطابق الإجماليات دائماً. تعيد None إذا لم توجد فواتير لمركز التكلفة.
+    """
+    conditions = ["docstatus = 1", "posting_date BETWEEN %(from_date)s AND %(to_date)s"]
     values = {"from_date": filters.get("from_date"), "to_date": filters.get("to_date")}
+    cost_center_join = ""
+    weight = "1"
 
-    if filters.get("company"):
-        conditions.append("company = %(company)s")
-        values["company"] = filters.get("company")
+    company_condition = get_company_condition("company", filters, values)
+    if company_condition:
+        conditions.append(company_condition)
 
     if filters.get("cost_center"):
-        conditions.append(
-            "EXISTS (SELECT name FROM `tabPurchase Invoice Item` WHERE parent = `tabPurchase Invoice`.name AND cost_center = %(cost_center)s)"
+        # مجموعة الفواتير المطابقة لمركز التكلفة تُحسب مرة واحدة وتُستخدم في كل الاستعلامات
+        cost_center_invoices = get_cost_center_invoices(
+            doctype,
+            filters.get("company"),
+            filters.get("cost_center"),
+            filters.get("from_date"),
+            filters.get("to_date"),
         )
+        if not cost_center_invoices:
+            return None
+
+        conditions.append("`tab{0}`.name IN %(cost_center_invoices)s".format(doctype))
+        values["cost_center_invoices"] = cost_center_invoices
         values["cost_center"] = filters.get("cost_center")
 
-    # إضافة شرط للتأكد من عدم وجود ضريبة على الفاتورة أو ضريبة صفرية
-    conditions.append(
-        "(total_taxes_and_charges = 0 OR total_taxes_and_charges IS NULL)"
+        if filters.get("apportion_cost_center"):
+            # توزيع قيم الفاتورة حسب نسبة صافي بنود مركز التكلفة
+            cost_center_join = """
+                INNER JOIN (
+                    SELECT
+                        parent,
+                        SUM(IF(cost_center = %(cost_center)s, base_net_amount, 0)) as cc_net,
+                        SUM(IF(cost_center = %(cost_center)s, 1, 0)) as cc_lines,
+                        COUNT(*) as total_lines
+                    FROM `tab{0} Item`
+                    WHERE parent IN %(cost_center_invoices)s
+                    GROUP BY parent
+                ) cc ON cc.parent = `tab{0}`.name
+            """.format(doctype)
+            weight = (
+                "(CASE WHEN base_net_total != 0 THEN cc.cc_net / base_net_total "
+                "ELSE cc.cc_lines / cc.total_lines END)"
+            )
+
+    return frappe._dict(
+        conditions=" AND ".join(conditions),
+        values=values,
+        cost_center_join=cost_center_join,
+        weight=weight,
     )
 
-    condition_str = " AND ".join(conditions)
-    if condition_str:
-        condition_str = " AND " + condition_str
 
-    non_taxable_purchase_returns_summary = frappe.db.sql(
+@request_cache
+def get_cost_center_invoices(doctype, company, cost_center, from_date, to_date):
+    """
+    أسماء الفواتير التي تحتوي على بنود بمركز التكلفة المحدد خلال الفترة
+    (استعلام واحد على جدول البنود بدلاً من EXISTS لكل فاتورة)
+    """
+    conditions = ""
+    if company:
+        conditions = "AND inv.company = %(company)s"
+
+    invoices = frappe.db.sql_list(
         """
-        SELECT 
-            ABS(COALESCE(SUM(base_grand_total), 0)) as base_total,
-            ABS(COALESCE(SUM(base_net_total), 0)) as net_amount,
-            ABS(COALESCE(SUM(base_grand_total - base_net_total), 0)) as adjustments,
-            0 as tax_amount
-        FROM 
-            `tabPurchase Invoice`
-        WHERE 
-            docstatus = 1
-            AND is_return = 1
-            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
-            {condition_str}
+        SELECT DISTINCT item.parent
+        FROM `tab{doctype} Item` item
+        INNER JOIN `tab{doctype}` inv ON inv.name = item.parent
+        WHERE item.cost_center = %(cost_center)s
+            AND inv.docstatus = 1
+            AND inv.posting_date BETWEEN %(from_date)s AND %(to_date)s
+            {conditions}
     """.format(
-            condition_str=condition_str
+            doctype=doctype, conditions=conditions
         ),
-        values,
-        as_dict=1,
-    )
-
-    return (
-        non_taxable_purchase_returns_summary[0]
-        if non_taxable_purchase_returns_summary
-        else {"base_total": 0, "net_amount": 0, "adjustments": 0, "tax_amount": 0}
+        {
+            "company": company,
+            "cost_center": cost_center,
+            "from_date": from_date,
+            "to_date": to_date,
+        },
     )
 
+    return tuple(invoices)
 
-def get_returns_summary(filters):
-    # استعلام موجز للمرتجعات (سندات الإشعار الدائنة)
-    conditions = []
-    values = {"from_date": filters.get("from_date"), "to_date": filters.get("to_date")}
 
-    if filters.get("company"):
-        conditions.append("company = %(company)s")
-        values["company"] = filters.get("company")
-
-    if filters.get("cost_center"):
-        conditions.append(
-            "EXISTS (SELECT name FROM `tabSales Invoice Item` WHERE parent = `tabSales Invoice`.name AND cost_center = %(cost_center)s)"
-        )
-        values["cost_center"] = filters.get("cost_center")
-
-    # إضافة شرط للتأكد من وجود ضريبة على الفاتورة (مع مراعاة أن المبلغ قد يكون سالب)
-    conditions.append("ABS(total_taxes_and_charges) > 0")
-
-    condition_str = " AND ".join(conditions)
-    if condition_str:
-        condition_str = " AND " + condition_str
+def get_ledger_tax_summary(doctype, filters, group_by=None):
+    """قراءة ملخص الفواتير من سجل الفترات الضريبية المجمّع مسبقاً"""
+    values = {
+        "cost_center": filters.get("cost_center"),
+        "doctype": doctype,
+        "from_date": filters.get("from_date"),
+        "to_date": filters.get("to_date"),
+    }
+    company_condition = get_company_condition("company", filters, values)
 
-    returns_summary = frappe.db.sql(
+    rows = frappe.db.sql(
         """
         SELECT 
-            ABS(COALESCE(SUM(base_grand_total), 0)) as base_total,
-            ABS(COALESCE(SUM(base_net_total), 0)) as net_amount,
-            ABS(COALESCE(SUM(base_grand_total - base_net_total), 0)) as adjustments,
-            ABS(COALESCE(SUM(total_taxes_and_charges), 0)) as tax_amount
+            {group_key} as group_key,
+            CONCAT(
+                IF(is_taxable = 1, 'taxable', 'non_taxable'),
+                IF(is_return = 1, '_returns', '')
+            ) as bucket,
+            COALESCE(SUM(base_grand_total), 0) as base_total,
+            COALESCE(SUM(base_net_total), 0) as net_amount,
+            COALESCE(SUM(base_grand_total - base_net_total), 0) as adjustments,
+            COALESCE(SUM(tax_amount), 0) as tax_amount
         FROM 
-            `tabSales Invoice`
+            `tabVAT Period Ledger`
         WHERE 
-            docstatus = 1
-            AND is_return = 1
-            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
-            {condition_str}
+            invoice_doctype = %(doctype)s
+            AND {company_condition}
+            AND posting_month BETWEEN %(from_date)s AND %(to_date)s
+            {cost_center_condition}
+        GROUP BY
+            group_key, bucket
     """.format(
-            condition_str=condition_str
+            group_key=(group_by or "''").format(
+                date_field="posting_month", company_field="company"
+            ),
+            company_condition=company_condition,
+            cost_center_condition=(
+                "AND cost_center = %(cost_center)s" if filters.get("cost_center") else ""
+            ),
         ),
         values,
         as_dict=1,
     )
 
-    return (
-        returns_summary[0]
-        if returns_summary
-        else {"base_total": 0, "net_amount": 0, "adjustments": 0, "tax_amount": 0}
-    )
+    return get_grouped_bucket_summary(rows, group_by)
 
 
-def get_purchase_returns_summary(filters):
-    # استعلام موجز لمرتجعات المشتريات
-    conditions = []
-    values = {"from_date": filters.get("from_date"), "to_date": filters.get("to_date")}
+def get_grouped_bucket_summary(rows, group_by=None):
+    """ملخص واحد، أو قاموس ملخصات حسب group_key عند التجميع"""
+    if not group_by:
+        return get_bucket_summary(rows)
 
-    if filters.get("company"):
-        conditions.append("company = %(company)s")
-        values["company"] = filters.get("company")
+    rows_by_group = {}
+    for row in rows:
+        rows_by_group.setdefault(row.group_key, []).append(row)
 
-    if filters.get("cost_center"):
-        conditions.append(
-            "EXISTS (SELECT name FROM `tabPurchase Invoice Item` WHERE parent = `tabPurchase Invoice`.name AND cost_center = %(cost_center)s)"
-        )
-        values["cost_center"] = filters.get("cost_center")
+    return {key: get_bucket_summary(group_rows) for key, group_rows in rows_by_group.items()}
 
-    # إضافة شرط للتأكد من وجود ضريبة على الفاتورة (مع مراعاة أن المبلغ قد يكون سالب)
-    conditions.append("ABS(total_taxes_and_charges) > 0")
 
-    condition_str = " AND ".join(conditions)
-    if condition_str:
-        condition_str = " AND " + condition_str
+def get_bucket_summary(rows):
+    """تحويل صفوف التجميع حسب التصنيف إلى ملخص لكل تصنيف"""
+    summary = {bucket: get_empty_summary() for bucket in TAX_BUCKET_CONDITIONS}
 
-    purchase_returns_summary = frappe.db.sql(
-        """
-        SELECT 
-            ABS(COALESCE(SUM(base_grand_total), 0)) as base_total,
-            ABS(COALESCE(SUM(base_net_total), 0)) as net_amount,
-            ABS(COALESCE(SUM(base_grand_total - base_net_total), 0)) as adjustments,
-            ABS(COALESCE(SUM(total_taxes_and_charges), 0)) as tax_amount
-        FROM 
-            `tabPurchase Invoice`
-        WHERE 
-            docstatus = 1
-            AND is_return = 1
-            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
-            {condition_str}
-    """.format(
-            condition_str=condition_str
-        ),
-        values,
-        as_dict=1,
-    )
+    for row in rows:
+        if not row.bucket:
+            # فواتير خارج التصنيفات (مثل ضريبة سالبة على فاتورة عادية)
+            continue
 
-    return (
-        purchase_returns_summary[0]
-        if purchase_returns_summary
-        else {"base_total": 0, "net_amount": 0, "adjustments": 0, "tax_amount": 0}
-    )
+        bucket_summary = summary[row.bucket]
+        for key in bucket_summary:
+            value = flt(row.get(key))
+            # المرتجعات تُعرض بالقيمة المطلقة
+            if row.bucket.endswith("_returns"):
+                value = abs(value)
+            bucket_summary[key] = value
+
+        if row.bucket.startswith("non_taxable"):
+            bucket_summary["tax_amount"] = 0
+
+    return summary
+
+
+# مفتاح التخزين المؤقت لقائمة الحسابات الضريبية لكل شركة
+TAX_ACCOUNTS_CACHE_KEY = "muzaini_tax_accounts"
 
 
 def get_tax_accounts(filters):
-    """الحصول على قائمة بالحسابات الضريبية في ERPNext - نسخة محسنة ومركزة"""
-    company = filters.get("company")
+    """الحصول على قائمة بالحسابات الضريبية للشركة (أو الشركات) من التخزين المؤقت"""
+    companies = get_filter_companies(filters)
 
-    if not company:
+    if not companies:
         return []
 
-    # جمع كل الحسابات الضريبية في قائمة واحدة
-    all_tax_accounts = []
+    accounts_map = get_tax_accounts_map(companies)
+
+    tax_accounts = []
+    for company in companies:
+        tax_accounts.extend(accounts_map.get(company) or [])
+
+    return tax_accounts
+
+
+def get_tax_accounts_map(companies):
+    """
+    الحسابات الضريبية لكل شركة: تُقرأ من التخزين المؤقت، والشركات غير المخزنة
+    يتم البحث عنها معاً في نفس الاستعلامات
+    """
+    cache = frappe.cache()
+    accounts_map = {}
+    missing_companies = []
+
+    for company in companies:
+        accounts = cache.hget(TAX_ACCOUNTS_CACHE_KEY, company)
+        if accounts is None:
+            missing_companies.append(company)
+        else:
+            accounts_map[company] = accounts
+
+    if missing_companies:
+        found_accounts = find_tax_accounts(missing_companies)
+        for company in missing_companies:
+            accounts_map[company] = found_accounts.get(company) or []
+            cache.hset(TAX_ACCOUNTS_CACHE_KEY, company, accounts_map[company])
+
+    return accounts_map
+
+
+def clear_tax_accounts_cache(doc, method=None, *args, **kwargs):
+    """مسح قائمة الحسابات الضريبية المخزنة عند إضافة أو تعديل أو حذف حساب"""
+    if doc.get("company"):
+        frappe.cache().hdel(TAX_ACCOUNTS_CACHE_KEY, doc.company)
+    else:
+        frappe.cache().delete_value(TAX_ACCOUNTS_CACHE_KEY)
+
+
+def find_tax_accounts(companies):
+    """البحث عن الحسابات الضريبية في ERPNext لعدة شركات - نسخة محسنة ومركزة"""
+    values = {"companies": tuple(companies)}
 
     # 1. الحسابات ذات النوع "Tax" (الأكثر دقة)
     tax_type_accounts = frappe.db.sql(
         """
-        SELECT name FROM `tabAccount` 
-        WHERE company = %s AND is_group = 0 AND account_type = 'Tax'
+        SELECT company, name FROM `tabAccount` 
+        WHERE company IN %(companies)s AND is_group = 0 AND account_type = 'Tax'
     """,
-        (company),
+        values,
         as_dict=0,
     )
 
     # 2. الحسابات تحت مجموعات الضرائب الرئيسية
     tax_group_accounts = frappe.db.sql(
         """
-        SELECT a.name 
+        SELECT a.company, a.name 
         FROM `tabAccount` a
         JOIN `tabAccount` parent ON a.parent_account = parent.name
-        WHERE a.company = %s AND a.is_group = 0 
+        WHERE a.company IN %(companies)s AND a.is_group = 0 
         AND (
             parent.account_name LIKE '%%Duties and Taxes%%' OR
             parent.account_name LIKE '%%ضرائب%%' OR
@@ -883,15 +1035,15 @@ def get_tax_accounts(filters):
             parent.account_name LIKE '%%VAT%%'
         )
     """,
-        (company),
+        values,
         as_dict=0,
     )
 
     # 3. الحسابات ذات الأسماء المتعلقة بالضرائب (مثل ضريبة القيمة المضافة أو VAT)
     tax_named_accounts = frappe.db.sql(
         """
-        SELECT name FROM `tabAccount`
-        WHERE company = %s AND is_group = 0
+        SELECT company, name FROM `tabAccount`
+        WHERE company IN %(companies)s AND is_group = 0
         AND (
             account_name LIKE '%%ضريب%%' OR 
             account_name LIKE '%%VAT%%' OR
@@ -899,113 +1051,160 @@ def get_tax_accounts(filters):
             name LIKE '%%VAT%%'
         )
     """,
-        (company),
+        values,
         as_dict=0,
     )
 
-    # إضافة كل النتائج إلى القائمة
-    if tax_type_accounts:
-        all_tax_accounts.extend([x[0] for x in tax_type_accounts])
+    # جمع النتائج لكل شركة مع إزالة التكرارات والقيم الفارغة
+    accounts_by_company = {}
+    for company, account in (
+        list(tax_type_accounts) + list(tax_group_accounts) + list(tax_named_accounts)
+    ):
+        if account:
+            accounts_by_company.setdefault(company, set()).add(account)
 
-    if tax_group_accounts:
-        all_tax_accounts.extend([x[0] for x in tax_group_accounts])
+    return {company: list(accounts) for company, accounts in accounts_by_company.items()}
 
-    if tax_named_accounts:
-        all_tax_accounts.extend([x[0] for x in tax_named_accounts])
 
-    # إزالة التكرارات والقيم الفارغة
-    unique_tax_accounts = list(set([acc for acc in all_tax_accounts if acc]))
+def get_filter_companies(filters):
+    """الشركات المطلوبة: قائمة الشركات في الإقرار الموحد أو الشركة المحددة"""
+    companies = filters.get("companies")
+    if companies:
+        if not isinstance(companies, list):
+            companies = [companies]
+        return companies
 
-    return unique_tax_accounts if unique_tax_accounts else []
+    return [filters.get("company")] if filters.get("company") else []
 
 
-def get_journal_entries_tax_summary(filters):
-    """الحصول على ضريبة المصروفات من القيود اليومية فقط - للحسابات الضريبية فقط"""
-    # قائمة بالحسابات الضريبية
-    tax_accounts = get_tax_accounts(filters)
-
-    if not tax_accounts:
-        return {"base_total": 0, "tax_amount": 0}
-
-    conditions = []
-    values = {
-        "from_date": filters.get("from_date"),
-        "to_date": filters.get("to_date"),
-        "tax_accounts": tax_accounts,
-    }
+def get_company_condition(field, filters, values):
+    """شرط الشركة (أو الشركات في الإقرار الموحد)"""
+    if filters.get("companies"):
+        values["companies"] = tuple(get_filter_companies(filters))
+        return "{0} IN %(companies)s".format(field)
 
     if filters.get("company"):
-        conditions.append("je.company = %(company)s")
         values["company"] = filters.get("company")
+        return "{0} = %(company)s".format(field)
 
-    if filters.get("cost_center"):
-        conditions.append("jea.cost_center = %(cost_center)s")
-        values["cost_center"] = filters.get("cost_center")
+    return ""
 
-    # إذا تم تحديد حساب ضريبي، نقوم بتصفية البيانات وفقًا لذلك
-    if filters.get("tax_account"):
-        conditions.append("jea.account = %(tax_account)s")
-        values["tax_account"] = filters.get("tax_account")
-    else:
-        # استخدام قائمة الحسابات الضريبية
-        conditions.append("jea.account IN %(tax_accounts)s")
 
-    # شرط إضافي للتأكد من أن نوع القيد هو "قيد يومي"
-    conditions.append("je.voucher_type = 'Journal Entry'")
+# صفوف المصروفات الأساسية في الإقرار (رمز الصف، الوصف)
+EXPENSE_VOUCHER_TYPES = {
+    "Journal Entry": ("expenses_journal_entry", "المصروفات (القيود اليومية)"),
+    "Payment Entry": ("expenses_payment_entry", "المصروفات (سندات الصرف)"),
+}
 
-    # إضافة شرط للتأكد من أن قيمة المدين لحساب الضريبة أكبر من الصفر
-    conditions.append("jea.debit > 0")
+# الفواتير لها أقسامها الخاصة في الإقرار ولا تُحتسب ضمن المصروفات
+INVOICE_VOUCHER_TYPES = ("Sales Invoice", "Purchase Invoice")
+
+
+def get_expense_voucher_types(filters):
+    """أنواع المستندات التي تظهر كصفوف مصروفات (الأساسية + الإضافية من الفلتر)"""
+    voucher_types = list(EXPENSE_VOUCHER_TYPES)
+
+    extra_voucher_types = filters.get("expense_voucher_types") or []
+    if not isinstance(extra_voucher_types, list):
+        extra_voucher_types = [extra_voucher_types]
+
+    for voucher_type in extra_voucher_types:
+        if voucher_type not in voucher_types and voucher_type not in INVOICE_VOUCHER_TYPES:
+            voucher_types.append(voucher_type)
+
+    return voucher_types
+
+
+def get_expense_row_code(voucher_type):
+    if voucher_type in EXPENSE_VOUCHER_TYPES:
+        return EXPENSE_VOUCHER_TYPES[voucher_type][0]
+
+    return "expenses_" + frappe.scrub(voucher_type)
+
+
+def get_expense_row_label(voucher_type):
+    if voucher_type in EXPENSE_VOUCHER_TYPES:
+        return EXPENSE_VOUCHER_TYPES[voucher_type][1]
+
+    return "المصروفات ({0})".format(_(voucher_type))
 
-    condition_str = " AND ".join(conditions)
-    if condition_str:
-        condition_str = " AND " + condition_str
 
-    # استعلام القيود اليومية التي تحتوي على ضرائب - للمدين
-    debit_tax_summary = frappe.db.sql(
+def get_expense_tax_summary(filters, tax_accounts, voucher_types, group_by=None):
+    """
+    ضريبة المصروفات من قيود الأستاذ العام على الحسابات الضريبية في استعلام واحد
+    مجمّع حسب نوع المستند (القيود اليومية، سندات الصرف، وأي نوع إضافي)
+    """
+    query = get_expense_query_parts(filters, tax_accounts, voucher_types)
+    if not query:
+        return {}
+
+    expense_summary = frappe.db.sql(
         """
         SELECT 
-            COALESCE(SUM(jea.debit), 0) as base_total,
-            COALESCE(SUM(jea.debit), 0) as tax_amount
+            {group_key} as group_key,
+            gl.voucher_type,
+            COALESCE(SUM(gl.debit), 0) as base_total,
+            COALESCE(SUM(gl.debit), 0) as tax_amount
         FROM 
-            `tabJournal Entry` je
-        INNER JOIN
-            `tabJournal Entry Account` jea ON je.name = jea.parent
+            {tables}
         WHERE 
-            je.docstatus = 1
-            AND je.posting_date BETWEEN %(from_date)s AND %(to_date)s
-            {condition_str}
+            {conditions}
+        GROUP BY
+            group_key, gl.voucher_type
     """.format(
-            condition_str=condition_str
+            group_key=(group_by or "''").format(
+                date_field="gl.posting_date", company_field="gl.company"
+            ),
+            tables=query.tables,
+            conditions=query.conditions,
         ),
-        values,
+        query.values,
         as_dict=1,
     )
 
-    return (
-        debit_tax_summary[0]
-        if debit_tax_summary
-        else {"base_total": 0, "tax_amount": 0}
-    )
+    summary_by_group = {}
+    for row in expense_summary:
+        summary_by_group.setdefault(row.group_key, {})[row.voucher_type] = row
 
+    if group_by:
+        return summary_by_group
 
-def get_payment_entries_tax_summary(filters):
-    """الحصول على ضريبة المصروفات من سندات الصرف من خلال القيود المحاسبية"""
-    # الحصول على حسابات الضرائب
-    tax_accounts = get_tax_accounts(filters)
+    return summary_by_group.get("") or {}
 
-    if not tax_accounts:
-        return {"base_total": 0, "tax_amount": 0}
 
-    conditions = []
+def get_expense_query_parts(filters, tax_accounts, voucher_types):
+    """
+    جداول وشروط استعلام ضريبة المصروفات المشتركة بين ملخص الإقرار وتفصيل المستندات.
+    تعيد None إذا لم توجد حسابات ضريبية.
+    """
+    if not tax_accounts:
+        return None
+
+    # القيود اليومية تقتصر على نوع "قيد يومي" كما في السابق (ربط بالمفتاح الأساسي فقط)
+    conditions = [
+        "gl.is_cancelled = 0",
+        "gl.posting_date BETWEEN %(from_date)s AND %(to_date)s",
+        "gl.debit > 0",
+        "gl.voucher_type IN %(voucher_types)s",
+        "(gl.voucher_type != 'Journal Entry' OR je.voucher_type = 'Journal Entry')",
+    ]
     values = {
         "from_date": filters.get("from_date"),
         "to_date": filters.get("to_date"),
         "tax_accounts": tax_accounts,
+        "voucher_types": tuple(voucher_types),
     }
 
-    if filters.get("company"):
-        conditions.append("gl.company = %(company)s")
-        values["company"] = filters.get("company")
+    company_condition = get_company_condition("gl.company", filters, values)
+    if company_condition:
+        conditions.append(company_condition)
+
+    # فلتر مركز التكلفة (سندات الصرف لا تُفلتر بمركز التكلفة كما في السابق)
+    if filters.get("cost_center"):
+        conditions.append(
+            "(gl.voucher_type = 'Payment Entry' OR gl.cost_center = %(cost_center)s)"
+        )
+        values["cost_center"] = filters.get("cost_center")
 
     # فلتر حساب الضريبة
     if filters.get("tax_account"):
@@ -1014,38 +1213,171 @@ def get_payment_entries_tax_summary(filters):
     else:
         conditions.append("gl.account IN %(tax_accounts)s")
 
-    # فلترة حسب سندات المدفوعات فقط
-    conditions.append("gl.voucher_type = 'Payment Entry'")
+    return frappe._dict(
+        tables="""`tabGL Entry` gl
+            LEFT JOIN `tabJournal Entry` je
+                ON gl.voucher_type = 'Journal Entry' AND je.name = gl.voucher_no""",
+        conditions=" AND ".join(conditions),
+        values=values,
+    )
+
+
+# جداول الضرائب المرتبطة بكل نوع فاتورة
+TAXES_DOCTYPES = {
+    "Sales Invoice": "Sales Taxes and Charges",
+    "Purchase Invoice": "Purchase Taxes and Charges",
+}
+
+RATE_BREAKDOWN_LABELS = {
+    ("Sales Invoice", 0): ("sales", "المبيعات"),
+    ("Sales Invoice", 1): ("sales_returns", "مرتجعات المبيعات"),
+    ("Purchase Invoice", 0): ("purchase", "المشتريات"),
+    ("Purchase Invoice", 1): ("purchase_returns", "مرتجعات المشتريات"),
+}
+
+
+def get_rate_breakdown_rows(filters):
+    """صفوف تفصيل الإقرار حسب قالب ضريبة الصنف ونسبة الضريبة لكل بند"""
+    tax_accounts = get_tax_accounts(filters)
+
+    rows = [
+        {
+            "row_code": "rate_breakdown_section",
+            "description": "--- التفصيل حسب قالب ونسبة الضريبة ---",
+            "amount": "",
+            "adjustments": "",
+            "net_amount": "",
+            "tax_amount": "",
+        }
+    ]
+
+    for doctype in INVOICE_VOUCHER_TYPES:
+        for row in get_rate_breakdown(doctype, filters, tax_accounts):
+            code, label = RATE_BREAKDOWN_LABELS[(doctype, row.is_return)]
+            rate = "{0:g}".format(flt(row.tax_rate, 2))
+            net_amount = flt(abs(flt(row.net_amount)), 2)
+
+            rows.append(
+                {
+                    "row_code": "rate_{0}_{1}_{2}".format(
+                        code,
+                        frappe.scrub(row.item_tax_template) or "no_template",
+                        rate.replace(".", "_"),
+                    ),
+                    "description": "{0} - {1} ({2}%)".format(
+                        label, row.item_tax_template or _("بدون قالب ضريبي"), rate
+                    ),
+                    "amount": net_amount,
+                    "adjustments": 0.00,
+                    "net_amount": net_amount,
+                    "tax_amount": flt(abs(flt(row.tax_amount)), 2),
+                }
+            )
+
+    return rows
+
+
+def get_rate_breakdown(doctype, filters, tax_accounts):
+    """
+    تجميع بنود الفواتير حسب قالب الضريبة والنسبة الفعلية للبند في استعلام واحد.
+    نسبة البند هي نسبة قالب الصنف (item_tax_rate) للحساب الضريبي إن وجدت،
+    وإلا نسبة سطر الضريبة في الفاتورة؛ التجميع يتم داخل قاعدة البيانات
+    فلا يعود إلا صف واحد لكل (قالب، نسبة) مهما كان عدد البنود.
+    """
+    conditions = []
+    values = {
+        "from_date": filters.get("from_date"),
+        "to_date": filters.get("to_date"),
+        "doctype": doctype,
+    }
+
+    company_condition = get_company_condition("inv.company", filters, values)
+    if company_condition:
+        conditions.append(company_condition)
+
+    # على مستوى البنود يطبق مركز التكلفة على البند نفسه
+    if filters.get("cost_center"):
+        conditions.append("item.cost_center = %(cost_center)s")
+        values["cost_center"] = filters.get("cost_center")
+
+    tax_account_condition = ""
+    if tax_accounts:
+        tax_account_condition = "AND tax.account_head IN %(tax_accounts)s"
+        values["tax_accounts"] = tax_accounts
 
     condition_str = " AND ".join(conditions)
     if condition_str:
         condition_str = " AND " + condition_str
 
-    # استعلام للحصول على مبلغ الضريبة من القيود المحاسبية
-    payment_entries_summary = frappe.db.sql(
+    return frappe.db.sql(
         """
-        SELECT 
-            COALESCE(SUM(gl.debit), 0) as base_total,
-            COALESCE(SUM(gl.debit), 0) as tax_amount
-        FROM 
-            `tabGL Entry` gl
-        WHERE 
-            gl.docstatus = 1
-            AND gl.posting_date BETWEEN %(from_date)s AND %(to_date)s
-            AND gl.debit > 0
-            {condition_str}
+        SELECT
+            line.is_return,
+            line.item_tax_template,
+            line.tax_rate,
+            SUM(line.base_net_amount) as net_amount,
+            SUM(line.base_net_amount * line.tax_rate / 100) as tax_amount
+        FROM (
+            SELECT
+                inv.is_return,
+                COALESCE(item.item_tax_template, '') as item_tax_template,
+                item.base_net_amount,
+                ROUND(COALESCE(SUM(COALESCE(
+                    JSON_VALUE(NULLIF(item.item_tax_rate, ''), CONCAT('$."', tax.account_head, '"')),
+                    tax.rate
+                )), 0), 2) as tax_rate
+            FROM
+                `tab{doctype} Item` item
+            INNER JOIN
+                `tab{doctype}` inv ON inv.name = item.parent
+            LEFT JOIN
+                `tab{taxes_doctype}` tax
+                ON tax.parent = item.parent
+                AND tax.parenttype = %(doctype)s
+                AND tax.charge_type = 'On Net Total'
+                {tax_account_condition}
+            WHERE
+                inv.docstatus = 1
+                AND inv.posting_date BETWEEN %(from_date)s AND %(to_date)s
+                {condition_str}
+            GROUP BY
+                item.name
+        ) line
+        GROUP BY
+            line.is_return, line.item_tax_template, line.tax_rate
+        ORDER BY
+            line.is_return, line.tax_rate DESC, line.item_tax_template
     """.format(
-            condition_str=condition_str
+            doctype=doctype,
+            taxes_doctype=TAXES_DOCTYPES[doctype],
+            tax_account_condition=tax_account_condition,
+            condition_str=condition_str,
         ),
         values,
         as_dict=1,
     )
 
-    return (
-        payment_entries_summary[0]
-        if payment_entries_summary
-        else {"base_total": 0, "tax_amount": 0}
-    )
+
+@frappe.whitelist()
+def get_tax_declaration(filters):
+    """واجهة برمجية: صفوف الإقرار كقاموس حسب رمز الصف مع الملخص"""
+    check_report_permission()
+
+    filters = frappe._dict(frappe.parse_json(filters))
+    _columns, data, _message, _chart, summary = execute(filters)
+
+    return {"rows": get_rows_by_code(data), "summary": summary}
+
+
+def check_report_permission():
+    """التحقق من صلاحية المستخدم على التقرير قبل تنفيذ الواجهات البرمجية"""
+    if not frappe.get_cached_doc("Report", "Tax Declaration Report").is_permitted():
+        frappe.throw(_("ليس لديك صلاحية للوصول إلى تقرير الإقرار الضريبي"), frappe.PermissionError)
+
+
+def get_rows_by_code(data):
+    """قاموس صفوف الإقرار حسب رمز الصف (row_code)"""
+    return {row["row_code"]: row for row in data if row.get("row_code")}
 
 
 def get_summary(data):
@@ -1058,37 +1390,34 @@ def get_summary(data):
         except (ValueError, TypeError):
             return "0.00"
 
-    # البحث عن الصفوف المطلوبة في البيانات باستخدام الوصف
-    def find_row(description):
-        return next(
-            (row for row in data if row.get("description") == description),
-            {"amount": 0, "tax_amount": 0},
-        )
+    # الوصول إلى الصفوف المطلوبة باستخدام رمز الصف
+    rows_by_code = get_rows_by_code(data)
+
+    def find_row(row_code):
+        return rows_by_code.get(row_code) or {"amount": 0, "tax_amount": 0}
 
     # الحصول على بيانات الصفوف المهمة
-    taxable_sales = find_row("المبيعات الخاضعة للنسبة الأساسية")
-    non_taxable_sales = find_row("المبيعات غير الخاضعة أو الضريبة الصفرية")
-    total_sales = find_row("اجمالي المبيعات")
-    taxable_sales_returns = find_row("مرتجعات المبيعات الخاضعة للنسبة الأساسية")
-    non_taxable_sales_returns = find_row("مرتجعات المبيعات غير الخاضعة للضريبة")
-    total_sales_returns = find_row("اجمالي مرتجعات المبيعات")
-    sales_net = find_row("صافي المبيعات (بعد خصم المرتجعات)")
-
-    taxable_purchases = find_row("المشتريات الخاضعة للنسبة الأساسية")
-    non_taxable_purchases = find_row("المشتريات غير الخاضعة أو الضريبة الصفرية")
-    total_purchases = find_row("اجمالي المشتريات")
-    taxable_purchase_returns = find_row("مرتجعات المشتريات الخاضعة للنسبة الأساسية")
-    non_taxable_purchase_returns = find_row("مرتجعات المشتريات غير الخاضعة للضريبة")
-    total_purchase_returns = find_row("اجمالي مرتجعات المشتريات")
-    purchase_net = find_row("صافي المشتريات (بعد خصم المرتجعات)")
-
-    journal_entries = find_row("المصروفات (القيود اليومية)")
-    payment_entries = find_row("المصروفات (سندات الصرف)")
-    total_recoverable = find_row("اجمالي الضريبة المستردة (المشتريات والمصروفات)")
-
-    vat_due = find_row(
-        "اجمالي ضريبة القيمة المضافة المستحقة عن الفترة الضريبية الحالية"
-    )
+    taxable_sales = find_row("sales_taxable")
+    non_taxable_sales = find_row("sales_non_taxable")
+    total_sales = find_row("sales_total")
+    taxable_sales_returns = find_row("sales_returns_taxable")
+    non_taxable_sales_returns = find_row("sales_returns_non_taxable")
+    total_sales_returns = find_row("sales_returns_total")
+    sales_net = find_row("sales_net")
+
+    taxable_purchases = find_row("purchase_taxable")
+    non_taxable_purchases = find_row("purchase_non_taxable")
+    total_purchases = find_row("purchase_total")
+    taxable_purchase_returns = find_row("purchase_returns_taxable")
+    non_taxable_purchase_returns = find_row("purchase_returns_non_taxable")
+    total_purchase_returns = find_row("purchase_returns_total")
+    purchase_net = find_row("purchase_net")
+
+    journal_entries = find_row("expenses_journal_entry")
+    payment_entries = find_row("expenses_payment_entry")
+    total_recoverable = find_row("recoverable_total")
+
+    vat_due = find_row("vat_due")
 
     # إعداد ملخص التقرير
     return [
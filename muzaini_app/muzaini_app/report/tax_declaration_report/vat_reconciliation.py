@@ -0,0 +1,197 @@
+# Copyright (c) 2026, Mohamed AbdElsabour and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+
+from muzaini_app.muzaini_app.report.tax_declaration_report.tax_declaration_report import (
+    INVOICE_VOUCHER_TYPES,
+    get_company_condition,
+    get_tax_accounts,
+)
+
+# الفروقات الأقل من هذا المبلغ تعتبر فروقات تقريب
+RECONCILIATION_TOLERANCE = 0.01
+
+# اتجاه قيد الضريبة لكل نوع فاتورة (ضريبة المبيعات دائنة وضريبة المشتريات مدينة)
+GL_TAX_SIGN = {"Sales Invoice": 1, "Purchase Invoice": -1}
+
+
+def get_reconciliation(filters):
+    """
+    مطابقة ضريبة الفواتير مع قيود الحسابات الضريبية في الأستاذ العام:
+    تحميل الطرفين في قاموسين حسب المستند ثم المقارنة في مرور واحد
+    """
+    invoice_tax = get_invoice_tax_map(filters)
+    gl_tax = get_gl_tax_map(filters, get_tax_accounts(filters))
+
+    data = []
+    for key in sorted(invoice_tax.keys() | gl_tax.keys()):
+        invoice = invoice_tax.get(key)
+        invoice_amount = flt(invoice.tax_amount) if invoice else 0
+        gl_amount = flt(gl_tax.get(key))
+        difference = flt(invoice_amount - gl_amount, 2)
+
+        if abs(difference) < RECONCILIATION_TOLERANCE:
+            continue
+
+        data.append(
+            {
+                "voucher_type": key[0],
+                "voucher_no": key[1],
+                "posting_date": invoice.posting_date if invoice else None,
+                "invoice_tax": flt(invoice_amount, 2),
+                "gl_tax": flt(gl_amount, 2),
+                "difference": difference,
+                "reason": get_mismatch_reason(invoice, key in gl_tax),
+            }
+        )
+
+    return get_reconciliation_columns(), data, get_reconciliation_summary(invoice_tax, data)
+
+
+def get_invoice_tax_map(filters):
+    """ضريبة كل فاتورة معتمدة بعملة الشركة: {(نوع المستند، رقم المستند): الفاتورة}"""
+    invoice_tax = {}
+
+    for doctype in INVOICE_VOUCHER_TYPES:
+        values = {"from_date": filters.get("from_date"), "to_date": filters.get("to_date")}
+        condition_str = get_company_condition("company", filters, values)
+        if condition_str:
+            condition_str = " AND " + condition_str
+
+        for row in frappe.db.sql(
+            """
+            SELECT name, posting_date, base_total_taxes_and_charges as tax_amount
+            FROM `tab{doctype}`
+            WHERE docstatus = 1
+                AND posting_date BETWEEN %(from_date)s AND %(to_date)s
+                {condition_str}
+        """.format(
+                doctype=doctype, condition_str=condition_str
+            ),
+            values,
+            as_dict=1,
+        ):
+            invoice_tax[(doctype, row.name)] = row
+
+    return invoice_tax
+
+
+def get_gl_tax_map(filters, tax_accounts):
+    """صافي القيود على الحسابات الضريبية لكل فاتورة: {(نوع المستند، رقم المستند): المبلغ}"""
+    if not tax_accounts:
+        return {}
+
+    values = {
+        "from_date": filters.get("from_date"),
+        "to_date": filters.get("to_date"),
+        "tax_accounts": tax_accounts,
+        "voucher_types": INVOICE_VOUCHER_TYPES,
+    }
+    condition_str = get_company_condition("company", filters, values)
+    if condition_str:
+        condition_str = " AND " + condition_str
+
+    rows = frappe.db.sql(
+        """
+        SELECT voucher_type, voucher_no, SUM(credit - debit) as amount
+        FROM `tabGL Entry`
+        WHERE is_cancelled = 0
+            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
+            AND account IN %(tax_accounts)s
+            AND voucher_type IN %(voucher_types)s
+            {condition_str}
+        GROUP BY voucher_type, voucher_no
+    """.format(
+            condition_str=condition_str
+        ),
+        values,
+    )
+
+    return {
+        (voucher_type, voucher_no): GL_TAX_SIGN[voucher_type] * flt(amount)
+        for voucher_type, voucher_no, amount in rows
+    }
+
+
+def get_mismatch_reason(invoice, has_gl_entries):
+    if not invoice:
+        return _("قيد ضريبي بدون فاتورة معتمدة في الفترة")
+
+    if not has_gl_entries:
+        return _("فاتورة بضريبة بدون قيد على الحسابات الضريبية")
+
+    return _("اختلاف مبلغ الضريبة")
+
+
+def get_reconciliation_columns():
+    return [
+        {
+            "fieldname": "voucher_type",
+            "label": _("نوع المستند"),
+            "fieldtype": "Data",
+            "width": 140,
+        },
+        {
+            "fieldname": "voucher_no",
+            "label": _("رقم المستند"),
+            "fieldtype": "Dynamic Link",
+            "options": "voucher_type",
+            "width": 180,
+        },
+        {
+            "fieldname": "posting_date",
+            "label": _("التاريخ"),
+            "fieldtype": "Date",
+            "width": 110,
+        },
+        {
+            "fieldname": "invoice_tax",
+            "label": _("ضريبة الفاتورة"),
+            "fieldtype": "Currency",
+            "width": 150,
+        },
+        {
+            "fieldname": "gl_tax",
+            "label": _("ضريبة الأستاذ العام"),
+            "fieldtype": "Currency",
+            "width": 150,
+        },
+        {
+            "fieldname": "difference",
+            "label": _("الفرق"),
+            "fieldtype": "Currency",
+            "width": 130,
+        },
+        {
+            "fieldname": "reason",
+            "label": _("السبب"),
+            "fieldtype": "Data",
+            "width": 280,
+        },
+    ]
+
+
+def get_reconciliation_summary(invoice_tax, data):
+    total_difference = flt(sum(row["difference"] for row in data), 2)
+
+    return [
+        {
+            "label": _("عدد الفواتير"),
+            "value": len(invoice_tax),
+            "indicator": "Blue",
+        },
+        {
+            "label": _("المستندات غير المطابقة"),
+            "value": len(data),
+            "indicator": "Red" if data else "Green",
+        },
+        {
+            "label": _("إجمالي الفروقات"),
+            "value": total_difference,
+            "datatype": "Currency",
+            "indicator": "Red" if total_difference else "Green",
+        },
+    ]
@@ -0,0 +1,6 @@
+import frappe
+
+
+def execute():
+    # مزامنة نقاط أرصدة الأطراف تبحث عن قيود الأستاذ العام حسب تاريخ الإنشاء
+    frappe.db.add_index("GL Entry", ["creation"], index_name="creation")
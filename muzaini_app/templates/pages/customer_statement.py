@@ -0,0 +1,124 @@
+# Copyright (c) 2026, Mohamed AbdElsabour and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import add_months, get_first_day, get_last_day, getdate, today
+
+from muzaini_app.muzaini_app.report.customer_statement_report.customer_statement_report import (
+    get_customer_ledger_entries,
+)
+
+no_cache = 1
+
+# كشوف البوابة المخزنة: لكل عميل جدول {الشركة|من|إلى: الكشف}
+PORTAL_STATEMENT_CACHE_KEY = "muzaini_portal_statement"
+
+PORTAL_STATEMENT_CACHE_EXPIRY = 6 * 60 * 60
+
+# الفترات المتاحة في البوابة: أشهر كاملة، بحد أقصى للمدة ولعمر الفترة وعدد الفترات المخزنة
+PORTAL_MAX_PERIOD_MONTHS = 12
+PORTAL_MAX_HISTORY_MONTHS = 36
+PORTAL_MAX_CACHED_PERIODS = 24
+
+
+def get_context(context):
+    if frappe.session.user == "Guest":
+        frappe.throw(_("يرجى تسجيل الدخول لعرض كشف الحساب"), frappe.PermissionError)
+
+    customer = get_portal_customer()
+    if not customer:
+        frappe.throw(_("لا يوجد عميل مرتبط بهذا المستخدم"), frappe.PermissionError)
+
+    company = frappe.defaults.get_global_default("company")
+    if frappe.form_dict.company and frappe.db.exists("Company", frappe.form_dict.company):
+        company = frappe.form_dict.company
+
+    from_date, to_date = get_portal_period(frappe.form_dict.from_date, frappe.form_dict.to_date)
+
+    context.no_cache = 1
+    context.show_sidebar = True
+    context.title = _("كشف الحساب")
+    context.customer = customer
+    context.customer_name = frappe.db.get_value("Customer", customer, "customer_name")
+    context.from_date = from_date
+    context.to_date = to_date
+    context.statement = get_cached_statement(customer, company, from_date, to_date)
+
+
+def get_portal_period(from_date=None, to_date=None):
+    """تقريب الفترة المطلوبة إلى أشهر كاملة ضمن الحدود المسموحة (حتى لا تتضخم الفترات المخزنة)"""
+    current_month_end = get_last_day(today())
+
+    try:
+        to_date = get_last_day(to_date or today())
+        from_date = get_first_day(from_date or to_date)
+    except Exception:
+        frappe.throw(_("تاريخ غير صحيح"))
+
+    to_date = min(to_date, current_month_end)
+    from_date = max(
+        from_date,
+        get_first_day(add_months(to_date, -(PORTAL_MAX_PERIOD_MONTHS - 1))),
+        get_first_day(add_months(current_month_end, -(PORTAL_MAX_HISTORY_MONTHS - 1))),
+    )
+
+    if from_date > to_date:
+        frappe.throw(_("تاريخ البداية يجب أن يكون قبل تاريخ النهاية"))
+
+    return getdate(from_date), getdate(to_date)
+
+
+def get_portal_customer():
+    """العميل المرتبط بمستخدم البوابة عن طريق جهة الاتصال"""
+    from erpnext.controllers.website_list_for_contact import get_customers_suppliers
+
+    customers, _suppliers = get_customers_suppliers("Sales Invoice", frappe.session.user)
+    return customers[0] if customers else None
+
+
+def get_cached_statement(customer, company, from_date, to_date):
+    """كشف العميل للفترة من التخزين المؤقت، ويُبنى بمنطق تقرير كشف حساب العميل عند عدم وجوده"""
+    cache = frappe.cache()
+    cache_name = get_cache_name(customer)
+    period_key = "{0}|{1}|{2}".format(company, from_date, to_date)
+
+    statement = cache.hget(cache_name, period_key)
+    if statement is None:
+        opening_balance, opening_date, data, aging = get_customer_ledger_entries(
+            frappe._dict(
+                company=company,
+                customer=customer,
+                from_date=from_date,
+                to_date=to_date,
+            )
+        )
+
+        statement = frappe._dict(
+            opening_balance=opening_balance,
+            opening_date=opening_date,
+            data=data,
+            aging=aging.buckets if aging else {},
+            open_invoices=aging.open_invoices if aging else [],
+        )
+
+        if len(cache.hkeys(cache_name)) >= PORTAL_MAX_CACHED_PERIODS:
+            cache.delete_value(cache_name)
+
+        cache.hset(cache_name, period_key, statement)
+        cache.expire(cache.make_key(cache_name), PORTAL_STATEMENT_CACHE_EXPIRY)
+
+    return statement
+
+
+def get_cache_name(customer):
+    return "{0}:{1}".format(PORTAL_STATEMENT_CACHE_KEY, customer)
+
+
+def clear_portal_statement_cache(doc, method=None):
+    """
+    أي قيد جديد للعميل يغير كشوفه: مسح كل الفترات المخزنة له بعد اعتماد المعاملة،
+    حتى لا يعيد طلب متزامن تخزين بيانات ما قبل الاعتماد
+    """
+    if doc.party_type == "Customer" and doc.party:
+        frappe.db.after_commit.add(lambda: frappe.cache().delete_value(get_cache_name(doc.party)))